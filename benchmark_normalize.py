@@ -0,0 +1,78 @@
+# This script measures the per-row cost of the name cleaning in normalize.py
+# on a chart history of a million rows (the scraped charts repeated), and
+# compares it with the row-by-row DataFrame.apply versions the scrapers used
+# before, copied unchanged. It also counts the rows where the results
+# differ: the vectorized Netease artist cleaning drops the empty names the
+# old version left between commas ("A, , B").
+#
+# Usage: python benchmark_normalize.py [rows]
+
+import re
+import sys
+import time
+
+import pandas as pd
+
+from normalize import (clean_billboard_artists, clean_netease_artists, clean_netease_tracks,
+                       normalize_key, normalize_keys)
+
+
+# The row-by-row versions, as they were in billboard.py and netease.py
+def sanitize_billboard_artist(artist_name):
+    artist_name = artist_name.replace(' & ', ', ')
+    artist_name = artist_name.replace(' With ', ', ')
+    artist_name = artist_name.replace(' Featuring ', ', ')
+    artist_name = artist_name.replace(' X ', ', ')
+    artist_name = artist_name.replace(' x ', ', ')
+    return artist_name.strip()
+
+
+def sanitize_netease_track(track_name):
+    track_name = re.sub(r'[^\x00-\x7F]+', '', track_name)
+    track_name = re.sub(r'¬†', ' ', track_name)
+    track_name = re.sub(r'\(.*?\)', '', track_name)
+    track_name = re.sub(r'\s+', ' ', track_name)
+    track_name = re.sub(r'\-$', '', track_name)
+    return track_name.strip()
+
+
+def sanitize_netease_artist(artist_name):
+    artist_name = artist_name.replace('/', ', ')
+    artist_name = re.sub(r'[^\x00-\x7F]+', '', artist_name)
+    return ', '.join(name.strip() for name in artist_name.split(','))
+
+
+def chart_history(rows):
+    # Names from both scraped charts, repeated up to `rows` rows
+    names = pd.concat([pd.read_csv(path)[column].dropna().astype(str)
+                       for path in ['billboard_year_end_hot_100.csv', 'netease_music_toplist.csv']
+                       for column in ['Track_name', 'Artist_name']], ignore_index=True)
+    repeats = rows // len(names) + 1
+    return pd.Series(list(names) * repeats).iloc[:rows].reset_index(drop=True)
+
+
+def timed(function, names):
+    start = time.perf_counter()
+    result = function(names)
+    return result, time.perf_counter() - start
+
+
+benchmarks = [
+    ('lookup key', lambda names: names.apply(normalize_key), normalize_keys),
+    ('billboard artists', lambda names: names.apply(sanitize_billboard_artist), clean_billboard_artists),
+    ('netease tracks', lambda names: names.apply(sanitize_netease_track), clean_netease_tracks),
+    ('netease artists', lambda names: names.apply(sanitize_netease_artist), clean_netease_artists),
+]
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    names = chart_history(rows)
+    print(f"{rows} rows")
+    print(f"{'':20} {'apply (us/row)':>15} {'vectorized (us/row)':>20} {'speed-up':>9}")
+    for name, row_wise, vectorized in benchmarks:
+        expected, row_seconds = timed(row_wise, names)
+        result, vector_seconds = timed(vectorized, names)
+        differ = (expected.astype(str) != result.astype(str)).sum()
+        print(f"{name:20} {row_seconds / rows * 1e6:15.3f} {vector_seconds / rows * 1e6:20.3f} "
+              f"{row_seconds / vector_seconds:8.1f}x{f'  ({differ} rows differ)' if differ else ''}")
@@ -0,0 +1,430 @@
+# This script benchmarks every stage of the pipeline (main.py) offline, so
+# throughput can be measured and regressions caught on any machine without
+# Spotify credentials. A local stand-in server answers the token, search,
+# tracks and audio-features endpoints from a synthetic catalog, with a
+# configurable response latency, share of server errors and share of
+# rate-limited (429) responses. The server runs in a process of its own, so
+# its request handling does not compete with the pipeline for the
+# benchmark process's interpreter; its request counts are fetched over HTTP. Synthetic charts are written for two markets
+# and the stages run one after the other on a scratch database.
+#
+# For each stage it reports the songs processed per second, the API calls
+# made per song (retries included) and the rows written to SQLite per second.
+# --output saves the results as JSON; --baseline compares songs/second with
+# a saved run and exits with status 1 if a stage got slower than --tolerance
+# allows.
+#
+# Usage:
+#   python benchmark_pipeline.py
+#   python benchmark_pipeline.py --songs 5000 --latency 0.05 --throttle-rate 0.05
+#   python benchmark_pipeline.py --weeks 4 --churn 0.1      weekly snapshot ingest
+#   python benchmark_pipeline.py --output baseline.json
+#   python benchmark_pipeline.py --baseline baseline.json --tolerance 0.2
+
+import argparse
+import json
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from urllib.request import urlopen
+
+import pandas as pd
+
+import main
+import spotify_client
+from spotify_client import SpotifyClient
+
+
+# The synthetic catalog: song i is "Song 000i" by "Artist 000j", and every
+# detail the API returns about it is derived from i
+track_title_pattern = re.compile(r'^Song (\d+)$')
+track_query_pattern = re.compile(r'track:(.+?)(?: artist:|$)')
+release_date_precisions = ['day', 'month', 'year']
+
+
+def track_title(i):
+    return f"Song {i:06d}"
+
+
+def artist_name(i, artist_count):
+    return f"Artist {i % artist_count:05d}"
+
+
+def track_id(i):
+    return f"t{i:021d}"
+
+
+def artist_id(name):
+    return f"a{int(name.split()[-1]):021d}"
+
+
+def track_number(spotify_id):
+    return int(spotify_id[1:]) if spotify_id.startswith('t') and spotify_id[1:].isdigit() else None
+
+
+def track_item(i, artist_count):
+    artist = artist_name(i, artist_count)
+    return {"id": track_id(i), "name": track_title(i),
+            "artists": [{"id": artist_id(artist), "name": artist}]}
+
+
+def track_details(i):
+    precision = release_date_precisions[i % 3]
+    release_date = f"{1960 + i % 64}-{1 + i % 12:02d}-{1 + i % 28:02d}"[:{'day': 10, 'month': 7, 'year': 4}[precision]]
+    return {"id": track_id(i), "popularity": i * 37 % 101,
+            "album": {"id": f"b{i:021d}", "release_date": release_date, "release_date_precision": precision}}
+
+
+def audio_features(i):
+    features = {column: (i * (n + 7) % 1000) / 1000 for n, column in enumerate(main.audio_feature_columns)}
+    features['loudness'] = -features['loudness'] * 30
+    features['id'] = track_id(i)
+    return features
+
+
+class StubSpotifyHandler(BaseHTTPRequestHandler):
+    # Keep-alive, as with the real API
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.server.count('token')
+        self.send_json(200, {"access_token": "benchmark-token", "token_type": "Bearer", "expires_in": 3600})
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        if url.path == counts_path:
+            # [endpoint, status, requests] since the last call, not counted itself
+            return self.send_json(200, [[endpoint, status, count]
+                                        for (endpoint, status), count in server.take_counts().items()])
+        path = url.path[len('/v1/'):] if url.path.startswith('/v1/') else url.path
+        endpoint = path.split('/')[0]
+        params = {name: values[0] for name, values in parse_qs(url.query).items()}
+
+        if server.latency:
+            time.sleep(server.latency)
+        outcome = server.draw()
+        if outcome == 'throttled':
+            server.count(endpoint, 429)
+            return self.send_json(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                                  {'Retry-After': str(server.retry_after)})
+        if outcome == 'error':
+            server.count(endpoint, 500)
+            return self.send_json(500, {"error": {"status": 500, "message": "Server error"}})
+
+        server.count(endpoint, 200)
+        if endpoint == 'search':
+            return self.send_json(200, self.search(params))
+        if endpoint == 'tracks':
+            return self.lookup(path, params, track_details, 'tracks')
+        if endpoint == 'audio-features':
+            return self.lookup(path, params, audio_features, 'audio_features')
+        self.send_json(404, {"error": {"status": 404, "message": "Not found"}})
+
+    def search(self, params):
+        query = params.get('q', '')
+        if params.get('type') == 'artist':
+            return {"artists": {"items": [{"id": artist_id(query), "name": query}]
+                                if query.startswith('Artist ') else []}}
+        match = track_query_pattern.search(query)
+        title = track_title_pattern.match(match.group(1).strip()) if match else None
+        items = [track_item(int(title.group(1)), self.server.artist_count)] if title else []
+        return {"tracks": {"items": items}}
+
+    def lookup(self, path, params, details, key):
+        # Several ids in ?ids=..., or one in the path; unknown ids are null
+        if '/' in path:
+            i = track_number(path.split('/', 1)[1])
+            if i is None:
+                return self.send_json(404, {"error": {"status": 404, "message": "Not found"}})
+            return self.send_json(200, details(i))
+        numbers = [track_number(spotify_id) for spotify_id in params.get('ids', '').split(',')]
+        return self.send_json(200, {key: [details(i) if i is not None else None for i in numbers]})
+
+
+counts_path = '/benchmark/counts'
+
+
+class StubSpotifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, artist_count, latency=0.0, error_rate=0.0, throttle_rate=0.0, retry_after=0.05, seed=0):
+        super().__init__(('127.0.0.1', 0), StubSpotifyHandler)
+        self.artist_count = artist_count
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def draw(self):
+        # 'throttled', 'error' or 'ok', at the configured rates
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.throttle_rate:
+            return 'throttled'
+        if roll < self.throttle_rate + self.error_rate:
+            return 'error'
+        return 'ok'
+
+    def count(self, endpoint, status=200):
+        with self.lock:
+            self.counts[(endpoint, status)] += 1
+
+    def take_counts(self):
+        with self.lock:
+            counts, self.counts = self.counts, Counter()
+        return counts
+
+
+def serve_stub(args):
+    # The body of the server process: print the port, then serve until killed
+    server = StubSpotifyServer(catalog_artist_count(args.songs), args.latency, args.error_rate, args.throttle_rate,
+                               args.retry_after, args.seed)
+    print(server.server_address[1], flush=True)
+    server.serve_forever()
+
+
+class StubSpotifyProcess:
+    # The stand-in server, started as `benchmark_pipeline.py --serve` with the
+    # same settings
+    def __init__(self, args):
+        command = [sys.executable, os.path.abspath(__file__), '--serve', '--songs', str(args.songs),
+                   '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+                   '--throttle-rate', str(args.throttle_rate), '--retry-after', str(args.retry_after),
+                   '--seed', str(args.seed)]
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        port = self.process.stdout.readline().strip()
+        if not port:
+            self.process.wait()
+            raise RuntimeError(f"The stub server exited with status {self.process.returncode}")
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    def take_counts(self):
+        # Requests per (endpoint, status) since the last call
+        with urlopen(self.base_url + counts_path, timeout=30) as response:
+            return Counter({(endpoint, status): count for endpoint, status, count in json.load(response)})
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+# Rows written to SQLite: every connection reports its total_changes when it
+# is closed (the pipeline closes each connection it opens)
+class CountingConnection(sqlite3.Connection):
+    rows_written = 0
+    lock = threading.Lock()
+
+    def close(self):
+        with CountingConnection.lock:
+            CountingConnection.rows_written += self.total_changes
+        super().close()
+
+
+def count_sqlite_writes():
+    connect = sqlite3.connect
+
+    def counting_connect(*args, **kwargs):
+        kwargs.setdefault('factory', CountingConnection)
+        return connect(*args, **kwargs)
+    sqlite3.connect = counting_connect
+
+
+def write_charts(chart_dir, songs, overlap, weeks, churn, artist_count, seed):
+    # The US chart holds songs 0..songs-1. The China chart shares `overlap`
+    # of them and, with several weeks, replaces `churn` of its songs every
+    # week (dated rows, so the pipeline ingests them as snapshots).
+    rng = random.Random(seed)
+    us_chart = pd.DataFrame({'Track_name': [track_title(i) for i in range(songs)],
+                             'Artist_name': [artist_name(i, artist_count) for i in range(songs)]})
+    shared = int(songs * overlap)
+    china_songs = list(range(shared)) + list(range(songs, 2 * songs - shared))
+    next_song = 2 * songs - shared
+    editions = []
+    first_week = date(2024, 1, 4)
+    for week in range(weeks):
+        if week:
+            for position in rng.sample(range(len(china_songs)), int(len(china_songs) * churn)):
+                china_songs[position] = next_song
+                next_song += 1
+        edition = pd.DataFrame({'Rank': range(1, len(china_songs) + 1),
+                                'Track_name': [track_title(i) for i in china_songs],
+                                'Artist_name': [artist_name(i, artist_count) for i in china_songs]})
+        if weeks > 1:
+            edition.insert(0, 'Week', (first_week + timedelta(weeks=week)).isoformat())
+        editions.append(edition)
+
+    chart_files = {'US': os.path.join(chart_dir, 'us_chart.csv'), 'China': os.path.join(chart_dir, 'china_chart.csv')}
+    us_chart.to_csv(chart_files['US'], index=False)
+    pd.concat(editions, ignore_index=True).to_csv(chart_files['China'], index=False)
+    return chart_files
+
+
+# Songs each stage works on, counted before it runs
+stage_work_queries = {
+    'resolve_charts': None,   # the songs found, counted after the stage
+    'track_info': "SELECT COUNT(*) FROM Songs WHERE album_id IS NULL",
+    'audio_features': "SELECT COUNT(*) FROM Songs WHERE danceability IS NULL",
+    'aggregates': "SELECT COUNT(*) FROM Aggregate_Dirty",
+    'export': "SELECT COUNT(*) FROM Songs",
+}
+
+
+def scalar(db_file_path, query):
+    conn = sqlite3.connect(db_file_path)
+    try:
+        return conn.execute(query).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def catalog_artist_count(songs):
+    return max(1, songs // 3)
+
+
+def run_benchmark(args):
+    count_sqlite_writes()
+    artist_count = catalog_artist_count(args.songs)
+    server = StubSpotifyProcess(args)
+    spotify_client.TOKEN_URL = f"{server.base_url}/api/token"
+    spotify_client.API_BASE_URL = f"{server.base_url}/v1"
+
+    try:
+        return benchmark_stages(args, server, artist_count)
+    finally:
+        server.stop()
+
+
+def benchmark_stages(args, server, artist_count):
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        chart_files = write_charts(scratch_dir, args.songs, args.overlap, args.weeks, args.churn,
+                                   artist_count, args.seed)
+        main.chart_sources = {market: (chart, chart_files[market])
+                              for market, (chart, _) in main.chart_sources.items()}
+        db_file_path = os.path.join(scratch_dir, 'benchmark.db')
+        export_file_path = os.path.join(scratch_dir, 'market_analysis.parquet')
+        main.database.market_analysis_file_path = export_file_path
+        main.create_schema(db_file_path)
+
+        # No response cache: every lookup goes to the server
+        credentials = [(f'benchmark-{n}', 'secret') for n in range(args.credentials)]
+        client = SpotifyClient(credentials, rate_per_credential=args.rate)
+        server.take_counts()
+
+        for stage, run_stage, _ in main.pipeline_stages:
+            work_query = stage_work_queries.get(stage)
+            songs = scalar(db_file_path, work_query) if work_query else None
+            CountingConnection.rows_written = 0
+            start = time.perf_counter()
+            run_stage(db_file_path, client)
+            seconds = time.perf_counter() - start
+            if songs is None:
+                songs = scalar(db_file_path, "SELECT COUNT(*) FROM Songs")
+
+            counts = server.take_counts()
+            api_calls = sum(count for (endpoint, _), count in counts.items() if endpoint != 'token')
+            results.append({
+                'stage': stage,
+                'seconds': seconds,
+                'songs': songs,
+                'songs_per_second': songs / seconds if seconds else 0.0,
+                'api_calls': api_calls,
+                'api_calls_per_song': api_calls / songs if songs else 0.0,
+                'throttled': sum(count for (_, status), count in counts.items() if status == 429),
+                'errors': sum(count for (_, status), count in counts.items() if status >= 500),
+                'rows_written': CountingConnection.rows_written,
+                'rows_per_second': CountingConnection.rows_written / seconds if seconds else 0.0,
+            })
+        client.close()
+    return results
+
+
+def print_results(results):
+    print(f"{'stage':16} {'seconds':>8} {'songs':>7} {'songs/s':>9} {'API calls':>10} {'calls/song':>11} "
+          f"{'429s':>6} {'5xx':>5} {'rows written':>13} {'rows/s':>10}")
+    for result in results:
+        print(f"{result['stage']:16} {result['seconds']:8.2f} {result['songs']:7d} {result['songs_per_second']:9.1f} "
+              f"{result['api_calls']:10d} {result['api_calls_per_song']:11.2f} {result['throttled']:6d} "
+              f"{result['errors']:5d} {result['rows_written']:13d} {result['rows_per_second']:10.0f}")
+
+
+def compare_with_baseline(results, baseline_file_path, tolerance):
+    # Stages whose songs/second fell more than `tolerance` below the baseline
+    with open(baseline_file_path) as baseline_file:
+        baseline = {result['stage']: result for result in json.load(baseline_file)['results']}
+    regressions = []
+    for result in results:
+        before = baseline.get(result['stage'])
+        if before and before['songs_per_second'] and \
+                result['songs_per_second'] < before['songs_per_second'] * (1 - tolerance):
+            regressions.append((result['stage'], before['songs_per_second'], result['songs_per_second']))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the pipeline stages against a local Spotify stand-in.')
+    parser.add_argument('--songs', type=int, default=1000, help='songs on each market chart')
+    parser.add_argument('--overlap', type=float, default=0.2, help='share of China songs also on the US chart')
+    parser.add_argument('--weeks', type=int, default=1, help='weekly editions of the China chart')
+    parser.add_argument('--churn', type=float, default=0.1, help='share of the China chart replaced every week')
+    parser.add_argument('--latency', type=float, default=0.01, help='seconds the server takes per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='share of requests answered with 429')
+    parser.add_argument('--retry-after', type=float, default=0.05, help='Retry-After of 429 responses, in seconds')
+    parser.add_argument('--credentials', type=int, default=1, help='client-id/secret pairs the client uses')
+    parser.add_argument('--rate', type=float, default=1000, help='requests per second allowed per credential')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed songs/second drop against the baseline')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)  # the stub server process
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_stub(args)
+        sys.exit(0)
+
+    results = run_benchmark(args)
+    print()
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump({'settings': vars(args), 'results': results}, output_file, indent=2)
+        print(f"Results saved to {args.output}")
+
+    if args.baseline:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        for stage, before, after in regressions:
+            print(f"{stage}: {after:.1f} songs/s, down from {before:.1f} songs/s")
+        if regressions:
+            sys.exit(1)
+        print(f"No stage is more than {args.tolerance:.0%} slower than {args.baseline}.")
@@ -1,66 +1,167 @@
+# This script scrapes Billboard Hot 100 charts: the year-end chart of any
+# number of years, or the weekly charts of given dates. Pages are fetched
+# concurrently by a bounded pool of threads sharing one keep-alive session,
+# and each page is parsed in a single pass with lxml/XPath. Every row keeps
+# the chart year (and week for weekly charts) and its rank.
+#
+# parse_chart() only needs the page HTML, so saved pages can be parsed
+# without network access: python billboard.py --html page1.html page2.html
+#
+# Usage:
+#   python billboard.py                          current year-end chart
+#   python billboard.py --years 1990-2023        year-end charts of many years
+#   python billboard.py --weeks 2023-01-07 2023-01-14
+#   python billboard.py --html saved_page.html --years 2023
+
+import argparse
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-from bs4 import BeautifulSoup
 import pandas as pd
+from lxml import etree
+
+from normalize import add_key_column, clean_billboard_artists
 
 
 # The URL of the Billboard Year-End Hot 100 songs chart
 url = 'https://www.billboard.com/charts/year-end/hot-100-songs/'
+year_end_url = 'https://www.billboard.com/charts/year-end/{year}/hot-100-songs/'
+weekly_url = 'https://www.billboard.com/charts/hot-100/{week}/'
 
-response = requests.get(url)
-if response.status_code == 200:
-    soup = BeautifulSoup(response.content, 'html.parser')
-
-    data = []
-    # Find all song entry containers
-    for entry in soup.find_all(attrs={'class': 'o-chart-results-list-row-container'}):
-        # Extract the track name and artist name
-        track_name = entry.find('h3', class_='c-title').get_text(strip=True)
-        artist_name = entry.find('h3', class_='c-title').find_next('span', class_='c-label').get_text(strip=True)
-        
-        data.append({
-            'Track_name': track_name,
-            'Artist_name': artist_name
-        })
-    # Convert the list of dictionaries to a DataFrame
-    df = pd.DataFrame(data)
-    # Save the DataFrame to a CSV file
-    csv_file_path = 'billboard_year_end_hot_100.csv' # relative path 
-    df.to_csv(csv_file_path, index=False)
-    print(f'Data saved to {csv_file_path}')
-    
-else:
-    print(f'Failed to retrieve data: Status code {response.status_code}')
-    
-
-#Clean data to normalize artist_name
-csv_file_path = 'billboard_year_end_hot_100.csv'
-df = pd.read_csv(csv_file_path)
-
-# Define the sanitization function
-def sanitize_artist_names(artist_name):
-    # Replace various conjunctions and separators with a comma
-    artist_name = artist_name.replace(' & ', ', ')
-    artist_name = artist_name.replace(' With ', ', ')
-    artist_name = artist_name.replace(' Featuring ', ', ')
-    artist_name = artist_name.replace(' X ', ', ')
-    artist_name = artist_name.replace(' x ', ', ')
-    # Strip any leading/trailing whitespace that may have been introduced
-    artist_name = artist_name.strip()
-    return artist_name
-
-# Apply the sanitization function to the 'Artist_name' column
-df['Artist_name'] = df['Artist_name'].apply(sanitize_artist_names)
+csv_file_path = 'billboard_year_end_hot_100.csv'  # relative path
 
-# Save the cleaned DataFrame to the same CSV file, effectively cleaning it "in place"
-df.to_csv(csv_file_path, index=False)
+# Song entry containers, and inside each one the title, which is followed by
+# the artist label; the rank is the label holding only a number
+row_xpath = etree.XPath(
+    "//*[contains(concat(' ', normalize-space(@class), ' '), ' o-chart-results-list-row-container ')]")
+title_xpath = etree.XPath(".//h3[contains(concat(' ', normalize-space(@class), ' '), ' c-title ')][1]")
+artist_xpath = etree.XPath(
+    "following-sibling::span[contains(concat(' ', normalize-space(@class), ' '), ' c-label ')][1]")
+next_label_xpath = etree.XPath(
+    "following::span[contains(concat(' ', normalize-space(@class), ' '), ' c-label ')][1]")
+label_xpath = etree.XPath(".//span[contains(concat(' ', normalize-space(@class), ' '), ' c-label ')]")
 
 
+def element_text(element):
+    return ' '.join(''.join(element.itertext()).split())
 
 
-
-
-
-
-    
-
-
+def parse_chart(page_html, year=None, week=None):
+    # One dict per chart entry: Year, Week, Rank, Track_name, Artist_name
+    html = etree.HTML(page_html)
+    if html is None:
+        return []
+    data = []
+    for position, entry in enumerate(row_xpath(html), 1):
+        titles = title_xpath(entry)
+        if not titles:
+            continue
+        # The artist label normally sits right next to the title
+        artists = artist_xpath(titles[0]) or next_label_xpath(titles[0])
+        ranks = [element_text(label) for label in label_xpath(entry)]
+        ranks = [int(rank) for rank in ranks if rank.isdigit()]
+        data.append({
+            'Year': year,
+            'Week': week,
+            'Rank': ranks[0] if ranks else position,
+            'Track_name': element_text(titles[0]),
+            'Artist_name': element_text(artists[0]) if artists else '',
+        })
+    return data
+
+
+def fetch_page(session, page_url):
+    try:
+        response = session.get(page_url, timeout=30)
+    except requests.RequestException as error:
+        print(f'Failed to retrieve {page_url}: {error}')
+        return None
+    if response.status_code != 200:
+        print(f'Failed to retrieve {page_url}: Status code {response.status_code}')
+        return None
+    return response.content
+
+
+def fetch_pages(page_urls, max_workers=8):
+    # {url: page content or None}, fetched by at most max_workers threads
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=max_workers)
+    session.mount('https://', adapter)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pages = dict(zip(page_urls, executor.map(lambda page_url: fetch_page(session, page_url), page_urls)))
+    session.close()
+    return pages
+
+
+def chart_pages(years=None, weeks=None):
+    # (url, year, week) of every chart to scrape
+    if weeks:
+        return [(weekly_url.format(week=week), int(week[:4]), week) for week in weeks]
+    if years:
+        return [(year_end_url.format(year=year), year, None) for year in years]
+    return [(url, None, None)]
+
+
+def charts_to_dataframe(rows):
+    df = pd.DataFrame(rows, columns=['Year', 'Week', 'Rank', 'Track_name', 'Artist_name'])
+    # Year and week are only known when the chart was chosen by them
+    df = df.drop(columns=[column for column in ['Year', 'Week'] if df[column].isna().all()])
+    # Replace conjunctions and separators with a comma, and store the lookup
+    # key of each track next to it
+    df['Artist_name'] = clean_billboard_artists(df['Artist_name'])
+    return add_key_column(df)
+
+
+def scrape_charts(years=None, weeks=None, max_workers=8):
+    pages = chart_pages(years, weeks)
+    contents = fetch_pages([page_url for page_url, _, _ in pages], max_workers)
+    rows = []
+    for page_url, year, week in pages:
+        if contents[page_url] is not None:
+            rows += parse_chart(contents[page_url], year, week)
+    return charts_to_dataframe(rows)
+
+
+def parse_saved_pages(paths, years=None, weeks=None):
+    # Saved pages are matched with years / weeks in order, if given
+    labels = weeks or years or []
+    rows = []
+    for i, path in enumerate(paths):
+        label = labels[i] if i < len(labels) else None
+        with open(path, 'rb') as page:
+            if weeks:
+                rows += parse_chart(page.read(), int(label[:4]) if label else None, label)
+            else:
+                rows += parse_chart(page.read(), label)
+    return charts_to_dataframe(rows)
+
+
+def parse_year_range(text):
+    # "2020" or "1990-2023"
+    first, _, last = text.partition('-')
+    return list(range(int(first), int(last or first) + 1))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scrape Billboard Hot 100 charts.')
+    parser.add_argument('--years', type=parse_year_range, help='year-end charts, e.g. 2023 or 1990-2023')
+    parser.add_argument('--weeks', nargs='+', help='weekly charts by date, e.g. 2023-01-07')
+    parser.add_argument('--html', nargs='+', help='parse saved pages instead of downloading')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent downloads')
+    parser.add_argument('--output', default=csv_file_path)
+    args = parser.parse_args()
+
+    if args.html:
+        df = parse_saved_pages(args.html, args.years, args.weeks)
+    else:
+        df = scrape_charts(args.years, args.weeks, args.workers)
+
+    # Every page failed or had no entries: keep the previous scrape
+    if df.empty:
+        print(f'No chart entries found, {args.output} was not changed')
+        sys.exit(1)
+
+    # Save the cleaned DataFrame to a CSV file
+    df.to_csv(args.output, index=False)
+    print(f'Data saved to {args.output} ({len(df)} rows)')
@@ -0,0 +1,138 @@
+# This script guards the database access paths. It runs EXPLAIN QUERY PLAN on
+# every query registered by the pipeline (main.py, name_index.py) and the
+# dashboard (database.py, see register_query) against a scratch copy of the
+# project database with the managed indexes applied, and exits with status 1
+# if any query scans a table or a whole index that is not on the allowlists
+# below.
+#
+# Usage: python check_query_plans.py [path/to/project_database.db]
+
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+import database
+import main
+
+
+# Tables, aliases and indexes that may be scanned in any query, with the reason
+allowed_full_scans = {
+    # The staging table (aliased "st" in the loader queries) holds one chart
+    # chunk and is read once in full by design
+    'market_staging': 'staging table', 'st': 'staging table',
+    # The queue of songs whose aggregates changed (aliased "d")
+    'Aggregate_Dirty': 'queue of changed songs', 'd': 'queue of changed songs',
+    # Partial indexes that only hold the songs still missing data
+    'idx_songs_pending_track_info': 'pending songs only',
+    'idx_songs_pending_audio_features': 'pending songs only',
+    'idx_songs_pending_release_dates': 'pending songs only',
+    # A market's songs and their features, materialized by the dashboard's
+    # base table queries
+    'm': "a market's songs", 'mf': "a market's songs",
+    # Catalog tables: a few rows per table
+    'sqlite_master': 'schema catalog',
+    'pragma_table_info': 'schema catalog', 'pragma_index_list': 'schema catalog', 'il': 'schema catalog',
+    'pragma_index_info': 'schema catalog', 'ii': 'schema catalog',
+}
+
+# Queries that are known to read whole tables, with the reason
+known_full_scans = {
+    'pipeline: charted songs': 'seeds the track aliases once',
+    'pipeline: all artists': 'seeds the artist aliases once',
+    'pipeline: any alias': 'stops at the first row',
+    'pipeline: queue charted songs': 'queues every song once, when the aggregates are first built',
+    'pipeline: export all markets': 'the export holds every charted song',
+    'pipeline: watermark SELECT COUNT(*) FROM Songs': 'counts the songs',
+    'dashboard: markets': 'one row per market',
+    'pipeline: count Songs rows': 'counts the rows once per pipeline run',
+    'pipeline: count Artists rows': 'counts the rows once per pipeline run',
+    'pipeline: count Chart_Entries rows': 'counts the rows once per pipeline run',
+    'dashboard: markets from base tables': 'only until the aggregates are built',
+}
+
+
+# The per-market tables of databases from before Chart_Entries
+legacy_market_table = """
+    CREATE TABLE IF NOT EXISTS {table} (
+        entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        song_id TEXT NOT NULL,
+        artist_id TEXT NOT NULL
+    )
+"""
+
+
+def known_full_scan(name):
+    # The reason a query may scan, or None. The first explorer page has no
+    # key to start from, so it walks its index from one end, but stops
+    # after one page (LIMIT).
+    if name.startswith('dashboard: explore ') and name.endswith(', first page'):
+        return 'stops after one page'
+    # The per-market tables have no indexes and are read in full
+    if name.endswith(' from legacy tables'):
+        return 'only until the pipeline migrates the database'
+    return known_full_scans.get(name)
+
+
+def collect_queries(conn):
+    # (name, sql, parameters) of every registered query, and of the
+    # explorer pages: the first page and a later one of every sort order
+    queries = [(name, query, params) for name, (query, params) in database.registered_queries.items()]
+    for table_name in database.explorer_tables:
+        columns = conn.execute(database.table_columns_query, (table_name,)).fetchall()
+        index_columns = conn.execute(database.index_columns_query, (table_name,)).fetchall()
+        for column, key_columns in database.explorer_sort_keys(columns, index_columns).items():
+            for descending in [False, True]:
+                name = f"dashboard: explore {table_name} by {column}{' descending' if descending else ''}"
+                after = ('x',) * len(key_columns) + (1,)
+                queries += [
+                    (f'{name}, first page',
+                     *database.explorer_page_query(table_name, [columns[0][0]], key_columns, descending)),
+                    (f'{name}, next page',
+                     *database.explorer_page_query(table_name, [columns[0][0]], key_columns, descending, after)),
+                ]
+    return queries
+
+
+def check_query_plans(db_file_path):
+    # Work on a copy so that checking never modifies the real database
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        scratch_db = os.path.join(scratch_dir, 'plans.db')
+        if os.path.exists(db_file_path):
+            shutil.copy(db_file_path, scratch_db)
+        main.create_schema(scratch_db)
+
+        conn = sqlite3.connect(scratch_db)
+        conn.execute(main.market_staging_table)
+        conn.execute(database.row_counts_table)
+        # The migration dropped them, or the database never had them
+        for table in database.legacy_market_tables:
+            conn.execute(legacy_market_table.format(table=table))
+        failures = []
+        for name, query, params in collect_queries(conn):
+            scans = database.full_table_scans(conn, query, params, allowed_full_scans)
+            reason = known_full_scan(name) if scans else None
+            if not scans:
+                status = 'ok'
+            elif reason:
+                status = 'known'
+            else:
+                failures.append((name, scans))
+                status = 'FULL SCAN'
+            print(f"{status:9} {name}" + (f" ({reason})" if reason else ''))
+            for detail in database.query_plan(conn, query, params):
+                print(f"          {detail}")
+        conn.close()
+    return failures
+
+
+if __name__ == "__main__":
+    db_file_path = sys.argv[1] if len(sys.argv) > 1 else 'project_database.db'
+    failures = check_query_plans(db_file_path)
+    if failures:
+        print(f"\n{len(failures)} queries regressed to a full table scan:")
+        for name, scans in failures:
+            print(f"  {name}: {', '.join(scans)}")
+        sys.exit(1)
+    print("\nAll query plans use indexes.")
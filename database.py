@@ -0,0 +1,511 @@
+# This module holds what the pipeline (main.py) and the dashboard (my_app.py)
+# share about the project database: where it lives, how connections to it
+# are configured, the secondary indexes that serve their lookups and joins,
+# the SQL issued by the dashboard, the market analysis export the dashboard
+# plots from, and helpers to inspect query plans with EXPLAIN QUERY PLAN
+# (used by check_query_plans.py), and the registry of the queries they check.
+
+import os
+import re
+import sqlite3
+from urllib.parse import quote
+
+import pandas as pd
+
+from normalize import release_date_details
+
+
+project_dir = os.path.dirname(os.path.abspath(__file__))
+
+# The project database sits next to the code unless PROJECT_DB says otherwise
+db_file_path = os.getenv("PROJECT_DB", os.path.join(project_dir, 'project_database.db'))
+
+# The pipeline is the only writer. WAL lets the dashboard keep reading while
+# it writes, and synchronous=NORMAL is safe in WAL mode while avoiding an
+# fsync on every commit.
+writer_pragmas = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'temp_store': 'MEMORY',
+    'cache_size': -64000,        # 64 MB page cache (negative values are KiB)
+    'mmap_size': 268435456,      # 256 MB memory-mapped I/O
+}
+
+reader_pragmas = {
+    'cache_size': -16000,
+    'mmap_size': 268435456,
+}
+
+
+def connect(path=None, readonly=False, check_same_thread=True):
+    # Open the project database with the settings for a writer (the pipeline)
+    # or a read-only reader (the dashboard)
+    path = path or db_file_path
+    if readonly:
+        uri = f"file:{quote(os.path.abspath(path))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+        pragmas = reader_pragmas
+    else:
+        conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+        pragmas = writer_pragmas
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    return conn
+
+
+# Every query the pipeline and the dashboard issue is registered here by
+# name, with sample parameters, when its module is imported.
+# check_query_plans.py explains the registered SQL, so it checks exactly
+# what the modules run rather than a copy of it.
+registered_queries = {}
+
+
+def register_query(name, query, sample_params=()):
+    registered_queries[name] = (query, tuple(sample_params))
+    return query
+
+
+# Secondary indexes, by name. Each one backs a specific access path:
+index_definitions = {
+    # The database explorer sorts songs and artists by name (see
+    # explorer_sort_keys), and counting their rows reads these small indexes
+    'idx_songs_track_name': 'CREATE INDEX IF NOT EXISTS idx_songs_track_name ON Songs (track_name)',
+    'idx_artists_artist_name': 'CREATE INDEX IF NOT EXISTS idx_artists_artist_name ON Artists (artist_name)',
+    # Enrichment stages only read the songs that are still missing data;
+    # partial indexes keep those lookups small as the catalog grows
+    'idx_songs_pending_track_info':
+        'CREATE INDEX IF NOT EXISTS idx_songs_pending_track_info ON Songs (song_id) WHERE album_id IS NULL',
+    'idx_songs_pending_audio_features':
+        'CREATE INDEX IF NOT EXISTS idx_songs_pending_audio_features ON Songs (song_id) WHERE danceability IS NULL',
+    'idx_songs_pending_release_dates':
+        'CREATE INDEX IF NOT EXISTS idx_songs_pending_release_dates ON Songs (song_id) '
+        'WHERE release_date IS NOT NULL AND release_year IS NULL',
+    # Chart entries (the table's unique key, market first, serves per-market
+    # and per-edition reads): a chart edition in rank order, and every market
+    # of a song, which drives the aggregates and the export; both cover the
+    # song and artist ids
+    'idx_Chart_Entries_rank':
+        'CREATE INDEX IF NOT EXISTS idx_Chart_Entries_rank '
+        'ON Chart_Entries (market, chart, chart_date, rank, song_id, artist_id)',
+    'idx_Chart_Entries_song':
+        'CREATE INDEX IF NOT EXISTS idx_Chart_Entries_song ON Chart_Entries (song_id, market, artist_id)',
+}
+
+
+def ensure_indexes(cursor):
+    for statement in index_definitions.values():
+        cursor.execute(statement)
+
+
+# Per-market aggregates behind the dashboard charts. The pipeline keeps them
+# up to date incrementally (see refresh_market_aggregates in main.py):
+# triggers record every song whose chart entries or chart columns change in
+# Aggregate_Dirty, and a refresh only applies the difference between what
+# those songs contributed before (Market_Song_Facts) and what they
+# contribute now. The charts then read a few rows per market, however many
+# songs there are.
+aggregate_feature_columns = ['danceability', 'energy', 'loudness', 'speechiness',
+                             'acousticness', 'instrumentalness', 'liveness', 'valence']
+
+aggregate_table_definitions = [
+    # What each song of each market currently contributes to the aggregates
+    f"""
+    CREATE TABLE IF NOT EXISTS Market_Song_Facts (
+        market TEXT NOT NULL,
+        song_id TEXT NOT NULL,
+        release_year INTEGER,
+        release_season TEXT,
+        popularity_score INTEGER,
+        {', '.join(f'{column} REAL' for column in aggregate_feature_columns)},
+        PRIMARY KEY (market, song_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Market_Artists (
+        market TEXT NOT NULL,
+        artist_id TEXT NOT NULL,
+        PRIMARY KEY (market, artist_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Market_Summary (
+        market TEXT PRIMARY KEY,
+        song_count INTEGER NOT NULL DEFAULT 0,
+        artist_count INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Market_Year_Counts (
+        market TEXT NOT NULL,
+        release_year INTEGER NOT NULL,
+        song_count INTEGER NOT NULL,
+        PRIMARY KEY (market, release_year)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Market_Season_Counts (
+        market TEXT NOT NULL,
+        release_season TEXT NOT NULL,
+        song_count INTEGER NOT NULL,
+        PRIMARY KEY (market, release_season)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS Market_Popularity_Counts (
+        market TEXT NOT NULL,
+        popularity_score INTEGER NOT NULL,
+        song_count INTEGER NOT NULL,
+        PRIMARY KEY (market, popularity_score)
+    )
+    """,
+    # Sum and number of non-NULL values of each audio feature, for averages
+    """
+    CREATE TABLE IF NOT EXISTS Market_Feature_Totals (
+        market TEXT NOT NULL,
+        feature TEXT NOT NULL,
+        total REAL NOT NULL,
+        value_count INTEGER NOT NULL,
+        PRIMARY KEY (market, feature)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_Market_Song_Facts_song ON Market_Song_Facts (song_id)",
+    "CREATE TABLE IF NOT EXISTS Aggregate_Dirty (song_id TEXT PRIMARY KEY)",
+]
+
+songs_dirty_trigger = f"""
+    CREATE TRIGGER IF NOT EXISTS trg_songs_aggregate_dirty
+    AFTER UPDATE OF release_year, release_season, popularity_score, {', '.join(aggregate_feature_columns)} ON Songs
+    BEGIN
+        INSERT OR IGNORE INTO Aggregate_Dirty (song_id) VALUES (NEW.song_id);
+    END
+"""
+
+chart_entries_dirty_trigger = """
+    CREATE TRIGGER IF NOT EXISTS trg_Chart_Entries_aggregate_dirty
+    AFTER INSERT ON Chart_Entries
+    BEGIN
+        INSERT OR IGNORE INTO Aggregate_Dirty (song_id) VALUES (NEW.song_id);
+    END
+"""
+
+
+def ensure_aggregate_tables(cursor):
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Market_Summary'")
+    first_build = cursor.fetchone() is None
+    for statement in aggregate_table_definitions:
+        cursor.execute(statement)
+    cursor.execute(songs_dirty_trigger)
+    cursor.execute(chart_entries_dirty_trigger)
+    if first_build:
+        # Songs loaded before the aggregates existed are counted on the next refresh
+        cursor.execute(queue_charted_songs_query)
+
+
+queue_charted_songs_query = register_query(
+    'pipeline: queue charted songs', "INSERT OR IGNORE INTO Aggregate_Dirty (song_id) SELECT song_id FROM Chart_Entries")
+
+
+# Queries issued by the dashboard, all on the aggregates (? is the market)
+markets_query = register_query(
+    'dashboard: markets', "SELECT market FROM Market_Summary WHERE song_count > 0 ORDER BY market")
+market_summary_query = register_query(
+    'dashboard: summary', "SELECT artist_count, song_count FROM Market_Summary WHERE market = ?", ('US',))
+year_counts_query = register_query(
+    'dashboard: years', "SELECT release_year, song_count FROM Market_Year_Counts WHERE market = ?", ('US',))
+season_counts_query = register_query(
+    'dashboard: seasons', "SELECT release_season, song_count FROM Market_Season_Counts WHERE market = ?", ('US',))
+popularity_counts_query = register_query(
+    'dashboard: popularity', "SELECT popularity_score, song_count FROM Market_Popularity_Counts WHERE market = ?",
+    ('US',))
+feature_averages_query = register_query('dashboard: feature averages', """
+    SELECT feature, total / value_count AS average FROM Market_Feature_Totals
+    WHERE market = ? AND value_count > 0
+""", ('US',))
+
+# The same results computed from the base tables, for when the aggregates
+# are missing (a database the pipeline has not migrated yet) or behind
+# (songs are waiting in Aggregate_Dirty). ?1 is the market. `chart_entries`
+# and `songs` are the tables (or subqueries) the chart entries and the songs
+# are read from.
+def chart_table_queries(source, chart_entries, songs):
+    market_songs_query = f"""
+    SELECT DISTINCT c.song_id FROM {chart_entries} c
+    JOIN {songs} s ON s.song_id = c.song_id
+    JOIN Artists a ON a.artist_id = c.artist_id
+    WHERE c.market = ?1
+"""
+
+    def market_song_counts_query(column):
+        return f"""
+    SELECT s.{column}, COUNT(*) AS song_count
+    FROM ({market_songs_query}) m JOIN {songs} s ON s.song_id = m.song_id
+    WHERE s.{column} IS NOT NULL
+    GROUP BY s.{column}
+"""
+
+    return {
+        markets_query: register_query(f'dashboard: markets from {source}',
+                                      f"SELECT DISTINCT market FROM {chart_entries} ORDER BY market"),
+        market_summary_query: register_query(f'dashboard: summary from {source}', f"""
+    SELECT (SELECT COUNT(DISTINCT artist_id) FROM {chart_entries} WHERE market = ?1) AS artist_count,
+           (SELECT COUNT(*) FROM ({market_songs_query})) AS song_count
+""", ('US',)),
+        year_counts_query: register_query(f'dashboard: years from {source}',
+                                          market_song_counts_query('release_year'), ('US',)),
+        season_counts_query: register_query(f'dashboard: seasons from {source}',
+                                            market_song_counts_query('release_season'), ('US',)),
+        popularity_counts_query: register_query(f'dashboard: popularity from {source}',
+                                                market_song_counts_query('popularity_score'), ('US',)),
+        feature_averages_query: register_query(f'dashboard: feature averages from {source}', f"""
+    WITH mf AS (
+        SELECT {', '.join(f's.{column}' for column in aggregate_feature_columns)}
+        FROM ({market_songs_query}) m JOIN {songs} s ON s.song_id = m.song_id
+    )
+    SELECT feature, average FROM ({' UNION ALL '.join(
+            f"SELECT '{column}' AS feature, AVG({column}) AS average FROM mf" for column in aggregate_feature_columns)})
+    WHERE average IS NOT NULL
+""", ('US',)),
+    }
+
+
+base_table_queries = chart_table_queries('base tables', 'Chart_Entries', 'Songs')
+
+# A database the pipeline has not migrated yet (such as the one in the
+# repository) keeps each market's chart entries in a table of its own and
+# only the text release date of every song. These subqueries read them like
+# Chart_Entries and Songs, with the release year and season derived as
+# release_date_details() does (a date known only to the year has no season).
+legacy_market_tables = {'US_Market': 'US', 'China_Market': 'China'}
+legacy_chart_entries = '(' + ' UNION ALL '.join(
+    f"SELECT '{market}' AS market, song_id, artist_id FROM {table}"
+    for table, market in legacy_market_tables.items()) + ')'
+legacy_songs = f"""(
+    SELECT song_id, popularity_score, {', '.join(aggregate_feature_columns)},
+           NULLIF(CAST(substr(release_date, 1, 4) AS INTEGER), 0) AS release_year,
+           CASE WHEN length(release_date) >= 7 THEN
+               CASE CAST(substr(release_date, 6, 2) AS INTEGER) % 12 / 3
+                   WHEN 0 THEN 'Winter' WHEN 1 THEN 'Spring' WHEN 2 THEN 'Summer' WHEN 3 THEN 'Fall'
+               END
+           END AS release_season
+    FROM Songs
+)"""
+legacy_table_queries = chart_table_queries('legacy tables', legacy_chart_entries, legacy_songs)
+
+# The queries of every source other than the aggregates
+chart_source_queries = {'base tables': base_table_queries, 'legacy tables': legacy_table_queries}
+
+existing_tables_query = register_query('dashboard: tables', "SELECT name FROM sqlite_master WHERE type = 'table'")
+aggregates_behind_query = register_query('dashboard: aggregates behind', "SELECT 1 FROM Aggregate_Dirty LIMIT 1")
+
+
+def chart_data_source(conn):
+    # Where the dashboard charts come from: 'aggregates' when they are up to
+    # date, 'base tables' when they are missing or behind, 'legacy tables'
+    # for a database from before Chart_Entries, or None when the database
+    # has no chart entries at all
+    tables = {name.lower() for (name,) in conn.execute(existing_tables_query)}
+    if {'market_summary', 'aggregate_dirty'} <= tables and conn.execute(aggregates_behind_query).fetchone() is None:
+        return 'aggregates'
+    if {'chart_entries', 'songs', 'artists'} <= tables:
+        return 'base tables'
+    if {table.lower() for table in legacy_market_tables} | {'songs', 'artists'} <= tables:
+        return 'legacy tables'
+    return None
+
+
+# The table explorer reads one page at a time with keyset pagination: a page
+# starts right after the sort key of the last row of the previous page, so
+# every page is a range read on an index however deep it is, and only the
+# chosen columns are fetched. Tables can be sorted by the primary key or by
+# the leading column of any full index whose columns are never NULL (a NULL
+# would drop out of the key comparison); ties are broken by rowid, which
+# every index ends with.
+explorer_tables = ['Songs', 'Artists', 'Chart_Entries']
+# The number of rows of each explorer table as of the last pipeline run
+row_counts_table = """
+    CREATE TABLE IF NOT EXISTS Table_Row_Counts (
+        table_name TEXT PRIMARY KEY,
+        row_count INTEGER NOT NULL
+    )
+"""
+
+table_columns_query = register_query(
+    'dashboard: explorer columns', "SELECT name, type, pk, \"notnull\" FROM pragma_table_info(?) ORDER BY cid",
+    ('Songs',))
+index_columns_query = register_query('dashboard: explorer indexes', """
+    SELECT il.name, ii.name
+    FROM pragma_index_list(?) il, pragma_index_info(il.name) ii
+    WHERE il.partial = 0
+    ORDER BY il.seq, ii.seqno
+""", ('Songs',))
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def explorer_sort_keys(columns, index_columns):
+    # {sort column: key columns} from pragma_table_info rows (name, type, pk,
+    # notnull) and (index, column) rows of the table's full indexes
+    nullable = {name for name, _, pk, notnull in columns if not (pk or notnull)}
+    sort_keys = {name: [] for name, type_name, pk, _ in columns
+                 if pk == 1 and type_name.upper() == 'INTEGER'}  # the rowid itself
+    by_index = {}
+    for index_name, column in index_columns:
+        by_index.setdefault(index_name, []).append(column)
+    for key_columns in by_index.values():
+        if None in key_columns or nullable.intersection(key_columns):
+            continue
+        sort_keys.setdefault(key_columns[0], key_columns)
+    return sort_keys
+
+
+def explorer_page_query(table, columns, key_columns, descending=False, after=None, page_size=100):
+    # (sql, params) of one page: `columns` of `table` ordered by `key_columns`
+    # and rowid, starting after the key values `after` (None for the first
+    # page). The key values of each row follow the columns, as key_0, key_1,
+    # ... and page_rowid, so the next page can start after the last row.
+    order_columns = [quote_identifier(column) for column in key_columns] + ['rowid']
+    select_list = [quote_identifier(column) for column in columns]
+    select_list += [f'{column} AS key_{i}' for i, column in enumerate(order_columns[:-1])] + ['rowid AS page_rowid']
+    direction = 'DESC' if descending else 'ASC'
+    query = f"SELECT {', '.join(select_list)} FROM {quote_identifier(table)}"
+    params = ()
+    if after is not None:
+        query += f" WHERE ({', '.join(order_columns)}) {'<' if descending else '>'} ({', '.join('?' for _ in after)})"
+        params = tuple(after)
+    query += f" ORDER BY {', '.join(f'{column} {direction}' for column in order_columns)} LIMIT ?"
+    return query, params + (page_size,)
+
+
+def page_keys(page):
+    # Key values of the last row of a page, to start the next page after
+    # (as Python values, which sqlite3 can bind)
+    key_columns = [column for column in page.columns if column.startswith('key_')] + ['page_rowid']
+    return tuple(page[key_columns].astype(object).iloc[-1].tolist())
+
+
+row_counts_exist_query = register_query(
+    'dashboard: explorer row counts exist',
+    "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'Table_Row_Counts'")
+row_count_query = register_query('dashboard: explorer row count',
+                                 "SELECT row_count FROM Table_Row_Counts WHERE table_name = ?", ('Songs',))
+max_rowid_queries = {table: register_query(f'dashboard: explorer {table} largest rowid',
+                                           f"SELECT MAX(rowid) FROM {quote_identifier(table)}")
+                     for table in explorer_tables}
+count_rows_queries = {table: register_query(f'pipeline: count {table} rows', f"""
+    INSERT OR REPLACE INTO Table_Row_Counts (table_name, row_count)
+    SELECT ?, COUNT(*) FROM {quote_identifier(table)}
+""", (table,)) for table in explorer_tables}
+
+
+def table_row_estimate(conn, table):
+    # (rows, upper_bound) without counting the rows: the count stored by the
+    # last pipeline run (see refresh_row_counts), or else the largest rowid,
+    # which is only an upper bound since ids that were never used (earlier
+    # versions used one up on every ignored insert) make it larger
+    if conn.execute(row_counts_exist_query).fetchone():
+        row = conn.execute(row_count_query, (table,)).fetchone()
+        if row:
+            return row[0], False
+    return conn.execute(max_rowid_queries[table]).fetchone()[0] or 0, True
+
+
+def refresh_row_counts(cursor):
+    # Count the rows of the explorer tables once per pipeline run
+    cursor.execute(row_counts_table)
+    for table in explorer_tables:
+        cursor.execute(count_rows_queries[table], (table,))
+
+
+# The market analysis export: one typed Parquet file for all markets, with a
+# market column. The per-market CSVs of earlier exports are still read when
+# the Parquet file has not been written yet.
+market_analysis_file_path = os.path.join(project_dir, 'market_analysis.parquet')
+market_analysis_csv_paths = {
+    'US': os.path.join(project_dir, 'us_market_analysis.csv'),
+    'China': os.path.join(project_dir, 'China_market_analysis.csv'),
+}
+# Column types of the export, in its column order
+market_analysis_dtypes = {
+    'market': 'category', 'track_name': 'string', 'popularity_score': 'Int64', 'release_date': 'datetime64[ns]',
+    'release_date_precision': 'category', 'release_year': 'Int64', 'release_season': 'category',
+    **{column: 'float64' for column in aggregate_feature_columns},
+}
+
+
+def file_version(path):
+    # Changes whenever the file is rewritten or replaced; None if it is missing
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def market_analysis_version(file_path=None):
+    # Version of whatever load_market_analysis() would read
+    file_path = file_path or market_analysis_file_path
+    if os.path.exists(file_path):
+        return file_version(file_path)
+    return tuple(file_version(csv_file_path) for csv_file_path in market_analysis_csv_paths.values())
+
+
+def load_market_analysis(columns=None, markets=None, file_path=None):
+    # Only the requested columns (plus market) of the requested markets are read
+    file_path = file_path or market_analysis_file_path
+    read_columns = None if columns is None else list(dict.fromkeys(['market'] + list(columns)))
+    if os.path.exists(file_path):
+        filters = [('market', 'in', list(markets))] if markets else None
+        df = pd.read_parquet(file_path, columns=read_columns, filters=filters)
+        df['market'] = df['market'].astype(str)
+        return df
+
+    frames = []
+    for market, csv_file_path in market_analysis_csv_paths.items():
+        if (markets and market not in markets) or not os.path.exists(csv_file_path):
+            continue
+        # The release date columns are derived from release_date
+        wanted = None if columns is None else {
+            'release_date' if column.startswith('release_') else column for column in read_columns}
+        df = pd.read_csv(csv_file_path, usecols=None if wanted is None else lambda column: column in wanted)
+        df.insert(0, 'market', market)
+        frames.append(df)
+    if not frames:
+        # No earlier export covers these markets
+        df = pd.DataFrame({column: pd.Series(dtype=dtype) for column, dtype in market_analysis_dtypes.items()})
+        df['market'] = df['market'].astype(str)
+        return df if read_columns is None else df[read_columns]
+    df = pd.concat(frames, ignore_index=True)
+    if 'release_date' in df.columns:
+        # Derive the normalized release date columns the export would hold
+        details = release_date_details(df['release_date'])
+        df['release_date'] = details.pop('release_date_parsed')
+        for column in details.columns:
+            if columns is None or column in columns:
+                df[column] = details[column]
+    return df if read_columns is None else df[read_columns]
+
+
+def query_plan(conn, query, params=()):
+    # The detail column of every EXPLAIN QUERY PLAN row
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+# Every SCAN step walks a whole table or index, through an index or not:
+# "SCAN Songs", "SCAN s USING COVERING INDEX idx_songs_track_name". Only a
+# constant row and subquery results ("SCAN (subquery-1)") are no table.
+scan_pattern = re.compile(r'^SCAN (\w+)(?: AS \w+)?(?: USING (?:COVERING )?INDEX (\w+))?')
+
+
+def full_table_scans(conn, query, params=(), allowed=()):
+    # The SCAN steps of the query plan, except those of a table, alias or
+    # index named in `allowed`
+    scans = []
+    for detail in query_plan(conn, query, params):
+        match = scan_pattern.match(detail)
+        if match is None or detail == 'SCAN CONSTANT ROW':
+            continue
+        if match.group(1) not in allowed and match.group(2) not in allowed:
+            scans.append(detail)
+    return scans
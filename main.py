@@ -5,469 +5,927 @@
 # ensuring that all fetched data is systematically stored in the project's 
 # database, facilitating easy access and analysis for future processes.
 
+
+import argparse
 from dotenv import load_dotenv
+import hashlib
+import itertools
 import os
-import base64
-import requests
-import json
 import pandas as pd
-import sqlite3
-
-load_dotenv()
-
-client_id = os.getenv("CLIENT_ID")
-client_secret = os.getenv("CLIENT_SECRET")
+from datetime import datetime, timezone
+from difflib import SequenceMatcher
 
-#Get Token Function
-def get_token(client_id, client_secret):
-    auth_string = client_id + ":" + client_secret
+import database
+from database import aggregate_feature_columns, ensure_aggregate_tables, ensure_indexes, register_query
+from name_index import load_name_index, save_aliases, save_song_aliases, song_key
+from normalize import normalize_key, normalize_keys, release_date_details
+from response_cache import ResponseCache
+from spotify_async import search_all
+from spotify_client import SpotifyClient, load_credentials
 
-    # Encode the authentication string to bytes, then to Base64
-    auth_bytes = auth_string.encode("utf-8")
-    auth_base64 = base64.b64encode(auth_bytes).decode("utf-8")
-
-    # The endpoint for requesting an access token
-    url = "https://accounts.spotify.com/api/token"
-
-    headers = {
-        "Authorization": "Basic " + auth_base64,
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
+load_dotenv()
 
-    data = {"grant_type": "client_credentials"}
 
-    # Making the POST request
-    result = requests.post(url, headers=headers, data=data)
+def make_client():
+    # One or more client-id/secret pairs, see load_credentials
+    credentials = load_credentials()
 
-    # Load the result content into a dictionary
-    json_result = json.loads(result.content)
+    # Responses are cached on disk between runs; set SPOTIFY_OFFLINE=1 to
+    # run the whole pipeline from the cache without touching the network
+    offline = os.getenv("SPOTIFY_OFFLINE") == "1"
+    if not credentials and not offline:
+        # Without a client the pipeline still runs its local stages
+        print("No Spotify credentials configured, the stages that need Spotify are left outstanding.")
+        return None
+    response_cache = ResponseCache(os.getenv("SPOTIFY_CACHE_PATH", "spotify_cache.db"), offline=offline)
+
+    # One client for the whole run: it keeps a pooled session and caches the token
+    return SpotifyClient(credentials, cache=response_cache)
+
+
+
+# Create the tables and add the enrichment columns; safe to run on every start
+songs_columns = {
+    'album_id': 'TEXT',
+    'release_date': 'TEXT',
+    # release_date normalized by the track_info stage (see normalize.py)
+    'release_date_parsed': 'TEXT',      # YYYY-MM-DD, incomplete dates on the 1st
+    'release_date_precision': 'TEXT',   # 'day', 'month' or 'year'
+    'release_year': 'INTEGER',
+    'release_season': 'TEXT',           # NULL when only the year is known
+    'popularity_score': 'INTEGER',
+    'danceability': 'REAL',
+    'energy': 'REAL',
+    'loudness': 'REAL',
+    'speechiness': 'REAL',
+    'acousticness': 'REAL',
+    'instrumentalness': 'REAL',
+    'liveness': 'REAL',
+    'valence': 'REAL',
+}
+
+
+def ensure_column(cursor, table_name, column_name, column_type):
+    # SQLite has no "ADD COLUMN IF NOT EXISTS", so check the table first
+    cursor.execute(f"PRAGMA table_info({table_name})")
+    existing_columns = {row[1] for row in cursor.fetchall()}
+    if column_name not in existing_columns:
+        cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+
+
+def database_rows(df):
+    # Plain Python values (no numpy scalars, None for missing) for sqlite3
+    df = df.astype(object)
+    return list(df.where(df.notna(), None).itertuples(index=False, name=None))
+
+
+# Every song on a chart with each of its artists
+charted_songs_query = register_query('pipeline: charted songs', """
+    SELECT DISTINCT s.song_id, s.track_name, a.artist_name
+    FROM Chart_Entries c
+    JOIN Songs s ON s.song_id = c.song_id
+    JOIN Artists a ON a.artist_id = c.artist_id
+""")
+# Seeding Name_Aliases from the songs and artists stored so far
+any_alias_query = register_query('pipeline: any alias', "SELECT 1 FROM Name_Aliases LIMIT 1")
+any_track_alias_query = register_query('pipeline: any track alias',
+                                       "SELECT 1 FROM Name_Aliases WHERE kind = 'track' LIMIT 1")
+all_artists_query = register_query('pipeline: all artists', "SELECT artist_id, artist_name FROM Artists")
+title_aliases_delete_query = register_query(
+    'pipeline: drop title-only track aliases',
+    "DELETE FROM Name_Aliases WHERE kind = 'track' AND instr(name_key, '|') = 0")
+
+
+# One row per song and artist on each edition of each market's chart. Rows
+# are never deleted, so a new entry_id is always larger than every earlier
+# one (the loaders rely on it) without AUTOINCREMENT, which would use up an
+# id on every row INSERT OR IGNORE skips.
+chart_entries_columns = ['entry_id', 'market', 'chart', 'chart_date', 'rank', 'song_id', 'artist_id']
+chart_entries_table = """
+    CREATE TABLE IF NOT EXISTS Chart_Entries (
+        entry_id INTEGER PRIMARY KEY,
+        market TEXT NOT NULL,
+        chart TEXT NOT NULL,
+        chart_date TEXT NOT NULL DEFAULT '',   -- '' for charts scraped without a date
+        rank INTEGER,                          -- NULL when the chart gave no rank
+        song_id TEXT NOT NULL,
+        artist_id TEXT NOT NULL,
+        FOREIGN KEY (song_id) REFERENCES Songs(song_id),
+        FOREIGN KEY (artist_id) REFERENCES Artists(artist_id),
+        UNIQUE (market, chart, chart_date, song_id, artist_id)
+    );
+"""
 
-    # Extract the access token from the JSON response
-    token = json_result["access_token"]
-    return token
 
+def drop_entry_id_autoincrement(cursor):
+    # Chart_Entries used to be created with AUTOINCREMENT; such a table is
+    # rebuilt without it, keeping its entry ids. Its indexes and trigger go
+    # with the old table and are created again by create_schema.
+    cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'Chart_Entries'")
+    if 'AUTOINCREMENT' not in cursor.fetchone()[0].upper():
+        return
+    cursor.execute("ALTER TABLE Chart_Entries RENAME TO Chart_Entries_old")
+    cursor.execute(chart_entries_table)
+    columns = ', '.join(chart_entries_columns)
+    cursor.execute(f"INSERT INTO Chart_Entries ({columns}) SELECT {columns} FROM Chart_Entries_old")
+    cursor.execute("DROP TABLE Chart_Entries_old")
 
-def get_auth_header(token):
-    return {"Authorization": "Bearer " + token}
 
+def create_schema(db_file_path):
+    conn = database.connect(db_file_path)
+    cursor = conn.cursor()
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS Artists (
+            artist_id TEXT PRIMARY KEY,
+            artist_name TEXT NOT NULL
+        )
+        ''')
+    cursor.execute(''' CREATE TABLE IF NOT EXISTS songs (
+                                            song_id TEXT PRIMARY KEY,
+                                            track_name TEXT NOT NULL
+                                        ); ''')
+    for column_name, column_type in songs_columns.items():
+        ensure_column(cursor, 'Songs', column_name, column_type)
+    cursor.execute(chart_entries_table)
+    drop_entry_id_autoincrement(cursor)
+    migrate_market_tables(cursor)
+    # The rows of every stored chart snapshot as scraped, to diff the next
+    # snapshot against
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Chart_Snapshots (
+        market TEXT NOT NULL,
+        chart TEXT NOT NULL,
+        chart_date TEXT NOT NULL,
+        rank INTEGER,
+        track_name TEXT NOT NULL,
+        artist_name TEXT NOT NULL,
+        track_key TEXT NOT NULL,
+        PRIMARY KEY (market, chart, chart_date, track_key, artist_name)
+    );
+    """)
+    ensure_indexes(cursor)
+    # Normalized artist/track names mapped to the Spotify id they resolved to
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Name_Aliases (
+        kind TEXT NOT NULL,
+        name_key TEXT NOT NULL,
+        spotify_id TEXT NOT NULL,
+        confidence REAL NOT NULL DEFAULT 1.0,
+        PRIMARY KEY (kind, name_key)
+    );
+    """)
+    cursor.execute(any_alias_query)
+    if cursor.fetchone() is None:
+        # First run on an existing database: index the names resolved so far
+        save_aliases(cursor, 'artist', {name: artist_id for artist_id, name
+                                        in cursor.execute(all_artists_query).fetchall()})
+    # Track aliases used to be keyed by title alone, which gave every song
+    # with the same title one id; they are rebuilt keyed by title and artist
+    cursor.execute(title_aliases_delete_query)
+    cursor.execute(any_track_alias_query)
+    if cursor.fetchone() is None:
+        save_song_aliases(cursor, {(track_name, artist_name): song_id for song_id, track_name, artist_name
+                                   in cursor.execute(charted_songs_query).fetchall()})
+    ensure_aggregate_tables(cursor)
+    # One row per pipeline stage with the watermark of its last completed run
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS Pipeline_Stages (
+        stage TEXT PRIMARY KEY,
+        watermark TEXT NOT NULL,
+        completed_at TEXT NOT NULL
+    );
+    """)
+    conn.commit()
+    conn.close()
 
 
-#Create a database and Artists table
-db_file_path = 'project_database.db'
-conn = sqlite3.connect(db_file_path)
-cursor = conn.cursor()
-cursor.execute('''
-    CREATE TABLE IF NOT EXISTS Artists (
-        artist_id TEXT PRIMARY KEY,
-        artist_name TEXT NOT NULL
+# The chart each market is read from: {market: (chart, chart CSV)}. Adding a
+# market only takes a line here.
+us_csv_file_path = 'billboard_year_end_hot_100.csv'
+china_csv_file_path = 'netease_music_toplist.csv'
+chart_sources = {
+    'US': ('billboard_hot_100', us_csv_file_path),
+    'China': ('netease_toplist', china_csv_file_path),
+}
+
+# The per-market tables used before Chart_Entries: {table: (market, chart)}
+legacy_market_tables = {table: (market, chart_sources[market][0])
+                        for table, market in database.legacy_market_tables.items()}
+
+
+def migrate_market_tables(cursor):
+    # Move the rows of the old per-market tables into Chart_Entries (they
+    # carry no chart date or rank) and drop the tables with their indexes
+    # and triggers. Duplicate rows left by early runs collapse on the key.
+    for market_table, (market, chart) in legacy_market_tables.items():
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (market_table,))
+        if cursor.fetchone() is None:
+            continue
+        cursor.execute(f"""
+            INSERT OR IGNORE INTO Chart_Entries (market, chart, chart_date, song_id, artist_id)
+            SELECT ?, ?, '', song_id, artist_id FROM {market_table} ORDER BY rowid
+        """, (market, chart))
+        print(f"Moved {cursor.rowcount} rows from {market_table} to Chart_Entries.")
+        cursor.execute(f"DROP TABLE {market_table}")
+
+
+market_staging_table = """
+    CREATE TEMP TABLE market_staging (
+        chart_date TEXT NOT NULL,
+        rank INTEGER,
+        track_name TEXT NOT NULL,
+        song_id TEXT,               -- NULL while the song is unknown
+        artist_key TEXT NOT NULL
     )
-    ''')
-conn.commit()
-conn.close()
-
-
-
-#Get Artist_id using single artist_name
-def search_for_artist(token, artist_name):
-    url = "https://api.spotify.com/v1/search"
-    headers = get_auth_header(token)
-    query = f"?q={artist_name}&type=artist&limit=1"
-    query_url = url + query
-    result = requests.get(query_url, headers=headers)
-    json_result = json.loads(result.content)["artists"]["items"]
-    if len(json_result) == 0:
-        print("No artist with this name exists...")
-        return None
+"""
+
+market_staging_rows_query = register_query('pipeline: stage chart rows', """
+    INSERT INTO market_staging (chart_date, rank, track_name, song_id, artist_key) VALUES (?, ?, ?, ?, ?)
+""", ('2024', 1, 'x', 'x', 'x'))
+last_entry_id_query = register_query('pipeline: last entry id', "SELECT COALESCE(MAX(entry_id), 0) FROM Chart_Entries")
+
+# Parameters: market, chart
+market_staging_insert_query = register_query('pipeline: load chart entries', """
+    INSERT OR IGNORE INTO Chart_Entries (market, chart, chart_date, rank, song_id, artist_id)
+    SELECT ?, ?, st.chart_date, MIN(st.rank), st.song_id, a.spotify_id
+    FROM market_staging st
+    JOIN Name_Aliases a ON a.kind = 'artist' AND a.name_key = st.artist_key AND a.confidence >= 1.0
+    WHERE st.song_id IS NOT NULL
+    GROUP BY st.chart_date, st.song_id, a.spotify_id
+""", ('US', 'billboard_hot_100'))
+
+# A chart may credit fewer artists than Spotify does, so new entries (those
+# after entry_id ?) also get every artist their song already has in the
+# market. NOT INDEXED keeps SQLite on the entry_id range rather than scanning
+# a whole covering index.
+song_artists_insert_query = register_query('pipeline: complete song artists', """
+    INSERT OR IGNORE INTO Chart_Entries (market, chart, chart_date, rank, song_id, artist_id)
+    SELECT DISTINCT n.market, n.chart, n.chart_date, n.rank, n.song_id, o.artist_id
+    FROM Chart_Entries n NOT INDEXED
+    CROSS JOIN Chart_Entries o ON o.song_id = n.song_id AND o.market = n.market
+    WHERE n.entry_id > ?
+""", (0,))
+
+missing_songs_query = register_query('pipeline: missing songs',
+                                     "SELECT DISTINCT track_name FROM market_staging WHERE song_id IS NULL")
+
+
+def with_chart_position(df):
+    # The chart date (the week of weekly charts, the year of year-end
+    # charts, '' if the CSV has neither) and rank of every row
+    if 'chart_date' in df.columns:
+        return df
+    chart_date = pd.Series('', index=df.index, dtype=object)
+    for column in ['Year', 'Week']:
+        if column in df.columns:
+            chart_date = df[column].astype(str).where(df[column].notna(), chart_date)
+    rank = df['Rank'].astype('Int64') if 'Rank' in df.columns else pd.Series(pd.NA, index=df.index, dtype='Int64')
+    return df.assign(chart_date=chart_date, rank=rank)
+
+
+def with_song_keys(df):
+    # The lookup keys of every row: the track key (the scrapers store it in
+    # the CSV as Track_key; older files without it are normalized here) and
+    # the song key of the track with its first listed artist
+    if 'song_key' in df.columns:
+        return df
+    if 'Track_key' in df.columns:
+        track_keys = df['Track_key'].fillna('')
     else:
-        artist_id = json_result[0]['id']
-        #print(f"Artist '{artist_name}' has the ID: {artist_id}")
-        return artist_id
-
-#Get Artist_id using csv file   
-def get_artist_ids_from_csv(csv_file_path, db_file_path):
-  # Read the CSV and make sure 'Artist_name' is treated as a string
-    df = pd.read_csv(csv_file_path, dtype={'Artist_name': str})
-    
-    # Establish a connection to the database
-    conn = sqlite3.connect(db_file_path)
-    cursor = conn.cursor()
- 
-    # Split artist names by comma and create a set to avoid duplicate searches
-    unique_artists = set()
-    for artists in df['Artist_name'].dropna():  # Drop rows where 'Artist_name' is NaN
-        # Check for non-empty strings after stripping whitespace
-        if isinstance(artists, str) and artists.strip():
-            for artist_name in artists.split(','):
-                # Add the stripped artist name to the set
-                unique_artists.add(artist_name.strip())
-
-    # Search for each unique artist and get their ID
-    for artist_name in unique_artists:
-        # Skip empty artist names
-        if artist_name:
-            artist_id = search_for_artist(token, artist_name)
-            if artist_id:
-                # Insert the artist into the database, or ignore if it already exists
-                cursor.execute('''
-                INSERT OR IGNORE INTO Artists (artist_id, artist_name)
-                VALUES (?, ?)
-                ''', (artist_id, artist_name))
-    conn.commit()
-    conn.close()  
-
-
-token = get_token(client_id, client_secret)
-csv_file_path = 'billboard_year_end_hot_100.csv'
-db_file_path = 'project_database.db'
-get_artist_ids_from_csv(csv_file_path, db_file_path)
-
-#Create Songs table
-db_file_path = 'project_database.db'
-conn = sqlite3.connect(db_file_path)
-cursor = conn.cursor()
-cursor.execute(''' CREATE TABLE IF NOT EXISTS songs (
-                                        song_id TEXT PRIMARY KEY,
-                                        track_name TEXT NOT NULL
-                                    ); ''')
-conn.commit()
-conn.close()
-
-
-# Get track_id using single track_name
-def get_track_id(token, track_name):
-    # Base URL for Spotify search API
-    url = "https://api.spotify.com/v1/search"
-    # Query parameters: track name (and artist if provided)
+        track_keys = normalize_keys(df['Track_name'])
+    artist_keys = normalize_keys(df['Artist_name'].str.split(',').str[0])
+    # No song key without both a title and an artist (see name_index.song_key)
+    song_keys = (track_keys + '|' + artist_keys).where((track_keys != '') & (artist_keys != ''), '')
+    return df.assign(track_key=track_keys, song_key=song_keys)
+
+
+def chart_pairs(df):
+    # One (track, artist) pair per chart date and row, with their lookup keys
+    df = with_song_keys(with_chart_position(df.dropna(subset=['Track_name', 'Artist_name'])))
+    pairs = df.assign(Artist_name=df['Artist_name'].str.split(',')).explode('Artist_name')
+    pairs['Artist_name'] = pairs['Artist_name'].str.strip()
+    pairs = pairs[pairs['Artist_name'] != ''].drop_duplicates(['chart_date', 'Track_name', 'Artist_name'])
+    pairs['artist_key'] = normalize_keys(pairs['Artist_name'])
+    return pairs
+
+
+def fill_market_staging(cursor, pairs, track_index):
+    # Every row is staged with the song its title and first artist resolve
+    # to, so rows that share a title but not the artist stay different songs
+    cursor.execute("DROP TABLE IF EXISTS temp.market_staging")
+    cursor.execute(market_staging_table)
+    pairs = pairs.assign(song_id=track_index.known_ids(pairs['song_key']))
+    cursor.executemany(market_staging_rows_query, database_rows(pairs[['chart_date', 'rank', 'Track_name', 'song_id', 'artist_key']]))
+
+
+def stage_market_pairs(cursor, pairs, market, chart, track_index):
+    # Stage the pairs in a temporary table and resolve the artist ids with
+    # one join on the normalized names. Returns the number of new chart
+    # entries and the track names that are not known yet.
+    fill_market_staging(cursor, pairs, track_index)
+
+    last_entry_id = cursor.execute(last_entry_id_query).fetchone()[0]
+    cursor.execute(market_staging_insert_query, (market, chart))
+    inserted = cursor.rowcount
+    cursor.execute(song_artists_insert_query, (last_entry_id,))
+    inserted += cursor.rowcount
+
+    cursor.execute(missing_songs_query)
+    missing = [track_name for (track_name,) in cursor.fetchall()]
+    cursor.execute("DROP TABLE market_staging")
+    return inserted, missing
+
+
+chart_csv_dtypes = {'Track_name': str, 'Artist_name': str, 'Track_key': str, 'Year': str, 'Week': str,
+                    'Toplist_id': str}
+
+
+# Resolve chart rows (track name + artist names) with one search per row.
+# A track search result already carries the ids and names of all its
+# artists, so the song and every artist come from the same response, and
+# searching by title and artist together avoids matching a different song
+# with the same title.
+def split_artist_names(artist_names):
+    if not isinstance(artist_names, str):
+        return []
+    return [name.strip() for name in artist_names.split(',') if name.strip()]
+
+
+# A candidate's title has to be at least this similar to the chart title,
+# and when the row credits artists, one of them has to be on the candidate
+min_title_similarity = 0.8
+
+
+def title_similarity(track_key, item_name):
+    # Spotify appends versions to titles ("Song - Remastered 2011"), so the
+    # part before " - " is compared as well
+    return max(SequenceMatcher(None, track_key, normalize_key(name)).ratio()
+               for name in (item_name, item_name.split(' - ')[0]))
+
+
+def pick_best_track(items, track_name, artist_names):
+    # Score every candidate by how well its title and artists match the row
+    track_key = normalize_key(track_name)
+    artist_keys = {normalize_key(name) for name in artist_names} - {''}
+    best_item, best_score = None, 0.0
+    for item in items:
+        if not item:
+            continue
+        title_score = title_similarity(track_key, item['name'])
+        item_artist_keys = {normalize_key(artist['name']) for artist in item.get('artists', [])}
+        artist_score = len(artist_keys & item_artist_keys) / len(artist_keys) if artist_keys else 0.0
+        if title_score < min_title_similarity or (artist_keys and not artist_score):
+            continue
+        score = title_score + artist_score
+        if score > best_score:
+            best_item, best_score = item, score
+    return best_item
+
+
+def chart_search_params(track_name, artist_names):
     query = f"track:{track_name}"
-    # Construct the full query URL
-    query_url = f"{url}?q={query}&type=track&limit=1"
-    
-    headers = {
-        "Authorization": f"Bearer {token}"
-    }
-    response = requests.get(query_url, headers=headers)
-    response_json = response.json()
-    
-    # Extract track ID from the response
-    items = response_json.get('tracks', {}).get('items', [])
-    if items:
-        # Assuming the first track is the one we want
-        track_id = items[0].get('id')
-        return track_id
-    else:
-        return None
-    
-# Get track_id using csv
-def get_track_ids_from_csv(csv_file_path, db_file_path):
-    # Load the CSV file into a DataFrame
-    df = pd.read_csv(csv_file_path)
-    
-    # Authenticate with Spotify
-    token = get_token(client_id, client_secret)
-    
-    # Connect to SQLite database
-    try:
-        conn = sqlite3.connect(db_file_path)
-        cursor = conn.cursor()
-        
-        # Iterate over unique track names and insert them into the database
-        for track_name in df['Track_name'].unique():
-            track_id = get_track_id(token, track_name)
-            if track_id:
-                cursor.execute('INSERT OR IGNORE INTO songs (song_id, track_name) VALUES (?, ?)', (track_id, track_name))
-        
-        conn.commit()
-        print(f"Inserted {cursor.rowcount} records to the songs table.")
-    
-    except sqlite3.Error as e:
-        print(f"Database error: {e}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        conn.close()
+    if artist_names:
+        query += f" artist:{artist_names[0]}"
+    return {"q": query, "type": "track", "limit": 5}
+
+
+def match_similar_songs(df, track_index):
+    # Rows whose song is not known exactly may be a spelling variant of a
+    # known song by the same artist (see name_index.py). The matches are
+    # used for this run only and never stored as aliases.
+    known = df['song_key'].isin(track_index.ids.keys()) | df['song_key'].isin(track_index.matched.keys())
+    matched = 0
+    for key in df.loc[~known, 'song_key'].unique():
+        spotify_id = track_index.resolve(None, key=key)
+        if spotify_id:
+            track_index.remember(key, spotify_id)
+            matched += 1
+    return matched
+
+
+song_insert_query = register_query('pipeline: insert songs',
+                                   "INSERT OR IGNORE INTO songs (song_id, track_name) VALUES (?, ?)", ('x', 'x'))
+artist_insert_query = register_query('pipeline: insert artists',
+                                     "INSERT OR IGNORE INTO Artists (artist_id, artist_name) VALUES (?, ?)", ('x', 'x'))
+chart_entry_insert_query = register_query('pipeline: insert chart entries', """
+    INSERT OR IGNORE INTO Chart_Entries (market, chart, chart_date, rank, song_id, artist_id)
+    VALUES (?, ?, ?, ?, ?, ?)
+""", ('US', 'billboard_hot_100', '2024', 1, 'x', 'x'))
+
+
+def resolve_chart_chunk(cursor, client, df, market, chart, track_index, not_found):
+    # Search Spotify for the rows of `df` whose song (title and first artist)
+    # is neither known (track_index) nor already searched in vain
+    # (not_found), and store the songs, artists, aliases and chart entries
+    # found. Returns the number of songs found and of searches that failed
+    # (or, without a client, were not sent).
+    known = (df['song_key'].isin(track_index.ids.keys()) | df['song_key'].isin(track_index.matched.keys())
+             | df['song_key'].isin(not_found))
+    pending, positions = {}, {}
+    rows = database_rows(df.loc[~known, ['Track_name', 'Artist_name', 'chart_date', 'rank']])
+    for track_name, artist_names, chart_date, rank in rows:
+        pending[(track_name, artist_names)] = chart_search_params(track_name, split_artist_names(artist_names))
+        # The same song may be on several editions of the chart
+        positions.setdefault((track_name, artist_names), []).append((chart_date, rank))
+    if not pending:
+        return 0, 0
+    if client is None:
+        return 0, len(pending)
+
+    results = search_all(client, pending, parse=lambda json_result: json_result.get('tracks', {}).get('items', []))
+
+    song_rows, artist_rows, entry_rows = [], [], []
+    song_aliases, artist_aliases = {}, {}
+    failed = 0
+    for (track_name, artist_names), items in results.items():
+        if items is None:
+            # The search itself failed; the row is tried again next run
+            failed += 1
+            continue
+        names = split_artist_names(artist_names)
+        item = pick_best_track(items, track_name, names)
+        if item is None:
+            print(f"Song '{track_name}' not found on Spotify.")
+            key = song_key(track_name, names[0] if names else '')
+            if key:
+                not_found.add(key)
+            continue
+        song_rows.append((item['id'], track_name))
+        item_artists = {normalize_key(artist['name']): artist for artist in item.get('artists', [])}
+        for artist in item_artists.values():
+            artist_rows.append((artist['id'], artist['name']))
+            artist_aliases[artist['name']] = artist['id']
+            song_aliases[(track_name, artist['name'])] = item['id']
+            song_aliases[(item['name'], artist['name'])] = item['id']
+            for chart_date, rank in positions[(track_name, artist_names)]:
+                entry_rows.append((market, chart, chart_date, rank, item['id'], artist['id']))
+        # The chart may spell an artist differently from Spotify
+        for name in names:
+            song_aliases[(track_name, name)] = item['id']
+            artist = item_artists.get(normalize_key(name))
+            if artist:
+                artist_aliases[name] = artist['id']
+
+    cursor.executemany(song_insert_query, song_rows)
+    cursor.executemany(artist_insert_query, artist_rows)
+    save_song_aliases(cursor, song_aliases)
+    save_aliases(cursor, 'artist', artist_aliases)
+    cursor.executemany(chart_entry_insert_query, entry_rows)
+    # Later chunks find these songs locally
+    for (track_name, artist_name), song_id in song_aliases.items():
+        track_index.add(None, song_id, key=song_key(track_name, artist_name))
+    return len(song_rows), failed
+
+
+# Streaming ingest: the chart CSV is read once, in chunks of bounded size,
+# and every chunk goes through normalization, resolution and the database
+# writes before the next one is read. Memory use depends on the chunk size
+# and the number of distinct names, not on the number of rows in the file.
+def read_chart_chunks(csv_file_path, chunksize, chart):
+    # (chart name, rows) for every chunk of the CSV. Netease scrapes of
+    # several toplists (Toplist_id column) hold one chart per toplist, so
+    # each chunk is split by toplist as it is read.
+    for chunk in pd.read_csv(csv_file_path, chunksize=chunksize, dtype=chart_csv_dtypes):
+        if 'Toplist_id' not in chunk.columns:
+            yield chart, chunk
+            continue
+        for toplist_id, rows in chunk.groupby('Toplist_id', sort=False):
+            yield f"{chart}_{toplist_id}", rows
+
+
+def normalized_chunks(chunks):
+    # Drop repeated rows within the chunk and add the chart position and the
+    # lookup keys
+    for chart, chunk in chunks:
+        chunk = with_chart_position(chunk.dropna(subset=['Track_name']))
+        chunk = chunk.drop_duplicates(['chart_date', 'Track_name', 'Artist_name'])
+        yield chart, with_song_keys(chunk)
+
+
+def resolve_unknown_songs(cursor, client, chunk, market, chart, track_index, not_found):
+    # Match unknown songs to known spellings, then search Spotify for the
+    # rest. Returns the searches that failed or, without a client, were
+    # not sent.
+    matched = match_similar_songs(chunk, track_index)
+    if matched:
+        print(f"Matched {matched} songs for {market} to known spellings.")
+    resolved, failed = resolve_chart_chunk(cursor, client, chunk, market, chart, track_index, not_found)
+    if resolved:
+        print(f"Resolved {resolved} songs for {market}.")
+    return failed
+
+
+def ingest_chart_csv(chunks, db_file_path, client, market):
+    # Returns the number of failed or unsent searches (rows to try again
+    # next run)
+    conn = database.connect(db_file_path)
+    cursor = conn.cursor()
 
-token = get_token(client_id, client_secret)
-csv_file_path = 'billboard_year_end_hot_100.csv'
-db_file_path = 'project_database.db'
-get_track_ids_from_csv(csv_file_path, db_file_path)
-
-
-#Create US Market Table
-db_file_path = 'project_database.db'
-conn = sqlite3.connect(db_file_path)
-cursor = conn.cursor()
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS US_Market (
-    us_entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    song_id TEXT NOT NULL,
-    artist_id TEXT NOT NULL,
-    FOREIGN KEY (song_id) REFERENCES Songs(song_id),
-    FOREIGN KEY (artist_id) REFERENCES Artists(artist_id)
-);
-""")
-conn.commit()
-conn.close()
+    track_index = load_name_index(cursor, 'track')
+    not_found = set()
+    inserted, rows, missing, failed = 0, 0, set(), 0
+    for chart, chunk in chunks:
+        failed += resolve_unknown_songs(cursor, client, chunk, market, chart, track_index, not_found)
+        # Chart entries of the rows that are known locally
+        chunk_inserted, chunk_missing = stage_market_pairs(cursor, chart_pairs(chunk), market, chart, track_index)
+        inserted += chunk_inserted
+        rows += len(chunk)
+        missing.update(chunk_missing)
+        conn.commit()
+    conn.close()
+    print(f"Read {rows} chart rows, inserted {inserted} new {market} chart entries, "
+          f"{len(missing)} songs not found, {failed} left to search.")
+    return failed
+
+
+# Snapshot ingest for dated charts (weekly charts, or year-end charts by
+# year): every edition is stored in Chart_Snapshots and compared with the
+# previous stored edition of the same chart. Rows that were already on it
+# take their songs and artists from the previous edition's chart entries
+# without any lookup; only new rows, rows whose artist credit changed and
+# rows that had no song on the previous edition go through resolution, so a
+# weekly refresh costs Spotify searches in proportion to the chart's churn,
+# not its size.
+sample_edition = ('China', 'netease_toplist', '2024-01-11')
+snapshot_exists_query = register_query('pipeline: snapshot exists', """
+    SELECT 1 FROM Chart_Snapshots WHERE market = ? AND chart = ? AND chart_date = ? LIMIT 1
+""", sample_edition)
+previous_snapshot_query = register_query('pipeline: previous snapshot', """
+    SELECT MAX(chart_date) FROM Chart_Snapshots WHERE market = ? AND chart = ? AND chart_date < ?
+""", sample_edition)
+snapshot_rows_query = register_query('pipeline: previous snapshot rows', """
+    SELECT track_key, artist_name FROM Chart_Snapshots WHERE market = ? AND chart = ? AND chart_date = ?
+""", sample_edition)
+snapshot_insert_query = register_query('pipeline: store snapshot', """
+    INSERT OR IGNORE INTO Chart_Snapshots (market, chart, chart_date, rank, track_name, artist_name, track_key)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+""", sample_edition + (1, 'x', 'x', 'x'))
+edition_entries_query = register_query(
+    'pipeline: edition entries',
+    "SELECT COUNT(*) FROM Chart_Entries WHERE market = ? AND chart = ? AND chart_date = ?", sample_edition)
+edition_songs_query = register_query(
+    'pipeline: edition songs',
+    "SELECT DISTINCT song_id FROM Chart_Entries WHERE market = ? AND chart = ? AND chart_date = ?", sample_edition)
+# Parameters: market, chart, previous chart date
+carry_forward_query = register_query('pipeline: carry forward entries', """
+    INSERT OR IGNORE INTO Chart_Entries (market, chart, chart_date, rank, song_id, artist_id)
+    SELECT e.market, e.chart, st.chart_date, MIN(st.rank), e.song_id, e.artist_id
+    FROM market_staging st
+    JOIN Chart_Entries e ON e.market = ? AND e.chart = ? AND e.chart_date = ? AND e.song_id = st.song_id
+    GROUP BY st.chart_date, e.song_id, e.artist_id
+""", sample_edition)
+
+
+def is_dated_chart(chunk):
+    return bool({'Year', 'Week'} & set(chunk.columns))
+
+
+def chart_snapshots(chunks):
+    # (chart, chart date, rows) of every edition in the file; the rows of
+    # one edition are expected together, as the scrapers write them
+    current, parts = None, []
+    for chart, chunk in chunks:
+        for chart_date, rows in chunk.groupby('chart_date', sort=False):
+            if parts and (chart, chart_date) != current:
+                yield current + (pd.concat(parts, ignore_index=True),)
+                parts = []
+            current = (chart, chart_date)
+            parts.append(rows)
+    if parts:
+        yield current + (pd.concat(parts, ignore_index=True),)
+
+
+def diff_snapshot(rows, previous, previous_songs, track_index):
+    # Split an edition into the rows the previous edition already had (same
+    # track and artist credit) with a song on its chart entries, and the
+    # rest: new or changed rows and rows that did not resolve last time
+    previous_pairs = set(zip(previous['track_key'], previous['artist_name']))
+    on_previous = pd.Series([pair in previous_pairs for pair in zip(rows['track_key'], rows['Artist_name'])],
+                            index=rows.index, dtype=bool)
+    unchanged = on_previous & track_index.known_ids(rows['song_key']).isin(previous_songs)
+    return rows[unchanged], rows[~unchanged]
+
+
+def carry_forward_entries(cursor, pairs, market, chart, previous_date, track_index):
+    fill_market_staging(cursor, pairs, track_index)
+    cursor.execute(carry_forward_query, (market, chart, previous_date))
+    cursor.execute("DROP TABLE market_staging")
+
+
+def ingest_chart_snapshots(chunks, db_file_path, client, market):
+    # Returns the number of failed or unsent searches (rows to try again
+    # next run)
+    conn = database.connect(db_file_path)
+    cursor = conn.cursor()
+    track_index = load_name_index(cursor, 'track')
+    not_found = set()
+    total_failed = 0
+
+    for chart, chart_date, rows in chart_snapshots(chunks):
+        if cursor.execute(snapshot_exists_query, (market, chart, chart_date)).fetchone():
+            print(f"{market} {chart} of {chart_date or 'no date'} is already stored, skipping.")
+            continue
+        rows = rows.assign(Artist_name=rows['Artist_name'].fillna('')).drop_duplicates(['track_key', 'Artist_name'])
+        previous_date = cursor.execute(previous_snapshot_query, (market, chart, chart_date)).fetchone()[0]
+        previous = pd.DataFrame(cursor.execute(snapshot_rows_query, (market, chart, previous_date)).fetchall(),
+                                columns=['track_key', 'artist_name'])
+        previous_songs = {song_id for (song_id,) in
+                          cursor.execute(edition_songs_query, (market, chart, previous_date)).fetchall()}
+        unchanged, changed = diff_snapshot(rows, previous, previous_songs, track_index)
+        current_pairs = set(zip(rows['track_key'], rows['Artist_name']))
+        dropped = sum(pair not in current_pairs for pair in zip(previous['track_key'], previous['artist_name']))
+
+        if previous_date is not None and not unchanged.empty:
+            carry_forward_entries(cursor, chart_pairs(unchanged), market, chart, previous_date, track_index)
+        match_similar_songs(changed, track_index)
+        searched, failed = 0, 0
+        if not changed.empty:
+            searched, failed = resolve_chart_chunk(cursor, client, changed, market, chart, track_index, not_found)
+        _, missing = stage_market_pairs(cursor, chart_pairs(changed), market, chart, track_index)
+        entries = cursor.execute(edition_entries_query, (market, chart, chart_date)).fetchone()[0]
+
+        # An edition with failed searches is not stored, so the next run
+        # reads it again and retries them
+        if not failed:
+            cursor.executemany(snapshot_insert_query, database_rows(
+                rows[['chart_date', 'rank', 'Track_name', 'Artist_name', 'track_key']]
+                .assign(market=market, chart=chart)
+                [['market', 'chart', 'chart_date', 'rank', 'Track_name', 'Artist_name', 'track_key']]))
+        conn.commit()
+        total_failed += failed
+        print(f"{market} {chart} of {chart_date}: {len(unchanged)} rows unchanged since "
+              f"{previous_date or 'no earlier snapshot'}, {len(changed)} new or changed, "
+              f"{dropped} dropped; {entries} chart entries, "
+              f"{searched} songs resolved on Spotify, {len(missing)} not found, {failed} left to search.")
+    conn.close()
+    return total_failed
 
 
+def ingest_chart_file(csv_file_path, db_file_path, client, market, chart, chunksize=50000):
+    # Reads the chart CSV once and hands its chunks to the snapshot ingest
+    # if the rows are dated (Year or Week column), else to the plain one
+    chunks = normalized_chunks(read_chart_chunks(csv_file_path, chunksize, chart))
+    first = next(chunks, None)
+    if first is None:
+        return 0
+    ingest = ingest_chart_snapshots if is_dated_chart(first[1]) else ingest_chart_csv
+    return ingest(itertools.chain([first], chunks), db_file_path, client, market)
 
-def insert_song_artist_relationship_US(csv_file_path, db_file_path):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(csv_file_path)
-    
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file_path)
-    cursor = conn.cursor()
 
-    # Iterate over each row in the DataFrame
-    for index, row in df.iterrows():
-        track_name = row['Track_name']
-        artist_names = row['Artist_name'].split(',')
-
-        # Find the song_id from the Songs table using track_name
-        cursor.execute("SELECT song_id FROM Songs WHERE track_name = ?", (track_name,))
-        song_result = cursor.fetchone()
-        if song_result:
-            song_id = song_result[0]
-
-            # For each artist, find the artist_id from the Artists table
-            for artist_name in artist_names:
-                artist_name = artist_name.strip()
-                cursor.execute("SELECT artist_id FROM Artists WHERE artist_name = ?", (artist_name,))
-                artist_result = cursor.fetchone()
-                
-                # If both song_id and artist_id are found, insert the relationship into US_Market table
-                if artist_result:
-                    artist_id = artist_result[0]
-                    cursor.execute("INSERT INTO US_Market (song_id, artist_id) VALUES (?, ?)", (song_id, artist_id))
-        else:
-            print(f"Song '{track_name}' not found in the Songs table.")
+def failed_request(response):
+    # Throttled, server errors and offline cache misses (504): the request
+    # did not get an answer and is worth repeating on a later run
+    return response.status_code == 429 or response.status_code >= 500
 
-    conn.commit()
-    conn.close()
 
-csv_file_path = 'billboard_year_end_hot_100.csv'
-db_file_path = 'project_database.db'
-insert_song_artist_relationship_US(csv_file_path, db_file_path)
-
-#Add new fields to Songs table: album_id, release_date, popuarity_score 
-db_file_path = 'project_database.db'
-conn = sqlite3.connect(db_file_path)
-cursor = conn.cursor()
-cursor.execute("ALTER TABLE Songs ADD COLUMN album_id TEXT")
-cursor.execute("ALTER TABLE Songs ADD COLUMN release_date TEXT")
-cursor.execute("ALTER TABLE Songs ADD COLUMN popularity_score INTEGER")
-conn.commit()
-conn.close()
-
-def get_track_info(token, song_id):
-    url = f"https://api.spotify.com/v1/tracks/{song_id}"
-
-    headers = get_auth_header(token)
-    response = requests.get(url, headers=headers)
+def get_track_info(client, song_id):
+    response = client.get(f"tracks/{song_id}")
+    if failed_request(response):
+        return None
     if response.status_code == 200:
         track_data = response.json()
         album_id = track_data['album']['id']
         release_date = track_data['album']['release_date']
+        release_date_precision = track_data['album'].get('release_date_precision')
         popularity_score = track_data['popularity']
-        return album_id, release_date, popularity_score
+        return album_id, release_date, popularity_score, release_date_precision
     else:
-        return None, None, None
-
+        return None, None, None, None
+
+
+# Get album_id, release_date, popularity and release date precision for up to
+# 50 tracks in one request
+def get_several_tracks_info(client, song_ids):
+    response = client.get("tracks", params={"ids": ",".join(song_ids)})
+    if response.status_code == 400:
+        # A single malformed id makes Spotify reject the whole request,
+        # so fall back to one request per id for this chunk
+        print("Batch track request rejected (400), retrying per track")
+        return {song_id: get_track_info(client, song_id) for song_id in song_ids}
+    if response.status_code != 200:
+        # Throttling (429, already retried by the client) and server errors
+        # would only get worse with 50 single requests; the songs stay
+        # pending for the next run
+        print(f"Batch track request failed ({response.status_code}), leaving {len(song_ids)} songs pending")
+        return None
 
-def get_track_info_db(db_file_path, token):
-    conn = sqlite3.connect(db_file_path)
+    # Unknown ids come back as null entries, keep the others
+    track_info = {}
+    for track_data in response.json().get('tracks', []):
+        if track_data:
+            track_info[track_data['id']] = (
+                track_data['album']['id'],
+                track_data['album']['release_date'],
+                track_data['popularity'],
+                track_data['album'].get('release_date_precision')
+            )
+    return track_info
+
+
+pending_track_info_query = register_query('pipeline: pending track info',
+                                          "SELECT song_id FROM Songs WHERE album_id IS NULL")
+track_info_update_query = register_query('pipeline: update track info', """
+    UPDATE Songs
+    SET album_id = ?, release_date = ?, popularity_score = ?,
+        release_date_parsed = ?, release_date_precision = ?, release_year = ?, release_season = ?
+    WHERE song_id = ?
+""", ('a', '2024', 1, '2024-01-01', 'year', 2024, None, 'x'))
+
+# Songs fetched before release dates were normalized
+pending_release_dates_query = register_query('pipeline: pending release dates', """
+    SELECT song_id, release_date, release_date_precision FROM Songs
+    WHERE release_date IS NOT NULL AND release_year IS NULL
+""")
+release_dates_update_query = register_query('pipeline: update release dates', """
+    UPDATE Songs
+    SET release_date_parsed = ?, release_date_precision = ?, release_year = ?, release_season = ?
+    WHERE song_id = ?
+""", ('2024-01-01', 'year', 2024, None, 'x'))
+
+
+def release_date_values(dates, precisions=None):
+    # The normalized release date columns as database values (None for missing)
+    details = release_date_details(dates, precisions)
+    details['release_date_parsed'] = details['release_date_parsed'].dt.strftime('%Y-%m-%d')
+    return details.astype(object).where(details.notna(), None)
+
+
+def track_info_rows(track_info):
+    # Rows for track_info_update_query from {song_id: (album_id, release_date,
+    # popularity_score, release_date_precision)}; all release dates of the
+    # batch are normalized at once
+    info = pd.DataFrame.from_dict(
+        track_info, orient='index',
+        columns=['album_id', 'release_date', 'popularity_score', 'release_date_precision'])
+    info = info[info['album_id'].notna() & info['release_date'].notna() & info['popularity_score'].notna()]
+    if info.empty:
+        return []
+    details = release_date_values(info['release_date'], info['release_date_precision'])
+    return list(zip(info['album_id'], info['release_date'], info['popularity_score'].astype(int).tolist(),
+                    details['release_date_parsed'], details['release_date_precision'],
+                    details['release_year'], details['release_season'], info.index))
+
+
+def normalize_release_dates_db(cursor):
+    # Normalize the release dates stored before the columns existed
+    pending = pd.DataFrame(cursor.execute(pending_release_dates_query).fetchall(),
+                           columns=['song_id', 'release_date', 'release_date_precision'])
+    if pending.empty:
+        return
+    details = release_date_values(pending['release_date'], pending['release_date_precision'])
+    cursor.executemany(release_dates_update_query, zip(
+        details['release_date_parsed'], details['release_date_precision'],
+        details['release_year'], details['release_season'], pending['song_id']))
+    print(f"Normalized the release dates of {len(pending)} songs.")
+
+
+def get_track_info_db(db_file_path, client, batch_size=50):
+    conn = database.connect(db_file_path)
     cursor = conn.cursor()
-    
-    cursor.execute('''SELECT song_id FROM Songs WHERE album_id IS NULL''')
-    songs_to_update = cursor.fetchall()
-    
-    for song_id in songs_to_update:
-        song_id = song_id[0]  # Extract the ID from the tuple
-        album_id, release_date, popularity_score = get_track_info(token, song_id)
-        if album_id and release_date and popularity_score is not None:
-            cursor.execute('''UPDATE Songs SET album_id = ?, release_date = ?, popularity_score = ? WHERE song_id = ?''',
-                           (album_id, release_date, popularity_score, song_id))
-    
+    normalize_release_dates_db(cursor)
     conn.commit()
+
+    cursor.execute(pending_track_info_query)
+    songs_to_update = [row[0] for row in cursor.fetchall()]
+    if client is None:
+        # Without credentials only the release dates are normalized
+        conn.close()
+        return len(songs_to_update)
+
+    # One request per song, or (batched mode) one request and one
+    # executemany per chunk of song ids
+    batch_size = min(max(batch_size, 1), 50)  # Spotify accepts at most 50 ids per request
+    failed = 0
+    for start in range(0, len(songs_to_update), batch_size):
+        chunk = songs_to_update[start:start + batch_size]
+        if batch_size == 1:
+            track_info = {chunk[0]: get_track_info(client, chunk[0])}
+        else:
+            track_info = get_several_tracks_info(client, chunk)
+        if track_info is None:
+            failed += len(chunk)
+            continue
+        # Songs whose request failed (None) stay pending
+        failed += sum(info is None for info in track_info.values())
+        rows = track_info_rows({song_id: info for song_id, info in track_info.items() if info is not None})
+        cursor.executemany(track_info_update_query, rows)
+        conn.commit()
+        if batch_size > 1:
+            print(f"Updated track info for {len(rows)} of {len(chunk)} songs.")
+
     conn.close()
+    return failed
 
-token = get_token(client_id, client_secret)
-db_file_path = 'project_database.db'
-get_track_info_db(db_file_path, token)
-
-#Add new fields to Songs table: track audio features
-db_file_path = 'project_database.db'
-conn = sqlite3.connect(db_file_path)
-cursor = conn.cursor()
-cursor.execute("ALTER TABLE Songs ADD COLUMN danceability REAL;")
-cursor.execute("ALTER TABLE Songs ADD COLUMN energy REAL;")
-cursor.execute("ALTER TABLE Songs ADD COLUMN loudness REAL;")
-cursor.execute("ALTER TABLE Songs ADD COLUMN speechiness REAL;")
-cursor.execute("ALTER TABLE Songs ADD COLUMN acousticness REAL;")
-cursor.execute("ALTER TABLE Songs ADD COLUMN instrumentalness REAL;")
-cursor.execute("ALTER TABLE Songs ADD COLUMN liveness REAL;")
-cursor.execute("ALTER TABLE Songs ADD COLUMN valence REAL;")
-conn.commit()
-conn.close()
 
 # Function to get audio features for a single track
-def get_track_audio_features(token, song_id):
-    url = f"https://api.spotify.com/v1/audio-features/{song_id}"
-    headers = {
-        "Authorization": f"Bearer {token}"
-    }
-    response = requests.get(url, headers=headers)
+def get_track_audio_features(client, song_id):
+    response = client.get(f"audio-features/{song_id}")
     if response.status_code != 200:
-        # If the response was not ok, print the error and return none
+        # If the response was not ok, print the error and return none when
+        # the request failed, or an empty result when Spotify has no features
         print(f"Error fetching track audio features: {response.json()}")
-        return None
+        return None if failed_request(response) else {}
 
     # If the response is ok, we parse it and return the audio features
     audio_features = response.json()
     return audio_features
 
-# token = get_token(client_id, client_secret)
 # song_id = '7K3BhSpAxZBznislvUMVtn'
-# audio_features = get_track_audio_features(token, song_id)
+# audio_features = get_track_audio_features(client, song_id)
 # print(audio_features)
 
 
-def get_track_audio_features_db(db_file_path, token):
-    conn = sqlite3.connect(db_file_path)
-    cursor = conn.cursor()
-    try:
-        # Select songs where audio features are not yet fetched
-        cursor.execute("SELECT song_id FROM Songs WHERE danceability IS NULL")
-        songs_to_update = cursor.fetchall()
-
-        for song_id in songs_to_update:
-            song_id = song_id[0]  # Unpack tuple
-            audio_features = get_track_audio_features(token, song_id)
-
-            if audio_features:
-                # Extract audio features
-                # Update the song record with the new data
-                # Make sure to handle potential None values for each feature with a fallback
-                cursor.execute("""
-                    UPDATE Songs
-                    SET danceability = ?, energy = ?, loudness = ?, speechiness = ?, acousticness = ?, instrumentalness = ?, liveness = ?, valence = ?
-                    WHERE song_id = ?
-                """, (
-                    audio_features.get('danceability', 0),
-                    audio_features.get('energy', 0),
-                    audio_features.get('loudness', 0),
-                    audio_features.get('speechiness', 0),
-                    audio_features.get('acousticness', 0),
-                    audio_features.get('instrumentalness', 0),
-                    audio_features.get('liveness', 0),
-                    audio_features.get('valence', 0),
-                    song_id
-                ))
-        conn.commit()
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    finally:
-        conn.close()
-
-
-token = get_token(client_id, client_secret)
-db_file_path = 'project_database.db'
-get_track_audio_features_db(db_file_path, token)
-
-# All Billboard songs'data has added to database
-# Then, Import Netease Data
-# Import Data into Artists Table
-token = get_token(client_id, client_secret)
-csv_file_path = 'netease_music_toplist.csv'
-db_file_path = 'project_database.db'
-get_artist_ids_from_csv(csv_file_path, db_file_path)
-
-#Import Data into Songs Table
-token = get_token(client_id, client_secret)
-csv_file_path = 'netease_music_toplist.csv'
-db_file_path = 'project_database.db'
-get_track_ids_from_csv(csv_file_path, db_file_path)
-
-# Create China_Market table
-db_file_path = 'project_database.db'
-conn = sqlite3.connect(db_file_path)
-cursor = conn.cursor()
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS China_Market (
-    CHN_entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
-    song_id TEXT NOT NULL,
-    artist_id TEXT NOT NULL,
-    FOREIGN KEY (song_id) REFERENCES Songs(song_id),
-    FOREIGN KEY (artist_id) REFERENCES Artists(artist_id)
-);
-""")
-conn.commit()
-conn.close()
-
-
-def insert_song_artist_relationship_CHI(csv_file_path, db_file_path):
-    # Read the CSV file into a DataFrame
-    df = pd.read_csv(csv_file_path)
-    
-    # Connect to the SQLite database
-    conn = sqlite3.connect(db_file_path)
-    cursor = conn.cursor()
-
-    # Iterate over each row in the DataFrame
-    for index, row in df.iterrows():
-        track_name = row['Track_name']
-        artist_names = row['Artist_name'].split(',')
-
-        # Find the song_id from the Songs table using track_name
-        cursor.execute("SELECT song_id FROM Songs WHERE track_name = ?", (track_name,))
-        song_result = cursor.fetchone()
-        if song_result:
-            song_id = song_result[0]
-
-            # For each artist, find the artist_id from the Artists table
-            for artist_name in artist_names:
-                artist_name = artist_name.strip()
-                cursor.execute("SELECT artist_id FROM Artists WHERE artist_name = ?", (artist_name,))
-                artist_result = cursor.fetchone()
-                
-                # If both song_id and artist_id are found, insert the relationship into China_Market table
-                if artist_result:
-                    artist_id = artist_result[0]
-                    cursor.execute("INSERT INTO China_Market (song_id, artist_id) VALUES (?, ?)", (song_id, artist_id))
-        else:
-            print(f"Song '{track_name}' not found in the Songs table.")
+# Function to get audio features for up to 100 tracks in one request
+def get_several_audio_features(client, song_ids):
+    response = client.get("audio-features", params={"ids": ",".join(song_ids)})
+    if response.status_code != 200:
+        print(f"Error fetching track audio features: {response.status_code}")
+        return None if failed_request(response) else {}
+
+    # Map the results back by id; tracks without analysis come back as null
+    audio_features = {}
+    for features in response.json().get('audio_features', []):
+        if features:
+            audio_features[features['id']] = features
+    return audio_features
 
-    conn.commit()
-    conn.close()
 
+audio_feature_columns = ['danceability', 'energy', 'loudness', 'speechiness',
+                         'acousticness', 'instrumentalness', 'liveness', 'valence']
 
-#Import Data into China Market table
-csv_file_path = 'netease_music_toplist_updated.csv'
-db_file_path = 'project_database.db'
-insert_song_artist_relationship_CHI(csv_file_path, db_file_path)
 
-#Import track_info data
-token = get_token(client_id, client_secret)
-db_file_path = 'project_database.db'
-get_track_info_db(db_file_path, token)
+pending_audio_features_query = register_query('pipeline: pending audio features',
+                                              "SELECT song_id FROM Songs WHERE danceability IS NULL")
+audio_features_update_query = register_query('pipeline: update audio features', """
+    UPDATE Songs
+    SET danceability = ?, energy = ?, loudness = ?, speechiness = ?, acousticness = ?, instrumentalness = ?, liveness = ?, valence = ?
+    WHERE song_id = ?
+""", (0,) * 8 + ('x',))
 
 
-#Import track_audio feature
-token = get_token(client_id, client_secret)
-db_file_path = 'project_database.db'
-get_track_audio_features_db(db_file_path, token)
+def get_track_audio_features_db(db_file_path, client, batch_size=100):
+    # Returns the number of songs whose request failed or, without a client,
+    # was not sent
+    conn = database.connect(db_file_path)
+    cursor = conn.cursor()
+    songs_to_update, failed = [], 0
+    try:
+        # Select songs where audio features are not yet fetched
+        cursor.execute(pending_audio_features_query)
+        songs_to_update = [row[0] for row in cursor.fetchall()]
+        if client is None:
+            return len(songs_to_update)
 
+        if batch_size <= 1:
+            batches = [[song_id] for song_id in songs_to_update]
+        else:
+            batch_size = min(batch_size, 100)  # Spotify accepts at most 100 ids per request
+            batches = [songs_to_update[start:start + batch_size]
+                       for start in range(0, len(songs_to_update), batch_size)]
+
+        for batch in batches:
+            if len(batch) == 1:
+                single = get_track_audio_features(client, batch[0])
+                if single is None:
+                    audio_features = None
+                else:
+                    audio_features = {batch[0]: single} if single else {}
+            else:
+                audio_features = get_several_audio_features(client, batch)
+            if audio_features is None:
+                failed += len(batch)
+                continue
+
+            # Make sure to handle potential None values for each feature with a fallback
+            rows = [
+                tuple(features.get(column, 0) for column in audio_feature_columns) + (song_id,)
+                for song_id, features in audio_features.items()
+            ]
+            # One transaction per batch
+            with conn:
+                cursor.executemany(audio_features_update_query, rows)
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        # The songs not updated yet are left for the next run
+        failed = len(songs_to_update) or 1
+    finally:
+        conn.close()
+    return failed
 
 
-# import data as CSV for visualization purpose
-# US_market analysis csv
-conn = sqlite3.connect('/Users/shengzhupeng/Desktop/DSCI510_FinalProject/project_database.db')
-# Define the query to get the necessary data for the US market analysis
-us_market_query = """
+# Export the data of the markets for visualization purpose: every song once
+# per market it charted in, read in one pass over the song index of
+# Chart_Entries. {market_filter} is empty or restricts the markets.
+market_analysis_query = """
 SELECT  
+    c.market, 
     s.track_name, 
     s.popularity_score, 
     s.release_date, 
+    s.release_date_parsed, 
+    s.release_date_precision, 
+    s.release_year, 
+    s.release_season, 
     s.danceability, 
     s.energy, 
     s.loudness, 
@@ -477,65 +935,325 @@ SELECT
     s.liveness, 
     s.valence
 FROM 
-    Songs s
+    Chart_Entries c
 JOIN 
-    US_Market um ON s.song_id = um.song_id
+    Songs s ON s.song_id = c.song_id
 JOIN 
-    Artists a ON um.artist_id = a.artist_id
+    Artists a ON a.artist_id = c.artist_id
+{market_filter}
 GROUP BY 
-    s.song_id;
+    c.song_id, c.market;
 """
 
-try:
-    # Execute the query and load into a DataFrame
-    us_market_df = pd.read_sql_query(us_market_query, conn)
-    print("Query executed successfully, DataFrame is populated.")
-except Exception as e:
-    print(f"An error occurred during the query: {e}")
-try:
-    us_market_df.to_csv('us_market_analysis.csv', index=False)
-    print("CSV file created successfully.")
-except Exception as e:
-    print(f"An error occurred while writing the CSV file: {e}")
-
-conn.close()
-
-# China_market analysis csv
-conn = sqlite3.connect('/Users/shengzhupeng/Desktop/DSCI510_FinalProject/project_database.db')
-China_market_query = """
-SELECT  
-    s.track_name, 
-    s.popularity_score, 
-    s.release_date, 
-    s.danceability, 
-    s.energy, 
-    s.loudness, 
-    s.speechiness, 
-    s.acousticness, 
-    s.instrumentalness, 
-    s.liveness, 
-    s.valence
-FROM 
-    Songs s
-JOIN 
-    China_Market cm ON s.song_id = cm.song_id
-JOIN 
-    Artists a ON cm.artist_id = a.artist_id
-GROUP BY 
-    s.song_id;
-"""
 
-try:
-    China_market_df = pd.read_sql_query(China_market_query, conn)
-    print("Query executed successfully, DataFrame is populated.")
-except Exception as e:
-    print(f"An error occurred during the query: {e}")
-try:
-    China_market_df.to_csv('China_market_analysis.csv', index=False)
-    print("CSV file created successfully.")
-except Exception as e:
-    print(f"An error occurred while writing the CSV file: {e}")
+def market_analysis_sql(markets=None):
+    # The export query for `markets`, or for all markets
+    market_filter = f"WHERE c.market IN ({', '.join('?' for _ in markets)})" if markets else ''
+    return market_analysis_query.format(market_filter=market_filter)
+
+
+register_query('pipeline: export all markets', market_analysis_sql())
+register_query('pipeline: export one market', market_analysis_sql(['US']), ('US',))
+
 
-conn.close()
+def read_market_analysis(conn, markets=None):
+    # The export rows of `markets`, or of all markets
+    return pd.read_sql_query(market_analysis_sql(markets), conn, params=tuple(markets or ()))
+
+
+def export_market_analysis_parquet(db_file_path, file_path=None, markets=None):
+    # All markets in one typed Parquet file with a market column, so the
+    # dashboard reads only the columns it needs and never parses text
+    file_path = file_path or database.market_analysis_file_path
+    conn = database.connect(db_file_path)
+    try:
+        market_df = read_market_analysis(conn, markets)
+    finally:
+        conn.close()
+
+    market_df = market_df.sort_values('market', kind='stable', ignore_index=True)
+    # The normalized release date replaces the text one
+    market_df['release_date'] = pd.to_datetime(market_df.pop('release_date_parsed'), format='%Y-%m-%d')
+    market_df = market_df.astype(database.market_analysis_dtypes)
+
+    # Write next to the target and swap it in, so readers never see half a file
+    temp_file_path = file_path + '.tmp'
+    market_df.to_parquet(temp_file_path, index=False)
+    os.replace(temp_file_path, file_path)
+    print(f"{file_path} created with {len(market_df)} songs "
+          f"({', '.join(f'{market}: {count}' for market, count in market_df['market'].value_counts(sort=False).items())}).")
+
+
+# Incremental refresh of the per-market chart aggregates (see database.py).
+# Only the songs listed in Aggregate_Dirty are looked at: their previous
+# contribution (Market_Song_Facts) is subtracted, their current one added.
+# CROSS JOIN makes SQLite drive the joins from that (small) list.
+aggregate_fact_columns = ['release_year', 'release_season', 'popularity_score'] + aggregate_feature_columns
+
+current_song_facts_query = register_query('pipeline: current song facts', f"""
+    SELECT DISTINCT c.market, c.song_id, {', '.join(f's.{column}' for column in aggregate_fact_columns)}
+    FROM Aggregate_Dirty d
+    CROSS JOIN Chart_Entries c ON c.song_id = d.song_id
+    CROSS JOIN Songs s ON s.song_id = c.song_id
+    CROSS JOIN Artists a ON a.artist_id = c.artist_id
+""")
+previous_song_facts_query = register_query('pipeline: previous song facts', f"""
+    SELECT f.market, f.song_id, {', '.join(f'f.{column}' for column in aggregate_fact_columns)}
+    FROM Aggregate_Dirty d
+    CROSS JOIN Market_Song_Facts f ON f.song_id = d.song_id
+""")
+new_market_artists_query = register_query('pipeline: new artists', """
+    INSERT OR IGNORE INTO Market_Artists (market, artist_id)
+    SELECT c.market, c.artist_id FROM Aggregate_Dirty d CROSS JOIN Chart_Entries c ON c.song_id = d.song_id
+    WHERE c.market = ?
+""", ('US',))
+aggregate_count_tables = {
+    'release_year': 'Market_Year_Counts',
+    'release_season': 'Market_Season_Counts',
+    'popularity_score': 'Market_Popularity_Counts',
+}
+# {column: (upsert, delete of emptied counts)} of the count tables
+aggregate_count_queries = {
+    column: (register_query(f'pipeline: update {table}', f"""
+        INSERT INTO {table} (market, {column}, song_count) VALUES (?, ?, ?)
+        ON CONFLICT (market, {column}) DO UPDATE SET song_count = song_count + excluded.song_count
+    """, ('US', 1, 1)),
+             register_query(f'pipeline: prune {table}',
+                            f"DELETE FROM {table} WHERE market = ? AND {column} = ? AND song_count <= 0", ('US', 1)))
+    for column, table in aggregate_count_tables.items()
+}
+dirty_count_query = register_query('pipeline: changed songs', "SELECT COUNT(*) FROM Aggregate_Dirty")
+feature_totals_update_query = register_query('pipeline: update feature totals', """
+    INSERT INTO Market_Feature_Totals (market, feature, total, value_count) VALUES (?, ?, ?, ?)
+    ON CONFLICT (market, feature) DO UPDATE
+    SET total = total + excluded.total, value_count = value_count + excluded.value_count
+""", ('US', 'energy', 0.5, 1))
+market_summary_update_query = register_query('pipeline: update market summary', """
+    INSERT INTO Market_Summary (market, song_count, artist_count) VALUES (?, ?, ?)
+    ON CONFLICT (market) DO UPDATE
+    SET song_count = song_count + excluded.song_count, artist_count = artist_count + excluded.artist_count
+""", ('US', 1, 1))
+song_facts_delete_query = register_query(
+    'pipeline: replace song facts',
+    "DELETE FROM Market_Song_Facts WHERE song_id IN (SELECT song_id FROM Aggregate_Dirty)")
+song_facts_insert_query = register_query('pipeline: store song facts', f"""
+    INSERT INTO Market_Song_Facts (market, song_id, {', '.join(aggregate_fact_columns)})
+    VALUES (?, ?, {', '.join('?' for _ in aggregate_fact_columns)})
+""", ('US', 'x') + (None,) * len(aggregate_fact_columns))
+dirty_clear_query = register_query('pipeline: clear changed songs', "DELETE FROM Aggregate_Dirty")
+
+
+def read_song_facts(conn, query, params=()):
+    facts = pd.read_sql_query(query, conn, params=params)
+    return facts.astype({'release_year': 'Int64', 'popularity_score': 'Int64'})
+
+
+def refresh_market_aggregates(db_file_path):
+    conn = database.connect(db_file_path)
+    cursor = conn.cursor()
+    dirty = cursor.execute(dirty_count_query).fetchone()[0]
+    if not dirty:
+        conn.close()
+        return
+
+    previous = read_song_facts(conn, previous_song_facts_query)
+    current = read_song_facts(conn, current_song_facts_query)
+    markets = sorted(set(previous['market']) | set(current['market']))
+
+    # Songs and chart counts: current minus previous contribution
+    song_deltas = current.groupby('market').size().sub(previous.groupby('market').size(), fill_value=0)
+    for column in aggregate_count_tables:
+        deltas = current.groupby(['market', column]).size().sub(
+            previous.groupby(['market', column]).size(), fill_value=0)
+        deltas = deltas[deltas != 0].reset_index(name='song_count')
+        upsert_query, prune_query = aggregate_count_queries[column]
+        cursor.executemany(upsert_query, database_rows(deltas))
+        cursor.executemany(prune_query, database_rows(deltas[['market', column]]))
+
+    # Feature sums and value counts, for the averages
+    def feature_totals(facts):
+        values = facts.melt(id_vars='market', value_vars=aggregate_feature_columns, var_name='feature')
+        return values.groupby(['market', 'feature'])['value'].agg(['sum', 'count'])
+    totals = feature_totals(current).sub(feature_totals(previous), fill_value=0).reset_index()
+    cursor.executemany(feature_totals_update_query, database_rows(totals.astype({'count': int})))
+
+    # Chart entries are only ever added, so artists only need counting once
+    artist_deltas = {}
+    for market in markets:
+        cursor.execute(new_market_artists_query, (market,))
+        artist_deltas[market] = cursor.rowcount
+    cursor.executemany(market_summary_update_query, [(market, int(song_deltas.get(market, 0)), artist_deltas[market]) for market in markets])
+
+    # The current contribution becomes the previous one of the next refresh
+    cursor.execute(song_facts_delete_query)
+    cursor.executemany(song_facts_insert_query, database_rows(current[['market', 'song_id'] + aggregate_fact_columns]))
+    cursor.execute(dirty_clear_query)
+    conn.commit()
+    conn.close()
+    print(f"Refreshed the market aggregates for {dirty} changed songs.")
+
+
+# Pipeline stages
+# Every stage stores a watermark describing the input it last completed on.
+# A stage is skipped when its current input still matches that watermark, so
+# rerunning after a crash or with unchanged data only does outstanding work.
+# Stages return the number of lookups whose requests failed; a stage with
+# failed lookups has not completed and stores no watermark. Without Spotify
+# credentials the stages still do their local work (loading chart rows of
+# known songs, normalizing release dates, refreshing the aggregates) and
+# count every lookup as left for a later run.
+def file_fingerprint(file_path):
+    if not os.path.exists(file_path):
+        return 'missing'
+    # Hashed in blocks, so memory use does not grow with the file
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def table_fingerprint(db_file_path, queries):
+    conn = database.connect(db_file_path)
+    try:
+        return ','.join(str(conn.execute(query).fetchone()[0]) for query in queries)
+    finally:
+        conn.close()
+
+
+watermark_query = register_query('pipeline: watermark', "SELECT watermark FROM Pipeline_Stages WHERE stage = ?",
+                                 ('export',))
+watermark_update_query = register_query(
+    'pipeline: store watermark',
+    "INSERT OR REPLACE INTO Pipeline_Stages (stage, watermark, completed_at) VALUES (?, ?, ?)", ('export', '0', ''))
+watermark_delete_query = register_query('pipeline: clear watermark', "DELETE FROM Pipeline_Stages WHERE stage = ?",
+                                        ('export',))
+
+
+def get_watermark(db_file_path, stage):
+    conn = database.connect(db_file_path)
+    row = conn.execute(watermark_query, (stage,)).fetchone()
+    conn.close()
+    return row[0] if row else None
+
+
+def set_watermark(db_file_path, stage, watermark):
+    conn = database.connect(db_file_path)
+    conn.execute(watermark_update_query, (stage, watermark, datetime.now(timezone.utc).isoformat(timespec='seconds')))
+    conn.commit()
+    conn.close()
+
+
+def clear_watermark(db_file_path, stage):
+    conn = database.connect(db_file_path)
+    conn.execute(watermark_delete_query, (stage,))
+    conn.commit()
+    conn.close()
+
+
+def run_resolve_charts(db_file_path, client):
+    failed = 0
+    for market, (chart, csv_file_path) in chart_sources.items():
+        failed += ingest_chart_file(csv_file_path, db_file_path, client, market, chart)
+    refresh_market_aggregates(db_file_path)
+    return failed
+
+
+def run_track_info(db_file_path, client):
+    failed = get_track_info_db(db_file_path, client)
+    refresh_market_aggregates(db_file_path)
+    return failed
+
+
+def run_audio_features(db_file_path, client):
+    failed = get_track_audio_features_db(db_file_path, client)
+    refresh_market_aggregates(db_file_path)
+    return failed
+
+
+def run_aggregates(db_file_path, client):
+    refresh_market_aggregates(db_file_path)
+
+
+def run_export(db_file_path, client):
+    export_market_analysis_parquet(db_file_path)
+
+
+# Queries whose results make up the database part of the stage watermarks
+track_info_input_queries = ["SELECT COUNT(*) FROM Songs WHERE album_id IS NULL",
+                            "SELECT COUNT(*) FROM Songs WHERE release_date IS NOT NULL AND release_year IS NULL"]
+audio_features_input_queries = ["SELECT COUNT(*) FROM Songs WHERE danceability IS NULL"]
+aggregate_input_queries = ["SELECT COUNT(*) FROM Aggregate_Dirty"]
+export_input_queries = ["SELECT COUNT(*) FROM Songs",
+                        "SELECT COUNT(*) FROM Songs WHERE album_id IS NULL",
+                        "SELECT COUNT(*) FROM Songs WHERE danceability IS NULL",
+                        "SELECT COUNT(*) FROM Songs WHERE release_date IS NOT NULL AND release_year IS NULL",
+                        "SELECT MAX(rowid) FROM Chart_Entries"]
+for query in dict.fromkeys(track_info_input_queries + audio_features_input_queries
+                           + aggregate_input_queries + export_input_queries):
+    register_query(f'pipeline: watermark {query}', query)
+
+# (stage name, function, watermark of the input the stage depends on)
+pipeline_stages = [
+    # Songs, artists and market relationships in one pass over the charts
+    ('resolve_charts', run_resolve_charts,
+     lambda db: ''.join(file_fingerprint(csv_file_path) for _, csv_file_path in chart_sources.values())),
+    # Enrichment only touches rows that are still NULL, so the outstanding
+    # row count is the watermark: 0 means there is nothing left to fetch
+    ('track_info', run_track_info,
+     lambda db: table_fingerprint(db, track_info_input_queries)),
+    ('audio_features', run_audio_features,
+     lambda db: table_fingerprint(db, audio_features_input_queries)),
+    # Every stage above refreshes the aggregates it changed; this one catches
+    # up on changes left over by an interrupted run
+    ('aggregates', run_aggregates,
+     lambda db: table_fingerprint(db, aggregate_input_queries)),
+    # The export is also outstanding when its file was deleted or replaced
+    ('export', run_export,
+     lambda db: f"{table_fingerprint(db, export_input_queries)},"
+                f"{database.file_version(database.market_analysis_file_path)}"),
+]
+
+
+def run_pipeline(db_file_path, client=None, stages=None, force=False):
+    create_schema(db_file_path)
+    if client is None:
+        client = make_client()
+    stages_run = 0
+    for stage, run_stage, watermark in pipeline_stages:
+        if stages and stage not in stages:
+            continue
+        current = watermark(db_file_path)
+        # All zeros is an enrichment stage with no outstanding rows
+        if not force and (get_watermark(db_file_path, stage) == current or set(current.split(',')) == {'0'}):
+            print(f"Stage '{stage}' is up to date, skipping.")
+            continue
+        print(f"Running stage '{stage}'...")
+        stages_run += 1
+        failed = run_stage(db_file_path, client)
+        if failed:
+            # Some requests got no answer (throttled, server errors, offline
+            # cache misses) or were not sent for lack of credentials: the
+            # stage is left outstanding for the next run
+            print(f"Stage '{stage}' has {failed} lookups left, it will run again next time.")
+            clear_watermark(db_file_path, stage)
+            continue
+        # Record the watermark only after the stage finished, so a crash
+        # leaves the stage outstanding for the next run
+        set_watermark(db_file_path, stage, watermark(db_file_path))
+
+    if stages_run:
+        conn = database.connect(db_file_path)
+        database.refresh_row_counts(conn.cursor())
+        conn.commit()
+        conn.close()
 
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the Spotify enrichment pipeline.")
+    parser.add_argument("--db", default=database.db_file_path, help="path of the SQLite database")
+    parser.add_argument("--stage", action="append", choices=[stage for stage, _, _ in pipeline_stages],
+                        help="only run the given stage (can be repeated)")
+    parser.add_argument("--force", action="store_true", help="rerun stages even if they are up to date")
+    args = parser.parse_args()
+    run_pipeline(args.db, stages=args.stage, force=args.force)
@@ -1,226 +1,248 @@
 import streamlit as st
 import pandas as pd
 import matplotlib.pyplot as plt
-import sqlite3
 import seaborn as sns
 
+import database
+from database import (feature_averages_query, market_summary_query, markets_query, popularity_counts_query,
+                      season_counts_query, year_counts_query)
+
 st.set_page_config(page_title="Music Market Analysis", layout="wide")
+
+
+# Streamlit reruns this whole script on every widget change, so everything
+# that reads a file or the database is cached across reruns, each under a
+# version that changes only when the underlying data does:
+#   - the connection: a resource shared by all reruns and sessions, reopened
+#     only if the database file is replaced
+#   - query results: keyed on the database data version, which moves
+#     whenever the pipeline commits
+#   - market analysis frames: keyed on the version of the export file
+#   - markdown pages: keyed on the version of the file
+# A rerun that changes no data only compares versions and does no reads.
+# Every pipeline commit starts a new data version, so the caches keyed on it
+# are bounded: results of old versions are dropped first.
+
+# One read-only connection; the pipeline writes in WAL mode, so reading
+# never waits for it
+@st.cache_resource
+def get_connection(db_file_identity):
+    return database.connect(readonly=True, check_same_thread=False)
+
+
+def current_connection():
+    version = database.file_version(database.db_file_path)
+    return get_connection(version[:1] if version else None)
+
+
+def data_version():
+    # PRAGMA data_version changes whenever another connection (the pipeline)
+    # commits to the database
+    conn = current_connection()
+    return conn.execute("PRAGMA data_version").fetchone()[0], database.file_version(database.db_file_path)
+
+
+# A page of the dashboard issues a few dozen distinct queries
+@st.cache_data(show_spinner=False, max_entries=256)
+def cached_query(query, params, version):
+    return pd.read_sql_query(query, current_connection(), params=params)
+
+
+def run_query(query, params=()):
+    return cached_query(query, tuple(params), data_version())
+
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def cached_chart_data_source(version):
+    return database.chart_data_source(current_connection())
+
+
+def chart_query(query):
+    # The aggregate query, or the same result from the base tables while the
+    # aggregates are missing or behind, or from the per-market tables of a
+    # database the pipeline has not migrated yet (see database.py)
+    source = cached_chart_data_source(data_version())
+    if source == 'aggregates':
+        return query
+    return database.chart_source_queries[source][query]
+
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def cached_row_estimate(table_name, version):
+    return database.table_row_estimate(current_connection(), table_name)
+
+
+@st.cache_data(show_spinner=False)
+def cached_page(path, version):
+    with open(path, 'r') as file:
+        return file.read()
+
+
+def read_page(path):
+    return cached_page(path, database.file_version(path))
+
+
+@st.cache_data(show_spinner=False)
+def cached_market_data(markets, columns, version):
+    return database.load_market_analysis(list(columns), list(markets))
+
+
 tabs = st.tabs(["Home", "Project Overview", "Datasets", "Analysis & Visualization"])
 
 # Home tab
 with tabs[0]:
-    with open('Home.md', 'r') as file:
-        content = file.read()
-    st.markdown(content)
+    st.markdown(read_page('Home.md'))
 
 # Project Overview tab
 with tabs[1]:   
-    with open('Project.md', 'r') as file:
-        content = file.read()
-    st.markdown(content)
+    st.markdown(read_page('Project.md'))
     
     
 # Datasets tab
 with tabs[2]:
-    with open('Datasets.md', 'r') as file:
-        content = file.read()
-    st.markdown(content)
+    st.markdown(read_page('Datasets.md'))
     st.image('Data_Pipeline.jpg', caption='Data Pipeline Visualization')
 
     st.header("Explore My Database")
     
-    conn = sqlite3.connect('project_database.db')
-    # Function to get data from a specific table
-    def get_table_data(table_name):
-        query = f"SELECT * FROM {table_name}"
-        df = pd.read_sql_query(query, conn)
-        return df
-    # Select box for user to choose table
+    # Function to get one page of a table: only the chosen columns and only
+    # the rows after the last row of the previous page (see database.py)
+    def get_table_page(table_name, columns, key_columns, descending, after, page_size):
+        query, params = database.explorer_page_query(table_name, columns, key_columns, descending, after, page_size)
+        return run_query(query, params)
+
+    # Select box for user to choose table, among the tables the database
+    # has (Chart_Entries only exists once the pipeline has run)
+    table_names = {'Songs Table': 'Songs', 'Artists Table': 'Artists', 'Chart Entries Table': 'Chart_Entries'}
+    existing_tables = {name.lower() for name in run_query(database.existing_tables_query)['name']}
+    table_names = {label: name for label, name in table_names.items() if name.lower() in existing_tables}
     table_choice = st.selectbox(
         'Choose a table to display:',
-        ['None', 'Songs Table', 'Artists Table', 'US Market Table', 'China Market Table']
+        ['None'] + list(table_names)
     )
-
-    # Conditional display of tables based on user selection
-    if table_choice == 'Songs Table':
-        st.header("Songs Table")
-        songs_table = get_table_data('Songs')
-        st.dataframe(songs_table)
-        st.markdown("""
-        - **Popularity_Score:** Reflecting the track's overall plays and recency, ranging from 0 to 100.
-        - **Acousticness:** A measure indicating the acoustic nature of the song, on a scale from 0.0 to 1.0.
-        - **Danceability:** An assessment of how suitable a track is for dancing, considering tempo, rhythm stability, and beat strength, scaled from 0.0 (least danceable) to 1.0 (most danceable).
-        - **Energy:** A perceptual measure of intensity and activity in the track, ranging from 0.0 to 1.0, where higher values signify more energetic tracks.
-        - **Instrumentalness:** The extent of instrumental content in the song.
-        - **Speechiness:** The presence of spoken words in the track.
-        - **Liveness:** Detects the presence of an audience in the recording. Higher liveness values represent an increased probability that the track was performed live.
-        - **Valence:** The musical positiveness conveyed by the track.
-        """)
-    elif table_choice == 'Artists Table':
-        st.header("Artists Table")
-        artists_table = get_table_data('Artists')
-        st.dataframe(artists_table)
-    elif table_choice == 'US Market Table':
-        st.header("US Market Table")
-        us_market_table = get_table_data('US_Market')
-        st.dataframe(us_market_table)
-    elif table_choice == 'China Market Table':
-        st.header("China Market Table")
-        china_market_table = get_table_data('China_Market')
-        st.dataframe(china_market_table)
-
-    # Close the database connection
-    conn.close()
-    
+    if 'Chart_Entries' not in table_names.values():
+        st.caption("Chart entries appear here once `python main.py` has built them.")
+
+    if table_choice != 'None':
+        table_name = table_names[table_choice]
+        st.header(table_choice)
+        table_columns = run_query(database.table_columns_query, (table_name,))
+        index_columns = run_query(database.index_columns_query, (table_name,))
+        sort_keys = database.explorer_sort_keys(table_columns.itertuples(index=False, name=None),
+                                                index_columns.itertuples(index=False, name=None))
+        all_columns = table_columns['name'].tolist()
+
+        column_choice, sort_choice, order_choice, size_choice = st.columns([3, 1, 1, 1])
+        columns = column_choice.multiselect('Columns:', all_columns, default=all_columns,
+                                            key=f'columns_{table_name}') or all_columns[:1]
+        sort_column = sort_choice.selectbox('Sort by:', list(sort_keys), key=f'sort_{table_name}')
+        descending = order_choice.selectbox('Order:', ['Ascending', 'Descending'],
+                                            key=f'order_{table_name}') == 'Descending'
+        page_size = size_choice.selectbox('Rows per page:', [50, 100, 500], index=1, key=f'size_{table_name}')
+
+        # The start of every page shown so far, so that "Previous" can go back;
+        # a new table, sort order or page size starts from the first page
+        view = (table_name, sort_column, descending, page_size)
+        if st.session_state.get('explorer_view') != view:
+            st.session_state['explorer_view'] = view
+            st.session_state['explorer_pages'] = [None]
+        pages = st.session_state['explorer_pages']
+
+        page = get_table_page(table_name, columns, sort_keys[sort_column], descending, pages[-1], page_size)
+        row_estimate = cached_row_estimate(table_name, data_version())
+
+        previous_button, page_label, next_button = st.columns([1, 4, 1])
+        if previous_button.button('Previous', disabled=len(pages) == 1, key='explorer_previous'):
+            pages.pop()
+            st.rerun()
+        row_count, upper_bound = row_estimate
+        estimate = 'at most' if upper_bound else 'about'
+        page_label.write(f"Page {len(pages)} of {estimate} {max(1, -(-row_count // page_size))} "
+                         f"({estimate} {row_count} rows)")
+        if next_button.button('Next', disabled=len(page) < page_size, key='explorer_next'):
+            pages.append(database.page_keys(page))
+            st.rerun()
+
+        st.dataframe(page[columns], hide_index=True)
+        if table_name == 'Songs':
+            st.markdown("""
+            - **Popularity_Score:** Reflecting the track's overall plays and recency, ranging from 0 to 100.
+            - **Acousticness:** A measure indicating the acoustic nature of the song, on a scale from 0.0 to 1.0.
+            - **Danceability:** An assessment of how suitable a track is for dancing, considering tempo, rhythm stability, and beat strength, scaled from 0.0 (least danceable) to 1.0 (most danceable).
+            - **Energy:** A perceptual measure of intensity and activity in the track, ranging from 0.0 to 1.0, where higher values signify more energetic tracks.
+            - **Instrumentalness:** The extent of instrumental content in the song.
+            - **Speechiness:** The presence of spoken words in the track.
+            - **Liveness:** Detects the presence of an audience in the recording. Higher liveness values represent an increased probability that the track was performed live.
+            - **Valence:** The musical positiveness conveyed by the track.
+            """)
 
 
 # Analysis & Visualization tab
 with tabs[3]:
-    with open('Analysis.md', 'r') as file:
-        content = file.read()
-    st.markdown(content)
+    st.markdown(read_page('Analysis.md'))
     st.divider()
+    if cached_chart_data_source(data_version()) is None:
+        st.warning("The database holds no chart entries yet. Run `python main.py` to build them; "
+                   "the songs already stored are loaded without Spotify credentials.")
+        st.stop()
+    # Every market with songs in the database, and the names shown for them
+    markets = run_query(chart_query(markets_query))['market'].tolist()
+    market_names = {'US': 'United States'}
+    comparison_choice = 'Both' if len(markets) == 2 else 'All Markets'
     # Sidebar for selecting the market
-    market_choice = st.selectbox("Choose the market to display:", ["China", "United States", "Both"])
-
-
-    # Function to fetch data from a CSV file - for Graph 1
-    def fetch_data(market_csv):
-        df = pd.read_csv(market_csv)
-        # Function to handle incomplete dates
-        def complete_date(date_str):
-            try:
-                # Try to convert the string to datetime with the full format
-                return pd.to_datetime(date_str, format='%Y-%m-%d')
-            except ValueError:
-                # If there's a ValueError, it means the date string is not complete
-                # We'll assume it's just the year and add January 1st to it
-                return pd.to_datetime(date_str + '-01-01')
-            
-        # Apply the complete_date function to the 'release_date' column
-        df['release_date'] = df['release_date'].apply(complete_date)
-        
-        # Extract the year from the release_date and create a 'year' column
-        df['year'] = df['release_date'].dt.year
-        
-        return df
-    
-    # Function for graph 2
-    def get_season(month):
-        if month in [12, 1, 2]:
-            return 'Winter'
-        elif month in [3, 4, 5]:
-            return 'Spring'
-        elif month in [6, 7, 8]:
-            return 'Summer'
-        elif month in [9, 10, 11]:
-            return 'Fall'
-    
+    market_choice = st.selectbox("Choose the market to display:",
+                                 [market_names.get(market, market) for market in markets] + [comparison_choice])
+
+
     audio_features = [
     'danceability', 'energy', 'loudness',
     'speechiness', 'acousticness', 'instrumentalness',
     'liveness', 'valence']
 
-    # Function for graph 5
-    conn = sqlite3.connect('project_database.db')
-    # count the number of distinct artists in the China market
-    artist_diversity_query_china = """
-        SELECT COUNT(DISTINCT artist_id) AS distinct_artist_count
-        FROM China_Market;
-        """
-    artist_diversity_result_china = pd.read_sql_query(artist_diversity_query_china, conn)
-    artist_diversity_china = artist_diversity_result_china['distinct_artist_count'].iloc[0]
-
-    # count the number of distinct artists in the US market
-    artist_diversity_query_us = """
-        SELECT COUNT(DISTINCT artist_id) AS distinct_artist_count
-        FROM US_Market;
-        """
-    artist_diversity_result_us = pd.read_sql_query(artist_diversity_query_us, conn)
-    artist_diversity_us = artist_diversity_result_us['distinct_artist_count'].iloc[0]
-    conn.close()
-   
-
-    if market_choice == "United States":
-        # Load the data for the United States market
-        us_data = fetch_data('us_market_analysis.csv')
-        us_year_count = us_data['year'].value_counts().sort_index()
-
-        # Graph 1
-        st.header("Distribution of Hit Songs Released Years")
-        st.bar_chart(us_year_count)
-        st.write("")
+    # Function to fetch per-song rows from the market analysis export - for
+    # Graph 4. Only the columns the graph uses are read.
+    def fetch_data(markets, columns):
+        return cached_market_data(tuple(markets), tuple(columns), database.market_analysis_version())
 
-        # Add a 'season' column to the DataFrame
-        us_data['season'] = us_data['release_date'].dt.month.apply(get_season) 
-        # Count the number of songs released in each season
-        season_count = us_data['season'].value_counts().sort_index()
+    # Functions to read the aggregates the pipeline maintains for each market
+    # - for Graphs 1, 2, 3 and 5 and the feature averages
+    def market_counts(query, market):
+        counts = run_query(chart_query(query), (market,))
+        return counts.set_index(counts.columns[0])['song_count'].sort_index()
 
-        # Graph 2
-        st.header("Seasonality Distribution of Hit Song Releases")
-        st.bar_chart(season_count)
-        
-        # Graph 3
-        st.header("Distribution of Popularity Scores")
-        # Prepare the data by counting the occurrences of each score and sorting by index
-        popularity_distribution = us_data['popularity_score'].value_counts().sort_index()
-        # Create a DataFrame for the line chart
-        popularity_df = pd.DataFrame({
-            'Popularity Score': popularity_distribution.index,
-            'Number of Songs': popularity_distribution.values
-        })
-        # Display the line chart using Streamlit's native function
-        st.line_chart(popularity_df.set_index('Popularity Score'))
+    def combined_counts(query):
+        return pd.DataFrame({market: market_counts(query, market)
+                             for market in markets}).fillna(0).astype(int)
 
-        # Load the data for the United States market
-        us_data = pd.read_csv('us_market_analysis.csv')
-        # Sidebar for feature selection
-        selected_feature = st.selectbox(
-            "Which Audio Feature do you want to explore?",
-            audio_features
-        )
-        # Graph 4
-        st.title("Audio Feature vs. Popularity Score")
-        if selected_feature:
-            # Create a scatter plot
-            fig = st.scatter_chart(
-                us_data, x='popularity_score', y=selected_feature)
-            # Display the scatter plot
-
-        # Graph 5
-        st.title("Artist Diversity in the US Market")
-        conn = sqlite3.connect('project_database.db')
-        # SQL query to count distinct artists and songs in the US market
-        query = """
-        SELECT 
-            (SELECT COUNT(DISTINCT artist_id) FROM US_Market) AS distinct_artist_count,
-            (SELECT COUNT(DISTINCT song_id) FROM US_Market) AS distinct_song_count;
-        """
-        result = pd.read_sql_query(query, conn)
+    def market_summary(market):
+        result = run_query(chart_query(market_summary_query), (market,))
         result.columns = ['Number of Distinct Artists', 'Number of Songs']
-        conn.close()
-        st.table(result)
+        return result
+
+    def feature_averages(market):
+        return run_query(chart_query(feature_averages_query), (market,)).set_index('feature')['average']
 
-    elif market_choice == "China":
-        china_data = fetch_data('China_market_analysis.csv')
-        china_year_count = china_data['year'].value_counts().sort_index()
+    # The graphs of one market
+    def show_market(market):
         #Graph 1
         st.header("Distribution of Hit Songs Released Years")
-        st.bar_chart(china_year_count)
-        china_data['season'] = china_data['release_date'].dt.month.apply(get_season) 
-        season_count = china_data['season'].value_counts().sort_index()
+        st.bar_chart(market_counts(year_counts_query, market))
+        st.write("")
 
         #Graph 2
-        st.header("Seasonality Distribution of Hit Song Releasest")
-        st.bar_chart(season_count)
+        st.header("Seasonality Distribution of Hit Song Releases")
+        # Number of songs released in each season
+        st.bar_chart(market_counts(season_counts_query, market))
 
         #Graph 3
         st.header("Distribution of Popularity Scores")
-        popularity_distribution = china_data['popularity_score'].value_counts().sort_index()
+        # Number of songs with each score
+        popularity_distribution = market_counts(popularity_counts_query, market)
         popularity_df = pd.DataFrame({
             'Popularity Score': popularity_distribution.index,
             'Number of Songs': popularity_distribution.values
         })
+        # Display the line chart using Streamlit's native function
         st.line_chart(popularity_df.set_index('Popularity Score'))
 
         #Graph 4
@@ -228,40 +250,25 @@ with tabs[3]:
             "Which Audio Feature do you want to explore?",
             audio_features
         )
-
         st.title("Audio Feature vs. Popularity Score")
         if selected_feature:
-            fig = st.scatter_chart(
-                china_data, x='popularity_score', y=selected_feature)
-            
+            market_data = fetch_data([market], ['popularity_score', selected_feature])
+            st.scatter_chart(market_data, x='popularity_score', y=selected_feature)
+
         #Graph 5
-        st.title("Artist Diversity in the China Market")
-        conn = sqlite3.connect('project_database.db')
-        # SQL query to count distinct artists and songs in the US market
-        query = """
-        SELECT 
-            (SELECT COUNT(DISTINCT artist_id) FROM China_Market) AS distinct_artist_count,
-            (SELECT COUNT(DISTINCT song_id) FROM China_Market) AS distinct_song_count;
-        """
-        result = pd.read_sql_query(query, conn)
-        result.columns = ['Number of Distinct Artists', 'Number of Songs']
-        conn.close()
-        st.table(result)
+        st.title(f"Artist Diversity in the {market} Market")
+        # Distinct artists and songs in the market
+        st.table(market_summary(market))
 
 
-    elif market_choice == "Both":
-        # Load the data for both markets
-        us_data = fetch_data('us_market_analysis.csv')
-        china_data = fetch_data('China_market_analysis.csv')
+    if market_choice != comparison_choice:
+        market_by_name = {market_names.get(market, market): market for market in markets}
+        show_market(market_by_name[market_choice])
 
-        # Combine the dataframes and differentiate by market
-        us_data['market'] = 'US'
-        china_data['market'] = 'China'
-        combined_data = pd.concat([us_data, china_data])
-        
+    else:
         #Graph 1
         st.header("Distribution of Hit Songs Released Years")
-        release_years_combined = combined_data.groupby(['year', 'market']).size().unstack(fill_value=0)
+        release_years_combined = combined_counts(year_counts_query)
         st.bar_chart(release_years_combined)
         st.write("""The majority of hit songs in both markets are recent releases from 2022 and 2023.
                  US market demonstrates a broader range, with enduring popularity for songs dating back to 1957 and 1964. 
@@ -271,9 +278,8 @@ with tabs[3]:
        
 
         #Graph 2
-        combined_data['season'] = combined_data['release_date'].dt.month.apply(get_season)
         st.header("Seasonality Distribution of Hit Song Releases")
-        season_count_combined = combined_data.groupby(['season', 'market']).size().unstack(fill_value=0)
+        season_count_combined = combined_counts(season_counts_query)
         st.bar_chart(season_count_combined)
         st.write ("""A higher number of hit songs were released during the Spring season in the US market and summer in the Chinese market
                  """)
@@ -281,7 +287,7 @@ with tabs[3]:
         
         #Graph 3
         st.header("Distribution of Popularity Scores")
-        popularity_distribution_combined = combined_data.groupby(['popularity_score', 'market']).size().unstack(fill_value=0)
+        popularity_distribution_combined = combined_counts(popularity_counts_query)
         st.line_chart(popularity_distribution_combined)
         st.write("""The distribution of popularity scores within the US market shows a noticeable spike within the high score range;
                  The Chinese market's distribution is more uniform across a wide range, 
@@ -290,27 +296,17 @@ with tabs[3]:
 
 
         #Graph 4
-        st.title("Audio Feature vs. Popularity Score - Both Markets")
+        st.title("Audio Feature vs. Popularity Score - All Markets")
         selected_feature = st.selectbox(
             "Which Audio Feature do you want to explore?",
             audio_features
         )
         if selected_feature:
-            # Create a new DataFrame for US data with popularity score and the selected audio feature
-            us_chart_data = us_data[['popularity_score', selected_feature]].rename(
-                columns={'popularity_score': 'Popularity Score', selected_feature: 'Audio Feature Value'}
-            )
-            us_chart_data['Market'] = 'US'  # Add a column for market
-
-            # Create a new DataFrame for China data with popularity score and the selected audio feature
-            china_chart_data = china_data[['popularity_score', selected_feature]].rename(
-                columns={'popularity_score': 'Popularity Score', selected_feature: 'Audio Feature Value'}
+            # Popularity score and the selected audio feature of every song, by market
+            combined_chart_data = fetch_data(markets, ['popularity_score', selected_feature]).rename(
+                columns={'popularity_score': 'Popularity Score', selected_feature: 'Audio Feature Value',
+                         'market': 'Market'}
             )
-            china_chart_data['Market'] = 'China'  # Add a column for market
-
-            # Concatenate the US and China data
-            combined_chart_data = pd.concat([us_chart_data, china_chart_data])
-            
             # Create a scatter chart using the combined data
             st.scatter_chart(combined_chart_data, x='Popularity Score', y='Audio Feature Value', color='Market')
 
@@ -320,22 +316,11 @@ with tabs[3]:
                  and not necessarily dependent on any single audio characteristic.  
                  """)
         
-        us_audio_data = pd.read_csv('us_market_analysis.csv')
-        china_audio_data = pd.read_csv('China_market_analysis.csv')
-        # Calculate the average of each audio feature for both markets
-        us_averages = us_audio_data[audio_features].mean()
-        china_averages = china_audio_data[audio_features].mean()
-
-        # Create a DataFrame to display the averages
-        averages_df = pd.DataFrame({
-    'Average of loudness': [china_averages['loudness'], us_averages['loudness']],
-    'Average of speechiness': [china_averages['speechiness'], us_averages['speechiness']],
-    'Average of acousticness': [china_averages['acousticness'], us_averages['acousticness']],
-    'Average of instrumentalness': [china_averages['instrumentalness'], us_averages['instrumentalness']],
-    'Average of liveness': [china_averages['liveness'], us_averages['liveness']],
-    'Average of valence': [china_averages['valence'], us_averages['valence']],
-    'Average of danceability': [china_averages['danceability'], us_averages['danceability']],
-    'Average of energy': [china_averages['energy'], us_averages['energy']]}, index=['China', 'US'])
+        # The average of each audio feature in each market
+        averages_df = pd.DataFrame({market: feature_averages(market) for market in markets}).T
+        averages_df = averages_df.reindex(columns=['loudness', 'speechiness', 'acousticness', 'instrumentalness',
+                                                   'liveness', 'valence', 'danceability', 'energy'])
+        averages_df.columns = [f'Average of {feature}' for feature in averages_df.columns]
 
         # Display the DataFrame in Streamlit
         st.dataframe(averages_df)
@@ -346,15 +331,18 @@ with tabs[3]:
                  """)
 
        # Graph 5
-        st.title("Comparing Artist Diversity in two Markets")
+        st.title("Comparing Artist Diversity across Markets")
+        # the number of distinct artists in each market
         artist_diversity_combined = pd.DataFrame({
-            'Market': ['US', 'China'],
-            'Distinct Artists': [artist_diversity_us, artist_diversity_china]
+            'Market': markets,
+            'Distinct Artists': [market_summary(market)['Number of Distinct Artists'].iloc[0] for market in markets]
         })
 
         # Plot a pie chart
+        pie_colors = ['#AEC7E8', '#1F77B4']
         fig, ax = plt.subplots(figsize=(3, 4))
-        ax.pie(artist_diversity_combined['Distinct Artists'], labels=artist_diversity_combined['Market'], autopct='%1.1f%%', colors = ['#AEC7E8','#1F77B4'],textprops={'fontsize': 6})
+        ax.pie(artist_diversity_combined['Distinct Artists'], labels=artist_diversity_combined['Market'], autopct='%1.1f%%',
+               colors=pie_colors if len(markets) <= len(pie_colors) else None, textprops={'fontsize': 6})
         
         
         # Display the pie chart
@@ -362,18 +350,3 @@ with tabs[3]:
         st.write("""Despite the dataset containing a slightly larger base for the Chinese market, 
                  with more songs included, the data reveals that the Chinese market has a significant greater diversity of artists. 
                  """)
-
-    
-
-
-
-
-
-
-
-
-
-
-
-
-
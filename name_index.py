@@ -0,0 +1,199 @@
+# This module resolves artist and track names locally, before any Spotify
+# search is sent. Every name the pipeline has already resolved is stored in
+# the Name_Aliases table under its normalized key (see normalize.py), so
+# "Taylor  Swift", "taylor swift" and "Taylor Swift (feat. X)" share one key.
+# Tracks are keyed by their title together with an artist (song_key), since
+# a title alone does not tell "Baby" by Justin Bieber from "Baby" by Clean
+# Bandit.
+#
+# A NameIndex answers lookups in two tiers:
+#   1. exact match on the normalized key (confidence 1.0)
+#   2. fuzzy match: candidates that share the rarest character trigrams with
+#      the key are ranked by edit distance; the best one is returned with a
+#      confidence between 0 and 1
+# The trigram postings are kept per group (for tracks: per artist), so
+# candidate generation only walks the names of the query's group, and within
+# it only the few rarest trigrams of the query, skipping trigrams shared by
+# very many names. A lookup therefore stays well under a millisecond with
+# hundreds of thousands of titles made of common words. A fuzzy match never
+# crosses a group and never joins names that differ in their numbers
+# ("Song 2" is not "Song 3").
+# Fuzzy matches are only used for the current run and are never stored as
+# aliases, so a wrong guess cannot become an exact key.
+
+import re
+from collections import Counter, defaultdict
+
+from database import register_query
+from normalize import normalize_key
+
+
+def song_key(track_name, artist_name):
+    # Name_Aliases key of a track: title and artist, both normalized. A
+    # title with no ASCII text or a missing artist gives no key (''), since
+    # it would stand for every song of the artist or every song of the title.
+    track_key, artist_key = normalize_key(track_name), normalize_key(artist_name)
+    return f"{track_key}|{artist_key}" if track_key and artist_key else ''
+
+
+number_pattern = re.compile(r'\d+')
+
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, max_distance):
+    # Levenshtein distance, giving up as soon as it exceeds max_distance
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous = current
+    return previous[-1]
+
+
+class NameIndex:
+    # With a group_separator, keys are "name<separator>group" (see song_key)
+    # and fuzzy matches are only looked for within the same group
+    def __init__(self, min_confidence=0.85, max_grams=4, max_candidates=10, max_postings=2000,
+                 group_separator=None):
+        self.min_confidence = min_confidence
+        self.max_grams = max_grams
+        self.max_candidates = max_candidates
+        self.max_postings = max_postings
+        self.group_separator = group_separator
+        self.ids = {}                    # normalized key -> spotify id
+        self.keys = []                   # entry number -> normalized key
+        # group -> trigram of the name -> entry numbers
+        self.postings = defaultdict(lambda: defaultdict(list))
+        self.matched = {}                # key -> spotify id of this run's fuzzy matches
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, name, spotify_id, key=None):
+        key = key if key is not None else normalize_key(name)
+        if not key or key in self.ids:
+            return
+        name, group = self.split_group(key)
+        if self.group_separator is not None and not (name and group):
+            # A song key missing its title or artist (stored by earlier versions)
+            return
+        self.ids[key] = spotify_id
+        entry = len(self.keys)
+        self.keys.append(key)
+        postings = self.postings[group]
+        for gram in trigrams(name):
+            postings[gram].append(entry)
+
+    def split_group(self, key):
+        if self.group_separator is None:
+            return key, None
+        name, _, group = key.partition(self.group_separator)
+        return name, group
+
+    def lookup(self, name, key=None):
+        # Returns (spotify_id, confidence); (None, 0.0) when nothing is close enough
+        key = key if key is not None else normalize_key(name)
+        if not key:
+            return None, 0.0
+        if key in self.ids:
+            return self.ids[key], 1.0
+
+        # Fuzzy tier: vote over the rarest trigrams of the name among the
+        # names of its group, leaving out trigrams so common that walking
+        # their postings costs more than they tell apart
+        name, group = self.split_group(key)
+        postings = self.postings.get(group)
+        if not postings:
+            return None, 0.0
+        grams = sorted((gram for gram in trigrams(name) if 0 < len(postings.get(gram, ())) <= self.max_postings),
+                       key=lambda gram: len(postings[gram]))
+        votes = Counter()
+        for gram in grams[:self.max_grams]:
+            votes.update(postings[gram])
+        if not votes:
+            return None, 0.0
+
+        # Only the entries sharing (almost) as many trigrams as the best one
+        # are worth an edit-distance check
+        top_votes = max(votes.values())
+        candidates = [entry for entry, count in votes.items() if count >= top_votes - 1]
+        candidates.sort(key=lambda entry: -votes[entry])
+
+        numbers = number_pattern.findall(name)
+        best_id, best_confidence = None, 0.0
+        for entry in candidates[:self.max_candidates]:
+            candidate = self.split_group(self.keys[entry])[0]
+            if number_pattern.findall(candidate) != numbers:
+                continue
+            longest = max(len(name), len(candidate))
+            max_distance = int(longest * (1 - self.min_confidence))
+            distance = edit_distance(name, candidate, max_distance)
+            if distance <= max_distance:
+                confidence = 1 - distance / longest
+                if confidence > best_confidence:
+                    best_id, best_confidence = self.ids[self.keys[entry]], confidence
+                    if distance == 1:
+                        break  # Nothing but an exact key can do better
+        return best_id, best_confidence
+
+    def resolve(self, name, key=None):
+        # The id of a known name if the match is confident enough, else None
+        spotify_id, confidence = self.lookup(name, key)
+        return spotify_id if confidence >= self.min_confidence else None
+
+    def remember(self, key, spotify_id):
+        # Keep a fuzzy match for the rest of the run. It is not added to the
+        # exact keys, so it never becomes the base of further fuzzy matches.
+        self.matched[key] = spotify_id
+
+    def known_ids(self, keys):
+        # The exact or remembered id of every key of a Series (NaN if unknown)
+        return keys.map(self.ids).fillna(keys.map(self.matched))
+
+
+exact_aliases_query = register_query(
+    'pipeline: exact aliases',
+    "SELECT name_key, spotify_id FROM Name_Aliases WHERE kind = ? AND confidence >= 1.0", ('track',))
+alias_insert_query = register_query(
+    'pipeline: insert aliases',
+    "INSERT OR IGNORE INTO Name_Aliases (kind, name_key, spotify_id, confidence) VALUES (?, ?, ?, ?)",
+    ('track', 'x', 'x', 1.0))
+
+
+def load_name_index(conn, kind, **kwargs):
+    # Build the index for 'artist' or 'track' names from the exact aliases in
+    # Name_Aliases (aliases stored with a lower confidence by earlier
+    # versions are left out). Track keys are grouped by artist.
+    if kind == 'track':
+        kwargs.setdefault('group_separator', '|')
+    index = NameIndex(**kwargs)
+    for name_key, spotify_id in conn.execute(exact_aliases_query, (kind,)):
+        index.add(name_key, spotify_id, key=name_key)
+    return index
+
+
+def insert_aliases(cursor, kind, keyed, confidence):
+    rows = [(kind, key, spotify_id, confidence) for key, spotify_id in keyed.items() if key and spotify_id]
+    cursor.executemany(alias_insert_query, rows)
+
+
+def save_aliases(cursor, kind, resolved, confidence=1.0):
+    # Remember {name: spotify_id} so the same key never needs a search again
+    insert_aliases(cursor, kind, {normalize_key(name): spotify_id for name, spotify_id in resolved.items()},
+                   confidence)
+
+
+def save_song_aliases(cursor, resolved, confidence=1.0):
+    # The same for tracks: {(track_name, artist_name): song_id}
+    insert_aliases(cursor, 'track', {song_key(track_name, artist_name): song_id
+                                     for (track_name, artist_name), song_id in resolved.items()}, confidence)
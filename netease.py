@@ -1,123 +1,260 @@
-# This script uses Selenium for web scraping because the target webpage
-# contains dynamically loaded content which is not accessible through
-# standard requests and static HTML parsing. Selenium automates a browser
-# session to retrieve the full content after scripts have run and the 
-# page has rendered completely.
+# This script scrapes Netease Cloud Music toplists. The toplist page at
+# music.163.com/#/discover/toplist only shows an iframe; the document behind
+# that iframe (music.163.com/discover/toplist?id=...) is served with the
+# whole song list embedded as JSON, so the list is normally read from it
+# with a plain HTTP request and lxml, without starting a browser.
+#
+# Selenium is only a fallback for when the embedded data is missing (e.g.
+# the site served a different page). Those toplists are shared out over a
+# small pool of long-lived headless browsers; each one waits for the iframe
+# and its song table with explicit conditions instead of fixed sleeps, so a
+# page takes as long as it actually needs to load.
+#
+# Netease updates its toplists weekly. Every row is stamped with the chart
+# date (the day of the scrape unless --date says otherwise, in the Week
+# column, as for Billboard's weekly charts), so the pipeline stores each
+# scrape as a snapshot and only resolves what changed since the last one.
+#
+# parse_toplist() only needs the page HTML, so stored page snapshots can be
+# parsed without network access:
+#   python netease.py --html snapshot1.html snapshot2.html
+#
+# Usage:
+#   python netease.py                     the default toplist
+#   python netease.py --ids 2809513713 3778678
+#   python netease.py --browser           always use Selenium
+#   python netease.py --browser --drivers 4 --ids ...
+#   python netease.py --date 2024-01-04
+
+import argparse
+import json
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 
 import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import requests
 from lxml import etree
-import time
-import re
-import sqlite3
 
+from normalize import add_key_column, clean_netease_artists, clean_netease_tracks
 
-# Start the Chrome browser
-driver = webdriver.Chrome()
 
-# URL to the specific song ranking list
-url = "https://music.163.com/#/discover/toplist?id=2809513713"
-driver.get(url)
-driver.maximize_window()  # Maximize the browser window
-time.sleep(2)
-print("step1")
+# The default song ranking list
+toplist_id = '2809513713'
+# URL of the page a browser opens, and of the document inside its iframe
+url = "https://music.163.com/#/discover/toplist?id={toplist_id}"
+iframe_url = "https://music.163.com/discover/toplist?id={toplist_id}"
 
-# Switch to the iframe that contains the song ranking
-iframe = driver.find_element(By.XPATH, "//iframe[@id='g_iframe']")
-driver.switch_to.frame(iframe)
-time.sleep(2)
-print("step2")
+headers = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+                  "(KHTML, like Gecko) Chrome/120.0 Safari/537.36",
+    "Referer": "https://music.163.com/",
+}
 
-# Use Selenium's page source attribute to get the HTML after the iframe has loaded
-page_html = driver.page_source
+csv_file_path = 'netease_music_toplist.csv'
 
-# Parse the HTML with lxml
-html = etree.HTML(page_html)
-# Define XPath for track names and artist names
+# The song list embedded in the iframe document
+embedded_json_xpath = etree.XPath("//textarea[@id='song-list-pre-data']/text()")
+# XPath for track names and artist names in the rendered song table
 track_xpath = "//table[contains(@class,'m-table')]/tbody/tr/td[2]/div/div/div/span/a/b"
 artist_xpath = "//table[contains(@class,'m-table')]/tbody/tr/td[4]/div/span/@title"
-print("step3")
 
-# Extract track names and artist names
-tracks = html.xpath(track_xpath)
-artists = html.xpath(artist_xpath)
 
-# Close the browser
-driver.quit()
+def parse_toplist(page_html):
+    # (track name, artist names) of every song, from the embedded JSON if
+    # the page has it, else from the rendered song table
+    html = etree.HTML(page_html)
+    if html is None:
+        return []
 
-print(artists[0])
-# Create a DataFrame with the extracted data
-df = pd.DataFrame({
-    'Track_name': [track.get('title') for track in tracks],
-    'Artist_name': artists
-})
+    embedded = embedded_json_xpath(html)
+    if embedded:
+        try:
+            songs = json.loads(embedded[0])
+        except ValueError:
+            songs = []
+        if songs:
+            # Artists are joined with '/' as in the rendered table
+            return [(song.get('name', ''), '/'.join(artist.get('name', '') for artist in song.get('artists', [])))
+                    for song in songs]
 
-# Output the DataFrame to a CSV file
-csv_file_path = 'netease_music_toplist.csv'
-df.to_csv(csv_file_path, index=False)
+    tracks = html.xpath(track_xpath)
+    artists = html.xpath(artist_xpath)
+    return list(zip([track.get('title') for track in tracks], artists))
 
-print(f'Data saved to {csv_file_path}')
 
+def fetch_toplist(session, toplist_id):
+    # The iframe document of one toplist, or None if it could not be fetched
+    try:
+        response = session.get(iframe_url.format(toplist_id=toplist_id), headers=headers, timeout=30)
+    except requests.RequestException as error:
+        print(f"Failed to retrieve toplist {toplist_id}: {error}")
+        return None
+    if response.status_code != 200:
+        print(f"Failed to retrieve toplist {toplist_id}: Status code {response.status_code}")
+        return None
+    return response.content
 
-# Clean Track_name
-def sanitize_track_names(track_name):
-    # Remove non-English characters and specific symbols
-    track_name = re.sub(r'[^\x00-\x7F]+', '', track_name)  # Remove non-ASCII characters
-    track_name = re.sub(r'¬†', ' ', track_name)  # Replace specific symbol with space
-    track_name = re.sub(r'\(.*?\)', '', track_name)  # Remove content within parentheses
-    track_name = re.sub(r'\s+', ' ', track_name)  # Replace multiple spaces with a single space
-    track_name = re.sub(r'\-$', '', track_name)  # Remove hyphen at the end
-    track_name = track_name.strip()  # Remove leading/trailing whitespace
-    return track_name
 
-csv_file_path = 'netease_music_toplist.csv'
-df = pd.read_csv(csv_file_path)
-df['Track'] = df['Track'].apply(sanitize_track_names)
-df.to_csv(csv_file_path, index=False)  # Save in place
-
-# Clean artist_name
-def sanitize_artist_names(artist_name):
-    # Replace slashes with commas and remove non-ASCII characters
-    artist_name = artist_name.replace('/', ', ')
-    artist_name = re.sub(r'[^\x00-\x7F]+', '', artist_name)
-    # Ensure there are no leading/trailing spaces around the artist names
-    artist_name = ', '.join(name.strip() for name in artist_name.split(','))
-    return artist_name
+def make_driver():
+    # Selenium is only needed here, so it is imported only when a browser is used
+    from selenium import webdriver
 
-csv_file_path = 'netease_music_toplist.csv'
-df = pd.read_csv(csv_file_path)
-
-df['Artist'] = df['Artist'].apply(sanitize_artist_names)
-df.to_csv(csv_file_path, index=False)
-df.rename(columns={'Track': 'Track_name', 'Artist': 'Artist_name'}, inplace=True)
-
-
-# Check for NaN values in 'Artist_name' and replace them with an empty string
-df['Artist_name'] = df['Artist_name'].fillna('')
-df.to_csv(csv_file_path, index=False)
-print('Finish Cleaning')
-
-# After interfacing with the Spotify API, the following codes filters out tracks 
-# that are not found on Spotify. The remaining tracks, which have been 
-# successfully matched with Spotify's database, are saved to a new CSV file
-# Step 1: Connect to SQLite database and fetch song IDs
-db_file_path = 'project_database.db'
-conn = sqlite3.connect(db_file_path)
-cursor = conn.cursor()
-cursor.execute("SELECT song_id, track_name FROM songs")
-fetched_songs = cursor.fetchall()
-conn.close()
-# Create a dictionary from fetched song data
-song_dict = {track_name: song_id for song_id, track_name in fetched_songs}
-# Step 2: Load the original CSV into a pandas DataFrame
-csv_file_path = 'netease_music_toplist.csv'
-df = pd.read_csv(csv_file_path)
-# Step 3: Filter the DataFrame based on track names that have a matching song_id
-df_filtered = df[df['Track_name'].apply(lambda x: x in song_dict)]
-# Step 4: Write the filtered DataFrame to a new CSV file including track_name and artist_name
-df_filtered.to_csv('netease_music_toplist_updated.csv', columns=['Track_name', 'Artist_name'], index=False)
-print(f"Updated CSV with {len(df_filtered)} songs that matched Spotify's database.")
+    # A headless Chrome with a fixed window size (no window to maximize)
+    # that does not download images, which the song table does not need
+    options = webdriver.ChromeOptions()
+    options.add_argument('--headless=new')
+    options.add_argument('--window-size=1920,1080')
+    options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2})
+    return webdriver.Chrome(options=options)
+
+
+class DriverPool:
+    # Long-lived headless browsers, each used by one scraping thread at a
+    # time and reused for every page it is handed; browsers are started on
+    # first use, up to `size`
+    def __init__(self, size=2):
+        self.size = size
+        self.drivers = []
+        self.idle = queue.Queue()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.drivers) < self.size:
+                driver = make_driver()
+                self.drivers.append(driver)
+                return driver
+        return self.idle.get()
+
+    def release(self, driver):
+        self.idle.put(driver)
+
+    def close(self):
+        # Close the browsers
+        for driver in self.drivers:
+            driver.quit()
+        self.drivers = []
+
+
+def scrape_with_browser(driver, toplist_id, timeout=15):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    driver.get(url.format(toplist_id=toplist_id))
+    try:
+        # Wait only as long as the page actually takes: first for the iframe
+        # that contains the song ranking, then for the rows of its song table
+        wait = WebDriverWait(driver, timeout)
+        wait.until(EC.frame_to_be_available_and_switch_to_it((By.ID, 'g_iframe')))
+        wait.until(EC.presence_of_element_located(
+            (By.XPATH, "//table[contains(@class,'m-table')]/tbody/tr")))
+        # Use Selenium's page source attribute to get the HTML after the iframe has loaded
+        page_html = driver.page_source
+    finally:
+        driver.switch_to.default_content()
+    return parse_toplist(page_html)
+
+
+def scrape_with_browsers(toplist_ids, pool_size=2, timeout=15):
+    # {toplist id: songs}, scraped in parallel by a pool of browsers
+    pool = DriverPool(pool_size)
+
+    def scrape(toplist_id):
+        try:
+            driver = pool.acquire()
+        except Exception as error:
+            print(f"Could not start a browser for toplist {toplist_id}: {error}")
+            return []
+        try:
+            return scrape_with_browser(driver, toplist_id, timeout)
+        except Exception as error:
+            print(f"Browser failed on toplist {toplist_id}: {error}")
+            return []
+        finally:
+            pool.release(driver)
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            return dict(zip(toplist_ids, executor.map(scrape, toplist_ids)))
+    finally:
+        pool.close()
+
+
+def scrape_toplists(toplist_ids, use_browser=False, pool_size=2):
+    # {toplist id: songs}; toplists without an embedded song list are
+    # handed to the browser pool together
+    songs_by_toplist = {}
+    if not use_browser:
+        session = requests.Session()
+        for toplist_id in toplist_ids:
+            page_html = fetch_toplist(session, toplist_id)
+            songs_by_toplist[toplist_id] = parse_toplist(page_html) if page_html else []
+        session.close()
+
+    missing = [toplist_id for toplist_id in toplist_ids if not songs_by_toplist.get(toplist_id)]
+    if missing:
+        if not use_browser:
+            print(f"No embedded song list for toplists {', '.join(missing)}, using the browser.")
+        songs_by_toplist.update(scrape_with_browsers(missing, pool_size))
+    return {toplist_id: songs_by_toplist[toplist_id] for toplist_id in toplist_ids}
+
+
+def toplists_to_dataframe(songs_by_toplist, chart_date=None):
+    # One row per song with its rank in the toplist and the chart date
+    rows = [(chart_date, toplist, rank, track, artists)
+            for toplist, songs in songs_by_toplist.items()
+            for rank, (track, artists) in enumerate(songs, 1)]
+    df = pd.DataFrame(rows, columns=['Week', 'Toplist_id', 'Rank', 'Track_name', 'Artist_name'])
+    if chart_date is None:
+        df = df.drop(columns='Week')
+
+    # Clean track and artist names (see normalize.py)
+    df['Track_name'] = clean_netease_tracks(df['Track_name'])
+    df['Artist_name'] = clean_netease_artists(df['Artist_name'])
+    # Check for NaN values in 'Artist_name' and replace them with an empty string
+    df['Artist_name'] = df['Artist_name'].fillna('')
+    return add_key_column(df)
+
+
+def parse_snapshots(paths):
+    # {path: songs} of stored page snapshots; each path stands in for a toplist id
+    songs_by_toplist = {}
+    for path in paths:
+        with open(path, 'rb') as page:
+            songs_by_toplist[path] = parse_toplist(page.read())
+    return songs_by_toplist
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scrape Netease Cloud Music toplists.')
+    parser.add_argument('--ids', nargs='+', default=[toplist_id], help='toplist ids')
+    parser.add_argument('--html', nargs='+', help='parse stored page snapshots instead of downloading')
+    parser.add_argument('--browser', action='store_true', help='always use Selenium')
+    parser.add_argument('--drivers', type=int, default=2, help='browsers used in parallel')
+    parser.add_argument('--date', default=date.today().isoformat(), help='chart date (YYYY-MM-DD), default today')
+    parser.add_argument('--output', default=csv_file_path)
+    args = parser.parse_args()
+
+    if args.html:
+        songs_by_toplist = parse_snapshots(args.html)
+    else:
+        songs_by_toplist = scrape_toplists(args.ids, args.browser, args.drivers)
+
+    # Neither the pages nor the browsers gave any songs: keep the previous
+    # scrape
+    df = toplists_to_dataframe(songs_by_toplist, args.date)
+    if df.empty:
+        print(f'No songs found, {args.output} was not changed')
+        sys.exit(1)
 
+    # Output the DataFrame to a CSV file
+    df.to_csv(args.output, index=False)
+    print(f'Data saved to {args.output} ({len(df)} songs)')
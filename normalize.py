@@ -0,0 +1,155 @@
+# This module holds the name cleaning shared by the scrapers (billboard.py,
+# netease.py) and the pipeline (main.py). All patterns are compiled once, and
+# the column functions run vectorized pandas string operations over a whole
+# column instead of calling a Python function per row with DataFrame.apply.
+# Chart histories repeat the same names week after week, so the column
+# functions clean each distinct name once and map the results back.
+#
+# normalize_key() turns one name into the key used for database lookups
+# (case, accents, "feat." credits, bracketed suffixes, punctuation and extra
+# whitespace removed); normalize_keys() does the same for a whole column and
+# gives exactly the same keys. The scrapers store that key next to each track
+# name (Track_key), so the pipeline can look the rows up without cleaning the
+# names again.
+#
+# parse_release_dates() turns Spotify release dates, which may be just a year
+# or a year and month, into datetimes for a whole column at once, and
+# release_date_details() derives their precision, year and season.
+
+import re
+import unicodedata
+
+import pandas as pd
+
+
+non_ascii_pattern = re.compile(r'[^\x00-\x7F]+')
+feat_pattern = re.compile(r'[\(\[]?\s*\b(?:feat|ft|featuring)\b\.?.*$')
+bracket_pattern = re.compile(r'[\(\[\{].*?[\)\]\}]')
+apostrophe_pattern = re.compile(r"['’`]")
+punctuation_pattern = re.compile(r'[^\w\s]|_')
+whitespace_pattern = re.compile(r'\s+')
+
+# Scraper clean-up
+billboard_separator_pattern = re.compile(r' (?:&|With|Featuring|X|x) ')
+parentheses_pattern = re.compile(r'\(.*?\)')
+trailing_hyphen_pattern = re.compile(r'-$')
+comma_pattern = re.compile(r'\s*,\s*')
+empty_names_pattern = re.compile(r'^(?:, )+|(?:, )+$')
+repeated_comma_pattern = re.compile(r'(?:, )+')
+
+
+def normalize_key(name):
+    # Fold accents and drop anything that is not ASCII (Netease titles are
+    # stored ASCII-stripped), then drop credits and decorations
+    name = unicodedata.normalize('NFKD', str(name))
+    name = non_ascii_pattern.sub('', name).casefold()
+    name = feat_pattern.sub(' ', name)
+    name = bracket_pattern.sub(' ', name)
+    name = apostrophe_pattern.sub('', name)
+    name = punctuation_pattern.sub(' ', name)
+    return whitespace_pattern.sub(' ', name).strip()
+
+
+def on_distinct_values(clean):
+    # Run a column function over the distinct values only and map the
+    # results back onto every row
+    def clean_column(values):
+        codes, distinct = pd.factorize(values, use_na_sentinel=False)
+        cleaned = clean(pd.Series(distinct, dtype=values.dtype))
+        return pd.Series(cleaned.to_numpy()[codes], index=values.index, name=values.name)
+    return clean_column
+
+
+# The column functions hand pandas the pattern text rather than the compiled
+# object, so that Arrow-backed strings are matched natively instead of
+# falling back to Python's re for every value
+@on_distinct_values
+def normalize_keys(names):
+    # normalize_key() for a whole column; missing names give an empty key
+    keys = names.fillna('').astype(str).str.normalize('NFKD')
+    keys = keys.str.replace(non_ascii_pattern.pattern, '', regex=True).str.casefold()
+    keys = keys.str.replace(feat_pattern.pattern, ' ', regex=True)
+    keys = keys.str.replace(bracket_pattern.pattern, ' ', regex=True)
+    keys = keys.str.replace(apostrophe_pattern.pattern, '', regex=True)
+    keys = keys.str.replace(punctuation_pattern.pattern, ' ', regex=True)
+    return keys.str.replace(whitespace_pattern.pattern, ' ', regex=True).str.strip()
+
+
+@on_distinct_values
+def clean_billboard_artists(artists):
+    # "A & B Featuring C" -> "A, B, C"
+    return artists.str.replace(billboard_separator_pattern.pattern, ', ', regex=True).str.strip()
+
+
+@on_distinct_values
+def clean_netease_tracks(tracks):
+    # Keep the ASCII part of the title, without bracketed notes or a trailing hyphen
+    tracks = tracks.str.replace(non_ascii_pattern.pattern, '', regex=True)
+    tracks = tracks.str.replace(parentheses_pattern.pattern, '', regex=True)
+    tracks = tracks.str.replace(whitespace_pattern.pattern, ' ', regex=True)
+    return tracks.str.replace(trailing_hyphen_pattern.pattern, '', regex=True).str.strip()
+
+
+@on_distinct_values
+def clean_netease_artists(artists):
+    # "A/B" -> "A, B", ASCII only; names with no ASCII left are dropped
+    artists = artists.str.replace('/', ', ', regex=False)
+    artists = artists.str.replace(non_ascii_pattern.pattern, '', regex=True)
+    artists = artists.str.replace(comma_pattern.pattern, ', ', regex=True).str.strip()
+    artists = artists.str.replace(repeated_comma_pattern.pattern, ', ', regex=True)
+    return artists.str.replace(empty_names_pattern.pattern, '', regex=True)
+
+
+def add_key_column(df, name_column='Track_name', key_column='Track_key'):
+    # Store the lookup key of every name next to it
+    df[key_column] = normalize_keys(df[name_column])
+    return df
+
+
+# Spotify gives release dates as YYYY-MM-DD, YYYY-MM or YYYY
+release_date_formats = ['%Y-%m-%d', '%Y-%m', '%Y']
+
+
+# Spotify gives '0000' for unknown release dates. Years outside the range
+# of datetime64[ns] are treated as missing instead of overflowing it.
+min_release_year = pd.Timestamp.min.year + 1
+max_release_year = pd.Timestamp.max.year - 1
+
+
+def parse_release_dates(dates):
+    # Incomplete dates become the first day of their month or year
+    parsed = pd.Series(pd.NaT, index=dates.index, dtype='datetime64[ns]')
+    years = pd.to_numeric(dates.str[:4], errors='coerce')
+    in_range = years.between(min_release_year, max_release_year)
+    for date_format in release_date_formats:
+        missing = parsed.isna() & in_range
+        if not missing.any():
+            break
+        parsed[missing] = pd.to_datetime(dates[missing], format=date_format, errors='coerce')
+    return parsed
+
+
+# Precision of a release date by the length of its text, for dates stored
+# without Spotify's release_date_precision
+precision_by_length = {10: 'day', 7: 'month', 4: 'year'}
+
+season_by_month = {12: 'Winter', 1: 'Winter', 2: 'Winter',
+                   3: 'Spring', 4: 'Spring', 5: 'Spring',
+                   6: 'Summer', 7: 'Summer', 8: 'Summer',
+                   9: 'Fall', 10: 'Fall', 11: 'Fall'}
+
+
+def release_date_details(dates, precisions=None):
+    # Parsed date, precision, year and season of every release date. A date
+    # known only to the year has no season.
+    parsed = parse_release_dates(dates)
+    inferred = dates.str.len().map(precision_by_length)
+    precision = inferred if precisions is None else precisions.fillna(inferred)
+    precision = precision.where(parsed.notna())
+    season = parsed.dt.month.map(season_by_month).where(precision.isin(['day', 'month']))
+    return pd.DataFrame({
+        'release_date_parsed': parsed,
+        'release_date_precision': precision,
+        'release_year': parsed.dt.year.astype('Int64'),
+        'release_season': season,
+    }, index=dates.index)
@@ -0,0 +1,136 @@
+# This module stores Spotify API responses in a local SQLite file so that
+# reruns of the pipeline do not send the same requests again. Entries are
+# keyed by a normalized form of the request and expire after a time-to-live
+# that depends on the endpoint: audio features never change, while
+# popularity scores drift and are refreshed more often. "Not found" answers
+# (empty search results, 404s) are cached too, for a shorter time, so names
+# that Spotify does not know are not searched on every run.
+# In offline mode the cache is the only data source: misses are answered
+# with a 504 response instead of going to the network.
+
+import json
+import sqlite3
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+
+
+DAY = 24 * 60 * 60
+
+# Time-to-live in seconds per endpoint (first path segment)
+DEFAULT_TTLS = {
+    "search": 30 * DAY,
+    "tracks": 7 * DAY,
+    "audio-features": 365 * DAY,
+}
+DEFAULT_TTL = 7 * DAY
+NEGATIVE_TTL = 3 * DAY
+
+
+def normalize_key(path, params=None):
+    # Requests that differ only in casing, spacing or parameter order map to
+    # the same key, e.g. "search?q=Taylor  Swift" and "search?q=taylor swift"
+    path = path.strip("/").lower()
+    items = []
+    for name, value in sorted((params or {}).items()):
+        value = str(value)
+        if name == "q":
+            value = " ".join(value.casefold().split())
+        items.append((name, value))
+    return f"{path}?{urlencode(items)}" if items else path
+
+
+def endpoint_of(path):
+    return path.strip("/").split("/")[0].lower()
+
+
+def is_negative(path, status_code, body):
+    # A "not found" answer: a 404, or a search that matched nothing
+    if status_code == 404:
+        return True
+    if status_code == 200 and endpoint_of(path) == "search":
+        try:
+            result = json.loads(body)
+        except ValueError:
+            return False
+        return all(not section.get("items") for section in result.values()
+                   if isinstance(section, dict))
+    return False
+
+
+def make_response(url, status_code, body, from_cache=True):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = body
+    response.url = url
+    response.encoding = "utf-8"
+    response.headers["Content-Type"] = "application/json"
+    response.from_cache = from_cache
+    return response
+
+
+class ResponseCache:
+    def __init__(self, db_file_path="spotify_cache.db", ttls=None,
+                 negative_ttl=NEGATIVE_TTL, offline=False):
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.negative_ttl = negative_ttl
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_file_path, check_same_thread=False)
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS Responses (
+                request_key TEXT PRIMARY KEY,
+                status_code INTEGER NOT NULL,
+                body BLOB NOT NULL,
+                expires_at REAL NOT NULL
+            )
+        ''')
+        self.conn.commit()
+
+    def lookup(self, path, params=None):
+        # Returns a Response rebuilt from the cache, or None on a miss
+        key = normalize_key(path, params)
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status_code, body, expires_at FROM Responses WHERE request_key = ?",
+                (key,)).fetchone()
+        if row is None or (row[2] < time.time() and not self.offline):
+            # Offline runs also accept expired entries: stale data beats no data
+            self.misses += 1
+            return None
+        self.hits += 1
+        return make_response(key, row[0], row[1])
+
+    def store(self, path, params, response):
+        # Only successful answers and "not found" answers are worth keeping;
+        # auth errors, rate limits and server errors are transient
+        if response.status_code not in (200, 404):
+            return
+        if is_negative(path, response.status_code, response.content):
+            ttl = self.negative_ttl
+        else:
+            ttl = self.ttls.get(endpoint_of(path), DEFAULT_TTL)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO Responses (request_key, status_code, body, expires_at) VALUES (?, ?, ?, ?)",
+                (normalize_key(path, params), response.status_code, response.content, time.time() + ttl))
+            self.conn.commit()
+
+    def offline_miss(self, path, params=None):
+        body = json.dumps({"error": {"status": 504, "message": "Not in offline cache"}})
+        return make_response(normalize_key(path, params), 504, body.encode("utf-8"))
+
+    def purge_expired(self):
+        with self.lock:
+            deleted = self.conn.execute("DELETE FROM Responses WHERE expires_at < ?",
+                                        (time.time(),)).rowcount
+            self.conn.commit()
+        return deleted
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,118 @@
+# This module runs Spotify searches (e.g. for chart rows) concurrently.
+# A fixed number of asyncio workers take names from a queue and run their
+# searches on worker threads that share the SpotifyClient's pooled session,
+# so many requests can be in flight at once. Request rates are limited per credential by the client's token
+# buckets (an extra overall cap can be given with `rate`). Rate-limited
+# responses (HTTP 429) are retried after the delay given in their
+# Retry-After header, and the number of concurrent requests shrinks while
+# Spotify is throttling and grows back once requests succeed again.
+# Rejected client credentials are not retried: the RuntimeError raised by
+# the token request ends the whole search.
+
+import asyncio
+
+import requests
+
+from spotify_client import TokenBucket, retry_after_seconds
+
+
+class AdaptiveConcurrency:
+    # Limits the number of requests in flight. The limit is halved whenever
+    # a request is throttled and raised by one after a full window of
+    # successful requests (additive increase, multiplicative decrease).
+    def __init__(self, max_concurrency, initial=None):
+        self.max_concurrency = max_concurrency
+        self.limit = initial or max(1, max_concurrency // 2)
+        self.in_flight = 0
+        self.successes = 0
+        self.condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self, throttled=False):
+        async with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self.successes = 0
+            else:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_concurrency:
+                    self.limit += 1
+                    self.successes = 0
+            # Wake only as many waiters as there are free slots
+            self.condition.notify(max(0, self.limit - self.in_flight))
+
+
+async def _resolve_one(name, params, parse, client, bucket, concurrency, max_retries):
+    attempt = 0
+    while True:
+        if bucket is not None:
+            wait = bucket.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+        await concurrency.acquire()
+        try:
+            response = await asyncio.to_thread(client.get, "search", params)
+            error = f"status code {response.status_code}"
+        except requests.RequestException as e:
+            response = None
+            error = str(e)
+        throttled = response is not None and (
+            response.status_code == 429 or getattr(response, "throttled", False))
+        await concurrency.release(throttled=throttled)
+
+        if response is not None and response.status_code == 429:
+            # Every credential is rate limited: wait as long as Spotify asks
+            # and try again. Throttled lookups never count against max_retries.
+            await asyncio.sleep(retry_after_seconds(response))
+            continue
+
+        if response is not None and response.status_code == 200:
+            return name, parse(response.json())
+        if getattr(response, "from_cache", False):
+            # Offline cache miss: retrying cannot help
+            return name, None
+
+        attempt += 1
+        if attempt > max_retries:
+            print(f"Giving up on '{name}' after {attempt} attempts: {error}")
+            return name, None
+        # Server errors and dropped connections: exponential backoff
+        await asyncio.sleep(min(2 ** attempt, 30))
+
+
+async def _search_all(client, params_by_key, parse, max_concurrency, rate, max_retries):
+    bucket = TokenBucket(rate) if rate else None
+    concurrency = AdaptiveConcurrency(max_concurrency)
+    queue = asyncio.Queue()
+    for key, params in params_by_key.items():
+        queue.put_nowait((key, params))
+    results = {}
+
+    async def worker():
+        while True:
+            try:
+                key, params = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            name, result = await _resolve_one(key, params, parse, client, bucket, concurrency, max_retries)
+            results[name] = result
+
+    # One worker per allowed request in flight, however many names there are
+    await asyncio.gather(*(worker() for _ in range(min(max_concurrency, len(params_by_key)))))
+    return {key: results[key] for key in params_by_key}
+
+
+def search_all(client, params_by_key, parse=None, max_concurrency=8, rate=None, max_retries=5):
+    # Runs one search per {key: search params} entry concurrently and returns
+    # {key: parse(json response)}, or {key: None} when the search failed
+    if not params_by_key:
+        return {}
+    parse = parse or (lambda json_result: json_result)
+    return asyncio.run(_search_all(client, params_by_key, parse, max_concurrency, rate, max_retries))
+
@@ -0,0 +1,219 @@
+# This module wraps all communication with the Spotify Web API in a single
+# client object. The client keeps one pooled HTTP session for the whole run,
+# so connections (and their TLS handshakes) are reused between requests, and
+# it caches the access token until shortly before it expires. A token that
+# is rejected with 401 is refreshed once and the request is retried.
+# An optional ResponseCache (see response_cache.py) answers repeated
+# requests locally; in offline mode it is the only source of data.
+# The client can hold several client-id/secret pairs. Each pair has its own
+# token and its own rate-limit state, every request is sent with whichever
+# pair has headroom, and a pair that gets throttled (429) is backed off on
+# its own while the others keep working.
+
+import base64
+import os
+import threading
+import time
+
+import requests
+
+
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+API_BASE_URL = "https://api.spotify.com/v1"
+
+# Refresh the token this many seconds before Spotify says it expires
+TOKEN_EXPIRY_MARGIN = 60
+
+
+#Get Token Function
+def request_token(client_id, client_secret, session=None):
+    auth_string = client_id + ":" + client_secret
+
+    # Encode the authentication string to bytes, then to Base64
+    auth_bytes = auth_string.encode("utf-8")
+    auth_base64 = base64.b64encode(auth_bytes).decode("utf-8")
+
+    headers = {
+        "Authorization": "Basic " + auth_base64,
+        "Content-Type": "application/x-www-form-urlencoded"
+    }
+    data = {"grant_type": "client_credentials"}
+
+    # Making the POST request
+    result = (session or requests).post(TOKEN_URL, headers=headers, data=data, timeout=30)
+    if 400 <= result.status_code < 500 and result.status_code != 429:
+        # Wrong or revoked client credentials: no retry can fix that, so this
+        # is not a RequestException that callers would retry
+        raise RuntimeError(f"Spotify rejected the client credentials (status code {result.status_code})")
+    result.raise_for_status()
+    json_result = result.json()
+
+    # Extract the access token and its lifetime (in seconds) from the JSON response
+    return json_result["access_token"], json_result.get("expires_in", 3600)
+
+
+def get_auth_header(token):
+    return {"Authorization": "Bearer " + token}
+
+
+class TokenBucket:
+    # Classic token bucket: `rate` requests per second on average,
+    # with bursts of up to `capacity` requests
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        # Seconds until a token is available, without taking it
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+            return max(wait, self.paused_until - now)
+
+    def reserve(self):
+        # Take one token and return how many seconds the caller must wait
+        # before using it (0 when a token is available right away)
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    def pause(self, seconds):
+        # Stop handing out tokens for a while, e.g. after a 429
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def retry_after_seconds(response, default=1.0):
+    try:
+        return float(response.headers.get("Retry-After", default))
+    except ValueError:
+        return default
+
+
+class Credential:
+    # One client-id/secret pair with its own token and rate limit
+    def __init__(self, client_id, client_secret, rate=10):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.bucket = TokenBucket(rate)
+        self.throttled_count = 0
+
+        self.token = None
+        self.token_expires_at = 0.0
+        self.token_lock = threading.Lock()
+
+    def get_token(self, session, force_refresh=False):
+        # Reuse the cached token until shortly before it expires
+        with self.token_lock:
+            if force_refresh or self.token is None or time.monotonic() >= self.token_expires_at:
+                token, expires_in = request_token(self.client_id, self.client_secret, session)
+                self.token = token
+                self.token_expires_at = time.monotonic() + expires_in - TOKEN_EXPIRY_MARGIN
+            return self.token
+
+    def invalidate_token(self, token):
+        with self.token_lock:
+            if self.token == token:
+                self.token = None
+
+    def back_off(self, seconds):
+        self.throttled_count += 1
+        self.bucket.pause(seconds)
+
+
+def load_credentials():
+    # SPOTIFY_CREDENTIALS holds a comma-separated list of "client_id:client_secret"
+    # pairs; CLIENT_ID/CLIENT_SECRET is still accepted for a single pair
+    credentials = []
+    for pair in os.getenv("SPOTIFY_CREDENTIALS", "").split(","):
+        if ":" in pair:
+            client_id, client_secret = pair.strip().split(":", 1)
+            credentials.append((client_id, client_secret))
+    if os.getenv("CLIENT_ID") and os.getenv("CLIENT_SECRET"):
+        single = (os.getenv("CLIENT_ID"), os.getenv("CLIENT_SECRET"))
+        if single not in credentials:
+            credentials.append(single)
+    return credentials
+
+
+class SpotifyClient:
+    def __init__(self, credentials, pool_size=16, cache=None, rate_per_credential=10,
+                 max_attempts=8):
+        # `credentials` is a list of (client_id, client_secret) pairs
+        self.credentials = [Credential(client_id, client_secret, rate_per_credential)
+                            for client_id, client_secret in credentials]
+        self.cache = cache
+        self.max_attempts = max_attempts
+        self.schedule_lock = threading.Lock()
+
+        # One keep-alive session shared by every request of the run
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, path, params=None):
+        # `path` is relative to the API base, e.g. "search" or "tracks/{id}"
+        if self.cache is not None:
+            cached = self.cache.lookup(path, params)
+            if cached is not None:
+                return cached
+            if self.cache.offline:
+                return self.cache.offline_miss(path, params)
+
+        response = self.fetch(path, params)
+        if self.cache is not None:
+            self.cache.store(path, params, response)
+        return response
+
+    def pick_credential(self):
+        # The credential that can send soonest; its token is reserved right away
+        # so concurrent callers spread over the pool instead of piling onto one
+        if not self.credentials:
+            raise RuntimeError("No Spotify credentials configured")
+        with self.schedule_lock:
+            credential = min(self.credentials, key=lambda c: c.bucket.wait_time())
+            wait = credential.bucket.reserve()
+        return credential, wait
+
+    def fetch(self, path, params=None):
+        url = f"{API_BASE_URL}/{path.lstrip('/')}"
+        throttled = False
+        for attempt in range(self.max_attempts):
+            credential, wait = self.pick_credential()
+            if wait > 0:
+                time.sleep(wait)
+
+            token = credential.get_token(self.session)
+            response = self.session.get(url, params=params, headers=get_auth_header(token), timeout=30)
+            if response.status_code == 401:
+                # The token was revoked or expired early; refresh it once and retry
+                credential.invalidate_token(token)
+                response = self.session.get(url, params=params,
+                                            headers=get_auth_header(credential.get_token(self.session)),
+                                            timeout=30)
+            if response.status_code != 429:
+                break
+            # Only this credential is backed off; the next attempt goes to
+            # whichever credential still has headroom
+            throttled = True
+            credential.back_off(retry_after_seconds(response))
+
+        # Lets callers (e.g. the async resolver) see that Spotify was throttling
+        response.throttled = throttled
+        return response
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+from billboard import parse_saved_pages
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fixture = os.path.join(project_dir, 'tests', 'fixtures', 'billboard_year_end.html')
+
+
+def test_parse_saved_year_end_page():
+    df = parse_saved_pages([fixture], years=[2023])
+    assert df['Rank'].tolist() == [1, 2, 3]
+    assert df['Track_name'].tolist() == ['Last Night', 'Flowers', "Creepin'"]
+    assert df['Artist_name'].tolist() == ['Morgan Wallen', 'Miley Cyrus', 'Metro Boomin, The Weeknd, 21 Savage']
+    assert df['Year'].tolist() == [2023] * 3
+    assert df['Track_key'].tolist() == ['last night', 'flowers', 'creepin']
+
+
+def run_billboard(*args):
+    return subprocess.run([sys.executable, 'billboard.py', *args], cwd=project_dir, capture_output=True, text=True)
+
+
+def test_html_option_writes_csv(tmp_path):
+    output = tmp_path / 'chart.csv'
+    result = run_billboard('--html', fixture, '--years', '2023', '--output', str(output))
+    assert result.returncode == 0, result.stderr
+    assert len(pd.read_csv(output)) == 3
+
+
+def test_no_entries_keeps_previous_file(tmp_path):
+    empty_page = tmp_path / 'empty.html'
+    empty_page.write_text('<html><body><p>Chart unavailable</p></body></html>')
+    output = tmp_path / 'chart.csv'
+    output.write_text('previous scrape\n')
+    result = run_billboard('--html', str(empty_page), '--output', str(output))
+    assert result.returncode == 1
+    assert output.read_text() == 'previous scrape\n'
@@ -0,0 +1,6 @@
+from check_query_plans import check_query_plans
+
+
+def test_no_query_regressed_to_a_full_scan(tmp_path):
+    # No database at the path: the check builds the schema from scratch
+    assert check_query_plans(str(tmp_path / 'project.db')) == []
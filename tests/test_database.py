@@ -0,0 +1,104 @@
+import sqlite3
+
+import database
+import main
+
+
+def make_conn():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE Songs (song_id TEXT PRIMARY KEY, track_name TEXT NOT NULL)")
+    conn.execute("CREATE INDEX idx_songs_track_name ON Songs (track_name)")
+    return conn
+
+
+def test_index_scans_count_as_full_scans():
+    conn = make_conn()
+    assert database.full_table_scans(conn, "SELECT track_name FROM Songs WHERE track_name = ?", ('x',)) == []
+    assert database.full_table_scans(conn, "SELECT * FROM Songs") == ['SCAN Songs']
+    assert database.full_table_scans(conn, "SELECT COUNT(*) FROM Songs") == [
+        'SCAN Songs USING COVERING INDEX idx_songs_track_name']
+
+
+def test_allowed_tables_and_indexes():
+    conn = make_conn()
+    assert database.full_table_scans(conn, "SELECT * FROM Songs s", allowed={'s'}) == []
+    assert database.full_table_scans(conn, "SELECT COUNT(*) FROM Songs", allowed={'idx_songs_track_name'}) == []
+
+
+def test_base_tables_match_aggregates(tmp_path):
+    db_file_path = str(tmp_path / 'project.db')
+    main.create_schema(db_file_path)
+    conn = database.connect(db_file_path)
+    conn.executemany("INSERT INTO Songs (song_id, track_name, release_year, popularity_score, energy) "
+                     "VALUES (?, ?, ?, ?, ?)", [('s1', 'One', 2020, 50, 0.5), ('s2', 'Two', 2021, 70, None)])
+    conn.executemany("INSERT INTO Artists (artist_id, artist_name) VALUES (?, ?)", [('a1', 'A'), ('a2', 'B')])
+    conn.executemany(main.chart_entry_insert_query, [('US', 'hot_100', '2024', 1, 's1', 'a1'),
+                                                     ('US', 'hot_100', '2024', 1, 's1', 'a2'),
+                                                     ('US', 'hot_100', '2024', 2, 's2', 'a2')])
+    conn.commit()
+    assert database.chart_data_source(conn) == 'base tables'
+    base_results = {query: sorted(conn.execute(base_query, ('US',) if '?' in query else ()).fetchall())
+                    for query, base_query in database.base_table_queries.items()}
+
+    main.refresh_market_aggregates(db_file_path)
+    assert database.chart_data_source(conn) == 'aggregates'
+    for query, rows in base_results.items():
+        assert sorted(conn.execute(query, ('US',) if '?' in query else ()).fetchall()) == rows
+    assert base_results[database.market_summary_query] == [(2, 2)]
+    conn.close()
+
+
+def test_no_chart_entries_yet(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'legacy.db'))
+    conn.execute("CREATE TABLE Songs (song_id TEXT PRIMARY KEY, track_name TEXT NOT NULL)")
+    assert database.chart_data_source(conn) is None
+
+
+def test_row_estimate_is_exact_after_a_pipeline_run(tmp_path):
+    db_file_path = str(tmp_path / 'project.db')
+    main.create_schema(db_file_path)
+    conn = database.connect(db_file_path)
+    conn.executemany("INSERT INTO Artists (rowid, artist_id, artist_name) VALUES (?, ?, ?)",
+                     [(1, 'a1', 'A'), (5, 'a2', 'B')])
+    assert database.table_row_estimate(conn, 'Artists') == (5, True)
+    database.refresh_row_counts(conn.cursor())
+    assert database.table_row_estimate(conn, 'Artists') == (2, False)
+    conn.close()
+
+
+def test_no_export_of_the_requested_markets(tmp_path):
+    df = database.load_market_analysis(['track_name', 'energy'], ['UK'], file_path=str(tmp_path / 'missing.parquet'))
+    assert df.empty
+    assert list(df.columns) == ['market', 'track_name', 'energy']
+    assert df['energy'].dtype == 'float64'
+
+
+def test_legacy_tables_match_the_migrated_database(tmp_path):
+    db_file_path = str(tmp_path / 'legacy.db')
+    conn = sqlite3.connect(db_file_path)
+    conn.execute("CREATE TABLE Songs (song_id TEXT PRIMARY KEY, track_name TEXT NOT NULL, release_date TEXT, "
+                 f"popularity_score INTEGER, {', '.join(f'{column} REAL' for column in database.aggregate_feature_columns)})")
+    conn.execute("CREATE TABLE Artists (artist_id TEXT PRIMARY KEY, artist_name TEXT NOT NULL)")
+    for table in database.legacy_market_tables:
+        conn.execute(f"CREATE TABLE {table} (entry_id INTEGER PRIMARY KEY, song_id TEXT, artist_id TEXT)")
+    conn.executemany("INSERT INTO Songs (song_id, track_name, release_date, popularity_score, energy) "
+                     "VALUES (?, ?, ?, ?, ?)", [
+        ('s1', 'One', '2020-12-01', 50, 0.5), ('s2', 'Two', '2021', 70, None), ('s3', 'Three', '1999-04', 60, 0.25)])
+    conn.executemany("INSERT INTO Artists VALUES (?, ?)", [('a1', 'A'), ('a2', 'B')])
+    conn.executemany("INSERT INTO US_Market (song_id, artist_id) VALUES (?, ?)", [('s1', 'a1'), ('s2', 'a2')])
+    conn.executemany("INSERT INTO China_Market (song_id, artist_id) VALUES (?, ?)", [('s3', 'a2')])
+    conn.commit()
+    assert database.chart_data_source(conn) == 'legacy tables'
+    legacy_results = {query: sorted(conn.execute(legacy_query, ('US',) if '?' in query else ()).fetchall())
+                      for query, legacy_query in database.legacy_table_queries.items()}
+    conn.close()
+
+    main.create_schema(db_file_path)
+    conn = database.connect(db_file_path)
+    main.normalize_release_dates_db(conn.cursor())
+    conn.commit()
+    assert database.chart_data_source(conn) == 'base tables'
+    for query, rows in legacy_results.items():
+        assert sorted(conn.execute(database.base_table_queries[query], ('US',) if '?' in query else ()).fetchall()) == rows
+    assert legacy_results[database.season_counts_query] == [('Winter', 1)]
+    conn.close()
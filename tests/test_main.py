@@ -0,0 +1,78 @@
+import sqlite3
+
+import main
+
+
+def test_ignored_entries_use_up_no_entry_ids(tmp_path):
+    db_file_path = str(tmp_path / 'project.db')
+    conn = sqlite3.connect(db_file_path)
+    # Chart_Entries as created by earlier versions, with AUTOINCREMENT
+    conn.execute(main.chart_entries_table.replace('INTEGER PRIMARY KEY', 'INTEGER PRIMARY KEY AUTOINCREMENT'))
+    entry = ('US', 'billboard_hot_100', '2024', 1, 's1', 'a1')
+    conn.execute(main.chart_entry_insert_query, entry)
+    conn.execute(main.chart_entry_insert_query, entry)
+    conn.commit()
+    conn.close()
+
+    main.create_schema(db_file_path)
+    conn = sqlite3.connect(db_file_path)
+    assert 'AUTOINCREMENT' not in conn.execute(
+        "SELECT sql FROM sqlite_master WHERE name = 'Chart_Entries'").fetchone()[0]
+    for _ in range(3):
+        conn.execute(main.chart_entry_insert_query, entry)
+    conn.execute(main.chart_entry_insert_query, entry[:4] + ('s2', 'a1'))
+    assert conn.execute("SELECT entry_id, song_id FROM Chart_Entries ORDER BY entry_id").fetchall() == [
+        (1, 's1'), (2, 's2')]
+    conn.close()
+
+
+def track(name, *artists):
+    return {'id': name, 'name': name, 'artists': [{'id': artist, 'name': artist} for artist in artists]}
+
+
+def test_pick_best_track_needs_the_title():
+    assert main.pick_best_track([track('Someone Like You', 'Adele')], 'Hello', ['Adele']) is None
+    assert main.pick_best_track([track('Someone Like You', 'Adele'), track('Hello - Live', 'Adele')],
+                                'Hello', ['Adele'])['name'] == 'Hello - Live'
+
+
+def test_pick_best_track_needs_a_listed_artist():
+    assert main.pick_best_track([track('Hello', 'Lionel Richie')], 'Hello', ['Adele']) is None
+    assert main.pick_best_track([track('Hello', 'Lionel Richie')], 'Hello', [])['name'] == 'Hello'
+
+
+def test_one_chart_per_toplist(tmp_path):
+    db_file_path = str(tmp_path / 'project.db')
+    main.create_schema(db_file_path)
+    conn = main.database.connect(db_file_path)
+    conn.executemany(main.song_insert_query, [('s1', 'Hello'), ('s2', 'Halo')])
+    conn.executemany(main.artist_insert_query, [('a1', 'Adele'), ('a2', 'Beyonce')])
+    main.save_song_aliases(conn.cursor(), {('Hello', 'Adele'): 's1', ('Halo', 'Beyonce'): 's2'})
+    main.save_aliases(conn.cursor(), 'artist', {'Adele': 'a1', 'Beyonce': 'a2'})
+    conn.commit()
+    csv_file_path = tmp_path / 'toplist.csv'
+    csv_file_path.write_text("Week,Toplist_id,Rank,Track_name,Artist_name\n"
+                             "2024-01-11,1,1,Hello,Adele\n2024-01-11,1,2,Halo,Beyonce\n"
+                             "2024-01-11,2,1,Halo,Beyonce\n")
+
+    assert main.ingest_chart_file(str(csv_file_path), db_file_path, None, 'China', 'toplist', chunksize=2) == 0
+    assert conn.execute("SELECT chart, rank, song_id FROM Chart_Entries ORDER BY chart, rank").fetchall() == [
+        ('toplist_1', 1, 's1'), ('toplist_1', 2, 's2'), ('toplist_2', 1, 's2')]
+    assert conn.execute("SELECT chart, COUNT(*) FROM Chart_Snapshots GROUP BY chart").fetchall() == [
+        ('toplist_1', 2), ('toplist_2', 1)]
+    conn.close()
+
+
+def test_deleted_export_is_written_again(tmp_path, monkeypatch):
+    export_file_path = tmp_path / 'market_analysis.parquet'
+    monkeypatch.setattr(main.database, 'market_analysis_file_path', str(export_file_path))
+    monkeypatch.setattr(main, 'make_client', lambda: None)
+    db_file_path = str(tmp_path / 'project.db')
+    main.run_pipeline(db_file_path, stages=['export'])
+    version = main.database.file_version(str(export_file_path))
+    main.run_pipeline(db_file_path, stages=['export'])
+    assert main.database.file_version(str(export_file_path)) == version
+
+    export_file_path.unlink()
+    main.run_pipeline(db_file_path, stages=['export'])
+    assert export_file_path.exists()
@@ -0,0 +1,20 @@
+from name_index import NameIndex, song_key
+
+
+def test_song_keys_need_a_title_and_an_artist():
+    assert song_key('Hello', 'Adele') == 'hello|adele'
+    assert song_key('晴天', 'Jay Chou') == ''
+    assert song_key('Hello', '') == ''
+    index = NameIndex(group_separator='|')
+    index.add(None, 's1', key='|jay chou')
+    index.add(None, 's2', key='hello|')
+    assert len(index) == 0
+
+
+def test_fuzzy_matches_stay_within_the_artist():
+    index = NameIndex(group_separator='|')
+    index.add(None, 's1', key=song_key('Someone Like You', 'Adele'))
+    index.add(None, 's2', key=song_key('Someone Like Me', 'Other Artist'))
+    assert index.resolve(None, key=song_key('Someone Lik You', 'Adele')) == 's1'
+    assert index.resolve(None, key=song_key('Someone Lik You', 'Other Artist')) is None
+    assert index.resolve(None, key=song_key('Someone Like You', 'Unknown')) is None
@@ -0,0 +1,52 @@
+import os
+import subprocess
+import sys
+
+import pandas as pd
+
+from netease import parse_snapshots, parse_toplist, toplists_to_dataframe
+
+project_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+fixture = os.path.join(project_dir, 'tests', 'fixtures', 'netease_toplist.html')
+
+
+def test_parse_embedded_song_list():
+    songs = parse_snapshots([fixture])[fixture]
+    assert songs == [('Seven (feat. Latto)', 'Jung Kook/Latto'), ('Flowers', 'Miley Cyrus'), ('晴天', '周杰伦')]
+
+
+def test_parse_rendered_song_table():
+    page = '''<table class="m-table"><tbody>
+        <tr><td>1</td><td><div><div><div><span><a><b title="Flowers">Flowers</b></a></span></div></div></div></td>
+            <td>3:20</td><td><div><span title="Miley Cyrus">Miley Cyrus</span></div></td></tr>
+        </tbody></table>'''
+    assert parse_toplist(page) == [('Flowers', 'Miley Cyrus')]
+
+
+def test_snapshot_to_dataframe():
+    df = toplists_to_dataframe(parse_snapshots([fixture]), '2024-01-04')
+    assert df['Rank'].tolist() == [1, 2, 3]
+    assert df['Track_name'].tolist() == ['Seven', 'Flowers', '']
+    assert df['Artist_name'].tolist() == ['Jung Kook, Latto', 'Miley Cyrus', '']
+    assert (df['Week'] == '2024-01-04').all()
+
+
+def run_netease(*args):
+    return subprocess.run([sys.executable, 'netease.py', *args], cwd=project_dir, capture_output=True, text=True)
+
+
+def test_html_option_writes_csv(tmp_path):
+    output = tmp_path / 'toplist.csv'
+    result = run_netease('--html', fixture, '--date', '2024-01-04', '--output', str(output))
+    assert result.returncode == 0, result.stderr
+    assert len(pd.read_csv(output)) == 3
+
+
+def test_no_songs_keeps_previous_file(tmp_path):
+    empty_page = tmp_path / 'empty.html'
+    empty_page.write_text('<html><body><p>Page not found</p></body></html>')
+    output = tmp_path / 'toplist.csv'
+    output.write_text('previous scrape\n')
+    result = run_netease('--html', str(empty_page), '--output', str(output))
+    assert result.returncode == 1
+    assert output.read_text() == 'previous scrape\n'
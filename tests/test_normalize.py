@@ -0,0 +1,19 @@
+import pandas as pd
+
+from normalize import release_date_details
+
+
+def test_release_date_details_by_precision():
+    details = release_date_details(pd.Series(['2020-01-05', '2001-07', '1999']))
+    assert details['release_date_precision'].tolist() == ['day', 'month', 'year']
+    assert details['release_year'].tolist() == [2020, 2001, 1999]
+    assert details['release_season'].tolist()[:2] == ['Winter', 'Summer']
+    assert pd.isna(details['release_season'].iloc[2])
+
+
+def test_release_date_zero_year_is_missing():
+    # Spotify gives '0000' for unknown release dates
+    details = release_date_details(pd.Series(['0000', '2020-01-05', '0000-00-00']), pd.Series(['year', 'day', 'day']))
+    assert details['release_date_parsed'].isna().tolist() == [True, False, True]
+    assert details['release_year'].isna().tolist() == [True, False, True]
+    assert details['release_date_precision'].isna().tolist() == [True, False, True]
@@ -0,0 +1,30 @@
+import time
+
+import pytest
+
+from spotify_async import search_all
+from spotify_client import SpotifyClient
+
+
+class RejectingSession:
+    # The token endpoint answers every request with 400 (invalid_client)
+    def __init__(self):
+        self.token_requests = 0
+
+    def post(self, url, **kwargs):
+        self.token_requests += 1
+        return type('Response', (), {'status_code': 400, 'raise_for_status': lambda self: None})()
+
+    def get(self, url, **kwargs):
+        raise AssertionError('no search is sent without a token')
+
+
+def test_rejected_credentials_end_the_search():
+    client = SpotifyClient([('id', 'wrong secret')])
+    client.session = RejectingSession()
+    params_by_key = {name: {'q': name, 'type': 'track'} for name in 'abcdefghij'}
+    started = time.monotonic()
+    with pytest.raises(RuntimeError, match='rejected the client credentials'):
+        search_all(client, params_by_key)
+    assert time.monotonic() - started < 1
+    assert client.session.token_requests <= 8